@@ -0,0 +1,126 @@
+"""Build the web client's static assets for production
+
+Copies every file under static/ (except the service worker and the build
+output itself) to static/dist/ under a content-hashed name, rewrites url()
+references in stylesheets to the hashed names, writes gzip and (when the
+brotli package is installed) brotli variants next to each compressible file,
+and records the mapping in static/dist/manifest.json. telemain.py links the
+hashed names when the manifest exists and serves them with immutable caching.
+
+Usage: python build_static.py [--static-dir static]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+
+# Optional brotli variants
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+SKIP = {'sw.js'}  # Must keep a stable URL, served as /sw.js
+COMPRESSIBLE = {'.js', '.css', '.svg', '.json', '.txt', '.html', '.ttf', '.map'}
+COMPRESS_MIN_SIZE = 1024
+HASH_LENGTH = 10
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+def list_sources(static_dir):
+    """Relative paths of the files to build, stylesheets last so their url()s can be rewritten"""
+    sources = []
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir:
+            dirs[:] = [d for d in dirs if d != DIST_DIR]
+        for name in files:
+            path = os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, '/')
+            if path not in SKIP and not name.startswith('.'):
+                sources.append(path)
+    return sorted(sources, key=lambda path: (path.endswith('.css'), path))
+
+def hashed_name(path, data):
+    """app.css -> app.<hash>.css (the last suffix keeps its place, so all.min.css -> all.min.<hash>.css)"""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+def rewrite_css(path, data, manifest):
+    """Point url() references at the hashed names of the files they load"""
+    base = os.path.dirname(path)
+
+    def replace(match):
+        quote, target = match.group(1), match.group(2)
+        if re.match(r'^([a-z]+:|/|#)', target):
+            return match.group(0)
+        clean, sep, suffix = re.match(r'([^?#]*)([?#]?)(.*)', target).groups()
+        resolved = os.path.normpath(os.path.join(base, clean)).replace(os.sep, '/')
+        if resolved not in manifest:
+            return match.group(0)
+        relative = os.path.relpath(manifest[resolved], base or '.').replace(os.sep, '/')
+        return f"url({quote}{relative}{sep}{suffix}{quote})"
+
+    return CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+def write_variants(target, data):
+    """Write a file plus its precompressed variants; returns the bytes written"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data)
+    written = len(data)
+    if os.path.splitext(target)[1] not in COMPRESSIBLE or len(data) < COMPRESS_MIN_SIZE:
+        return written
+    # mtime=0 keeps builds reproducible
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data):
+        with open(target + '.gz', 'wb') as f:
+            f.write(compressed)
+        written += len(compressed)
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            with open(target + '.br', 'wb') as f:
+                f.write(compressed)
+            written += len(compressed)
+    return written
+
+def build(static_dir):
+    """Rebuild static/dist and its manifest; returns the manifest"""
+    dist = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    manifest = {}
+    total = 0
+    for path in list_sources(static_dir):
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            data = f.read()
+        if path.endswith('.css'):
+            data = rewrite_css(path, data, manifest)
+        manifest[path] = hashed_name(path, data)
+        total += write_variants(os.path.join(dist, manifest[path]), data)
+    with open(os.path.join(dist, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    logger.info(
+        f"Built {len(manifest)} assets ({total / 1024:.0f} KB with compressed variants) into {dist}"
+        f"{'' if brotli else ' (brotli not installed, gzip only)'}"
+    )
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress the web client's static assets")
+    parser.add_argument('--static-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.static_dir):
+        logger.error(f"Static directory not found: {args.static_dir}")
+        return 1
+    build(args.static_dir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,26 @@
 import telebot
 import os
+import json
+import hashlib
 import logging
 import time
-import asyncio
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+import threading
+import fnmatch
+import tempfile
+import zipfile
+from contextlib import ExitStack
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InputMediaVideo
 from threading import Thread
 
+# Optional filesystem watcher for /sync (periodic checks only without it)
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 
@@ -20,6 +35,28 @@ ROOT_DIR = "/storage/emulated/0/DCIM"
 IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp']
 VIDEO_EXTENSIONS = ['mp4', 'mov', 'mkv', 'avi', 'wmv', 'flv', 'webm']
 
+# Folder sync: what each chat already received, so only new or changed media is sent
+SYNC_STATE_FILE = os.getenv('SYNC_STATE_FILE', 'sync_state.json')
+SYNC_POLL_INTERVAL = 30  # Seconds between checks; a folder whose mtime did not change is skipped
+SYNC_RESCAN_INTERVAL = 600  # Full rescan even if the folder looks unchanged (files changed in place, missed events)
+SYNC_SETTLE_SECONDS = 5  # Files modified more recently may still be being written
+SYNC_BATCH_SIZE = 10  # Files per media group (Telegram's maximum)
+SYNC_BATCH_DELAY = 1  # Seconds between batches
+SYNC_RETRY_DELAY = 60  # Seconds before a failed file is retried, doubled after each failure
+SYNC_MAX_ATTEMPTS = 5  # A file that failed this often is given up on until it changes
+PHOTO_MAX_BYTES = 10 * 1024 * 1024  # Larger images are sent as documents
+UPLOAD_MAX_BYTES = 50 * 1024 * 1024  # Bot API upload limit; larger files are never sent
+
+# Folder navigation
+MAX_FOLDER_BUTTONS = 40  # Subfolder buttons per view (Telegram allows 100 buttons per keyboard)
+BREADCRUMB_DEPTH = 3  # Parent folders shown as buttons next to the root
+
+# Basket: files picked across folders and delivered as one job
+FILE_ID_CACHE_FILE = os.getenv('FILE_ID_CACHE_FILE', 'file_ids.json')
+SELECT_PAGE_SIZE = 10  # File buttons per page of the selection keyboard
+ARCHIVE_PART_BYTES = 45 * 1024 * 1024  # Bots can upload at most 50 MB per file
+PROGRESS_EDIT_INTERVAL = 3  # Seconds between edits of the progress message
+
 # Helper: sanitize folder names
 def safe_join(base, *paths):
     final_path = os.path.abspath(os.path.join(base, *paths))
@@ -41,37 +78,140 @@ def get_file_type(filename):
         return 'video'
     return 'other'
 
+# Helper: human readable size
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+# Folder statistics: path -> (mtime_ns, files, bytes, subfolder paths) for the folder's own entries.
+# Adding, removing or renaming an entry changes the folder's mtime, so an entry stays valid until then.
+dir_stats_cache = {}
+
+def scan_dir_stats(path):
+    """One scandir pass over a folder, reused until the folder's mtime changes"""
+    mtime_ns = os.stat(path).st_mtime_ns
+    cached = dir_stats_cache.get(path)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached
+    files = size = 0
+    subfolders = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    files += 1
+                    size += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+    cached = (mtime_ns, files, size, sorted(subfolders, key=str.lower))
+    dir_stats_cache[path] = cached
+    return cached
+
+def folder_stats(path):
+    """Total file count and size under a folder; unchanged subfolders cost one stat each"""
+    files = size = 0
+    stack = [path]
+    while stack:
+        try:
+            _, own_files, own_size, subfolders = scan_dir_stats(stack.pop())
+        except OSError:
+            continue
+        files += own_files
+        size += own_size
+        stack.extend(subfolders)
+    return files, size
+
+# Callback data is limited to 64 bytes, so buttons carry a short token instead of the folder path
+path_tokens = {}  # token -> folder path relative to ROOT_DIR
+
+def path_token(folder):
+    token = hashlib.sha1(folder.encode('utf-8')).hexdigest()[:12]
+    path_tokens[token] = folder
+    return token
+
+def resolve_token(token):
+    if token not in path_tokens:
+        # Buttons from before a restart: tokens are stable, so index the tree again
+        stack = [ROOT_DIR]
+        while stack and token not in path_tokens:
+            try:
+                subfolders = scan_dir_stats(stack.pop())[3]
+            except OSError:
+                continue
+            for path in subfolders:
+                path_token(os.path.relpath(path, ROOT_DIR).replace(os.sep, '/'))
+            stack.extend(subfolders)
+    if token not in path_tokens:
+        raise ValueError("Folder not found, send /folders again.")
+    return path_tokens[token]
+
+def add_folder_buttons(markup, folder):
+    """One button per subfolder with its file count and size; returns how many subfolders there are"""
+    subfolders = scan_dir_stats(safe_join(ROOT_DIR, folder))[3]
+    for path in subfolders[:MAX_FOLDER_BUTTONS]:
+        name = os.path.basename(path)
+        files, size = folder_stats(path)
+        markup.add(InlineKeyboardButton(
+            f"📁 {name} · {files} files · {format_size(size)}",
+            callback_data=f"list::{path_token(f'{folder}/{name}' if folder else name)}"
+        ))
+    return len(subfolders)
+
+def root_folders_view():
+    markup = InlineKeyboardMarkup()
+    count = add_folder_buttons(markup, '')
+    if not count:
+        return "❌ No folders found.", None
+    reply = "📁 *Available folders:*"
+    if count > MAX_FOLDER_BUTTONS:
+        reply += f"\n... and {count - MAX_FOLDER_BUTTONS} more"
+    return reply, markup
+
+def add_breadcrumbs(markup, folder):
+    """Root button plus the closest parent folders, on one row"""
+    parts = folder.split('/')
+    buttons = [InlineKeyboardButton(f"🏠 {os.path.basename(ROOT_DIR) or 'Root'}", callback_data="back_to_folders")]
+    start = max(0, len(parts) - 1 - BREADCRUMB_DEPTH)
+    if start:
+        buttons.append(InlineKeyboardButton("…", callback_data=f"list::{path_token('/'.join(parts[:start]))}"))
+    for i in range(start, len(parts) - 1):
+        buttons.append(InlineKeyboardButton(parts[i], callback_data=f"list::{path_token('/'.join(parts[:i + 1]))}"))
+    markup.row(*buttons)
+
 # Start or show folders
 @bot.message_handler(commands=['start', 'folders'])
 def send_folders(message):
     try:
-        folders = [f for f in os.listdir(ROOT_DIR) if os.path.isdir(os.path.join(ROOT_DIR, f))]
-        if not folders:
-            bot.reply_to(message, "❌ No folders found.")
+        reply, markup = root_folders_view()
+        if markup is None:
+            bot.reply_to(message, reply)
             return
-        markup = InlineKeyboardMarkup()
-        for folder in folders:
-            markup.add(InlineKeyboardButton(f"📁 {folder}", callback_data=f"list::{folder}"))
-        bot.send_message(message.chat.id, "📁 *Available folders:*", reply_markup=markup, parse_mode="Markdown")
+        bot.send_message(message.chat.id, reply, reply_markup=markup, parse_mode="Markdown")
     except Exception as e:
         bot.reply_to(message, f"Error: {e}")
 
 # Callback to list files in folder with media preview options
 @bot.callback_query_handler(func=lambda call: call.data.startswith("list::"))
 def handle_list_callback(call):
-    folder = call.data.split("::")[1]
     try:
+        folder = resolve_token(call.data.split("::")[1])
         folder_path = safe_join(ROOT_DIR, folder)
-        files = os.listdir(folder_path)
-        if not files:
-            bot.send_message(call.message.chat.id, "📂 No files in this folder.")
-            return
+        token = path_token(folder)
+        total_files, total_size = folder_stats(folder_path)
+        files = [f for f in os.listdir(folder_path) if not os.path.isdir(os.path.join(folder_path, f))]
         
         # Separate media and other files
         media_files = [f for f in files if is_media_file(f)]
         other_files = [f for f in files if not is_media_file(f)]
         
-        reply = f"📷 *Files in {folder}:*\n\n"
+        reply = f"📷 *Files in {folder}:*\n"
+        reply += f"📊 {total_files} files · {format_size(total_size)} including subfolders\n\n"
+        if not files:
+            reply += "📂 No files directly in this folder.\n"
         
         if media_files:
             reply += f"🎬 *Media files ({len(media_files)}):*\n"
@@ -88,14 +228,24 @@ def handle_list_callback(call):
             if len(other_files) > 5:
                 reply += f"... and {len(other_files) - 5} more\n"
         
-        # Add action buttons
+        # Add breadcrumbs, subfolders and action buttons
         markup = InlineKeyboardMarkup()
+        add_breadcrumbs(markup, folder)
+        subfolder_count = add_folder_buttons(markup, folder)
+        if subfolder_count > MAX_FOLDER_BUTTONS:
+            reply += f"\n📁 ... and {subfolder_count - MAX_FOLDER_BUTTONS} more subfolders\n"
         if media_files:
-            markup.add(InlineKeyboardButton("🎬 Show All Media (Fast)", callback_data=f"showmedia::{folder}"))
-            markup.add(InlineKeyboardButton("📸 Images Only", callback_data=f"images::{folder}"))
-            markup.add(InlineKeyboardButton("🎥 Videos Only", callback_data=f"videos::{folder}"))
-        markup.add(InlineKeyboardButton("📋 List All Files", callback_data=f"listall::{folder}"))
-        markup.add(InlineKeyboardButton("🔙 Back to Folders", callback_data="back_to_folders"))
+            markup.add(InlineKeyboardButton("🎬 Show All Media (Fast)", callback_data=f"showmedia::{token}"))
+            markup.add(InlineKeyboardButton("📸 Images Only", callback_data=f"images::{token}"))
+            markup.add(InlineKeyboardButton("🎥 Videos Only", callback_data=f"videos::{token}"))
+        if files:
+            markup.add(InlineKeyboardButton("📋 List All Files", callback_data=f"listall::{token}"))
+            markup.add(InlineKeyboardButton("🧺 Select Files", callback_data=f"sel::{token}::0"))
+        parent = folder.rsplit('/', 1)[0] if '/' in folder else None
+        if parent is None:
+            markup.add(InlineKeyboardButton("🔙 Back to Folders", callback_data="back_to_folders"))
+        else:
+            markup.add(InlineKeyboardButton("🔙 Up", callback_data=f"list::{path_token(parent)}"))
         
         bot.edit_message_text(reply, call.message.chat.id, call.message.message_id, 
                             reply_markup=markup, parse_mode="Markdown")
@@ -104,8 +254,8 @@ def handle_list_callback(call):
 # Show all media files quickly
 @bot.callback_query_handler(func=lambda call: call.data.startswith("showmedia::"))
 def show_all_media(call):
-    folder = call.data.split("::")[1]
     try:
+        folder = resolve_token(call.data.split("::")[1])
         folder_path = safe_join(ROOT_DIR, folder)
         files = [f for f in os.listdir(folder_path) if is_media_file(f)]
         
@@ -126,8 +276,8 @@ def show_all_media(call):
 # Show only images
 @bot.callback_query_handler(func=lambda call: call.data.startswith("images::"))
 def show_images(call):
-    folder = call.data.split("::")[1]
     try:
+        folder = resolve_token(call.data.split("::")[1])
         folder_path = safe_join(ROOT_DIR, folder)
         files = [f for f in os.listdir(folder_path) if get_file_type(f) == 'image']
         
@@ -147,8 +297,8 @@ def show_images(call):
 # Show only videos
 @bot.callback_query_handler(func=lambda call: call.data.startswith("videos::"))
 def show_videos(call):
-    folder = call.data.split("::")[1]
     try:
+        folder = resolve_token(call.data.split("::")[1])
         folder_path = safe_join(ROOT_DIR, folder)
         files = [f for f in os.listdir(folder_path) if get_file_type(f) == 'video']
         
@@ -168,15 +318,15 @@ def show_videos(call):
 # List all files callback
 @bot.callback_query_handler(func=lambda call: call.data.startswith("listall::"))
 def list_all_files(call):
-    folder = call.data.split("::")[1]
     try:
+        folder = resolve_token(call.data.split("::")[1])
         folder_path = safe_join(ROOT_DIR, folder)
-        files = os.listdir(folder_path)
+        files = folder_files(folder_path)
         if not files:
             bot.send_message(call.message.chat.id, "📂 No files in this folder.")
             return
         
-        reply = f"📋 *All files in {folder}:*\n\n"
+        reply = f"📋 *All files in {folder}:*\nPick by number with `/select {folder} 1-20`\n\n"
         for i, f in enumerate(files, 1):
             file_type = get_file_type(f)
             if file_type == 'image':
@@ -201,14 +351,11 @@ def list_all_files(call):
 @bot.callback_query_handler(func=lambda call: call.data == "back_to_folders")
 def back_to_folders(call):
     try:
-        folders = [f for f in os.listdir(ROOT_DIR) if os.path.isdir(os.path.join(ROOT_DIR, f))]
-        if not folders:
-            bot.edit_message_text("❌ No folders found.", call.message.chat.id, call.message.message_id)
+        reply, markup = root_folders_view()
+        if markup is None:
+            bot.edit_message_text(reply, call.message.chat.id, call.message.message_id)
             return
-        markup = InlineKeyboardMarkup()
-        for folder in folders:
-            markup.add(InlineKeyboardButton(f"📁 {folder}", callback_data=f"list::{folder}"))
-        bot.edit_message_text("📁 *Available folders:*", call.message.chat.id, call.message.message_id,
+        bot.edit_message_text(reply, call.message.chat.id, call.message.message_id,
                             reply_markup=markup, parse_mode="Markdown")
     except Exception as e:
         bot.send_message(call.message.chat.id, f"Error: {e}")
@@ -253,6 +400,743 @@ def send_media_files(chat_id, folder_path, files):
     except Exception as e:
         bot.send_message(chat_id, f"❌ Error during bulk send: {e}")
 
+# Folder sync state: {chat id: {folder: {'active': bool, 'delivered': {file name: [size, mtime_ns]},
+#                                       'failed': {file name: [size, mtime_ns, attempts, retry at or None]}}}}
+sync_state = {}
+sync_lock = threading.Lock()
+sync_wakeup = threading.Event()
+sync_dirty = set()  # Folder paths the watcher saw change
+sync_forced = set()  # (chat id, folder) pairs to scan on the next pass whatever their mtime
+folder_marks = {}  # folder path -> (mtime_ns at the last complete scan, time of the last full scan)
+retry_due = {}  # folder path -> earliest time a failed file of it is retried
+folder_observer = None
+watched_folders = set()
+
+def load_sync_state():
+    global sync_state
+    try:
+        with open(SYNC_STATE_FILE) as f:
+            sync_state = json.load(f)
+    except FileNotFoundError:
+        sync_state = {}
+    except Exception as e:
+        logging.error(f"Could not read {SYNC_STATE_FILE}: {e}")
+        sync_state = {}
+
+def save_sync_state():
+    """Write the sync state atomically (call with sync_lock held)"""
+    tmp_path = SYNC_STATE_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(sync_state, f)
+    os.replace(tmp_path, SYNC_STATE_FILE)
+
+# Helper: media files in a folder with their size and mtime, in one scandir pass
+def scan_media(folder_path):
+    """Returns ({name: [size, mtime_ns]}, whether some files were too fresh to include)"""
+    files = {}
+    unsettled = False
+    cutoff = time.time_ns() - SYNC_SETTLE_SECONDS * 1_000_000_000
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.is_file() or not is_media_file(entry.name):
+                continue
+            stat = entry.stat()
+            if stat.st_mtime_ns > cutoff:
+                unsettled = True
+                continue
+            files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return files, unsettled
+
+# Helper: call the Bot API, waiting out flood limits
+def call_with_retry(func, *args, **kwargs):
+    for attempt in range(3):
+        try:
+            return func(*args, **kwargs)
+        except ApiTelegramException as e:
+            retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after')
+            if e.error_code != 429 or not retry_after or attempt == 2:
+                raise
+            logging.warning(f"Flood limit, waiting {retry_after}s")
+            time.sleep(retry_after)
+
+# Uploaded files are resent by file_id: path -> [size, mtime_ns, kind, file_id]
+file_id_cache = {}
+file_id_lock = threading.Lock()
+
+def load_file_id_cache():
+    global file_id_cache
+    try:
+        with open(FILE_ID_CACHE_FILE) as f:
+            file_id_cache = json.load(f)
+    except FileNotFoundError:
+        file_id_cache = {}
+    except Exception as e:
+        logging.error(f"Could not read {FILE_ID_CACHE_FILE}: {e}")
+        file_id_cache = {}
+
+def save_file_id_cache():
+    with file_id_lock:
+        tmp_path = FILE_ID_CACHE_FILE + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(file_id_cache, f)
+        os.replace(tmp_path, FILE_ID_CACHE_FILE)
+
+def cached_upload(file_path):
+    """(kind, file_id) of an earlier upload of this exact file, or None"""
+    entry = file_id_cache.get(file_path)
+    if entry is None:
+        return None
+    stat = os.stat(file_path)
+    if entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+        return None
+    return entry[2], entry[3]
+
+def remember_upload(file_path, kind, sent_message):
+    media = sent_message.photo[-1] if kind == 'photo' else getattr(sent_message, kind, None)
+    if media is None:
+        return
+    stat = os.stat(file_path)
+    with file_id_lock:
+        file_id_cache[file_path] = [stat.st_size, stat.st_mtime_ns, kind, media.file_id]
+
+# Helper: how a file is sent ('photo', 'video' or 'document')
+def send_kind(file_path):
+    cached = cached_upload(file_path)
+    if cached is not None:
+        return cached[0]
+    file_type = get_file_type(file_path)
+    if file_type == 'image' and os.path.getsize(file_path) <= PHOTO_MAX_BYTES:
+        return 'photo'
+    return 'video' if file_type == 'video' else 'document'
+
+def file_caption(file_path):
+    icons = {'image': "📸", 'video': "🎥"}
+    return f"{icons.get(get_file_type(file_path), '📄')} {os.path.basename(file_path)}"
+
+def send_single_file(chat_id, file_path):
+    """Send one file, by file_id when it was uploaded before; returns True if the upload was skipped"""
+    kind = send_kind(file_path)
+    cached = cached_upload(file_path)
+    send = {'photo': bot.send_photo, 'video': bot.send_video, 'document': bot.send_document}[kind]
+    if cached is not None:
+        call_with_retry(send, chat_id, cached[1], caption=file_caption(file_path))
+        return True
+    with open(file_path, 'rb') as f:
+        sent_message = call_with_retry(send, chat_id, f, caption=file_caption(file_path))
+    remember_upload(file_path, kind, sent_message)
+    return False
+
+def deliver_batch(chat_id, file_paths):
+    """Send up to 10 files as one media group; returns (paths sent, how many reused an earlier upload)"""
+    kinds = {path: send_kind(path) for path in file_paths}
+    reused = sum(1 for path in file_paths if cached_upload(path) is not None)
+    if len(file_paths) > 1 and 'document' not in kinds.values():
+        try:
+            with ExitStack() as stack:
+                media = []
+                for path in file_paths:
+                    cached = cached_upload(path)
+                    source = cached[1] if cached is not None else stack.enter_context(open(path, 'rb'))
+                    media_type = InputMediaPhoto if kinds[path] == 'photo' else InputMediaVideo
+                    media.append(media_type(source, caption=file_caption(path)))
+                sent_messages = call_with_retry(bot.send_media_group, chat_id, media)
+            for path, sent_message in zip(file_paths, sent_messages):
+                remember_upload(path, kinds[path], sent_message)
+            return list(file_paths), reused
+        except Exception as e:
+            logging.error(f"Media group to {chat_id} failed, sending files one by one: {e}")
+    sent = []
+    reused = 0
+    for path in file_paths:
+        try:
+            reused += send_single_file(chat_id, path)
+            sent.append(path)
+        except Exception as e:
+            logging.error(f"Error sending {path} to {chat_id}: {e}")
+    return sent, reused
+
+def sync_folder(chat_id, folder, files):
+    """Send one chat the files it has not received yet (or that changed since)
+
+    Returns {'sent': count, 'failed': names that failed for the first time,
+    'gave_up': names given up on, 'too_large': names over the upload limit,
+    'retry_at': when the next failed file is due, or None}.
+    """
+    folder_path = safe_join(ROOT_DIR, folder)
+    now = time.time()
+    report = {'sent': 0, 'failed': [], 'gave_up': [], 'too_large': [], 'retry_at': None}
+    with sync_lock:
+        subscription = sync_state.get(chat_id, {}).get(folder, {})
+        delivered = dict(subscription.get('delivered', {}))
+        failures = dict(subscription.get('failed', {}))
+    pending = []
+    for name, stat in files.items():
+        if delivered.get(name) == stat:
+            continue
+        failure = failures.get(name)
+        if failure is not None and failure[:2] == stat:
+            # Same file that failed before: wait for its retry time, or forever once given up on
+            if failure[3] is None:
+                continue
+            if failure[3] > now:
+                report['retry_at'] = min(report['retry_at'] or failure[3], failure[3])
+                continue
+        pending.append(name)
+    pending.sort(key=lambda name: files[name][1])  # Oldest first, like the camera roll
+    too_large = [name for name in pending if files[name][0] > UPLOAD_MAX_BYTES]
+    pending = [name for name in pending if files[name][0] <= UPLOAD_MAX_BYTES]
+    new_failures = {name: [*files[name], SYNC_MAX_ATTEMPTS, None] for name in too_large}
+    report['too_large'] = too_large
+    if pending:
+        logging.info(f"Syncing {len(pending)} files from {folder} to {chat_id}")
+    for i in range(0, len(pending), SYNC_BATCH_SIZE):
+        batch = pending[i:i + SYNC_BATCH_SIZE]
+        sent_paths, _ = deliver_batch(int(chat_id), [os.path.join(folder_path, name) for name in batch])
+        sent = [os.path.basename(path) for path in sent_paths]
+        for name in batch:
+            if name in sent:
+                continue
+            failure = failures.get(name)
+            attempts = (failure[2] if failure is not None and failure[:2] == files[name] else 0) + 1
+            if attempts >= SYNC_MAX_ATTEMPTS:
+                new_failures[name] = [*files[name], attempts, None]
+                report['gave_up'].append(name)
+            else:
+                retry_at = time.time() + SYNC_RETRY_DELAY * 2 ** (attempts - 1)
+                new_failures[name] = [*files[name], attempts, retry_at]
+                report['retry_at'] = min(report['retry_at'] or retry_at, retry_at)
+                if attempts == 1:
+                    report['failed'].append(name)
+        with sync_lock:
+            subscription = sync_state.get(chat_id, {}).get(folder)
+            if subscription is None or not subscription['active']:
+                report['sent'] += len(sent)
+                return report  # Unsubscribed while sending
+            subscription['delivered'].update({name: files[name] for name in sent})
+            failed = subscription.setdefault('failed', {})
+            for name in sent:
+                failed.pop(name, None)
+            failed.update(new_failures)
+            save_sync_state()
+        new_failures = {}
+        report['sent'] += len(sent)
+        time.sleep(SYNC_BATCH_DELAY)
+    if new_failures:
+        with sync_lock:
+            subscription = sync_state.get(chat_id, {}).get(folder)
+            if subscription is not None:
+                subscription.setdefault('failed', {}).update(new_failures)
+                save_sync_state()
+    if pending:
+        save_file_id_cache()
+    return report
+
+def sync_summary(folder, report):
+    """Chat message for a sync pass; each failure is reported once, or None if there is nothing to say"""
+    lines = []
+    if report['sent']:
+        lines.append(f"🔄 *{folder}:* {report['sent']} new file{'s' if report['sent'] != 1 else ''} synced")
+    if report['failed']:
+        lines.append(f"❌ {len(report['failed'])} failed, retrying later")
+    if report['gave_up']:
+        lines.append(f"🚫 Gave up on {len(report['gave_up'])} after {SYNC_MAX_ATTEMPTS} tries: "
+                     + ", ".join(f"`{name}`" for name in report['gave_up'][:5]))
+    if report['too_large']:
+        lines.append(f"⚠️ Over the {UPLOAD_MAX_BYTES // (1024 * 1024)} MB upload limit, not sent: "
+                     + ", ".join(f"`{name}`" for name in report['too_large'][:5]))
+    if lines and not report['sent']:
+        lines.insert(0, f"🔄 *{folder}:*")
+    return "\n".join(lines) or None
+
+def run_sync_pass(forced=()):
+    """Check every subscribed folder once; folders whose mtime did not change are skipped"""
+    with sync_lock:
+        subscriptions = [
+            (chat_id, folder)
+            for chat_id, folders in sync_state.items()
+            for folder, subscription in folders.items()
+            if subscription['active']
+        ]
+        dirty = set(sync_dirty)
+        sync_dirty.clear()
+    scans = {}
+    retries = {}  # Folder path -> next retry time, for the folders scanned in this pass
+    now = time.time()
+    for chat_id, folder in subscriptions:
+        try:
+            folder_path = safe_join(ROOT_DIR, folder)
+            if folder_path not in scans:
+                mtime_ns = os.stat(folder_path).st_mtime_ns
+                mark = folder_marks.get(folder_path)
+                changed = (
+                    mark is None or mark[0] != mtime_ns or now - mark[1] >= SYNC_RESCAN_INTERVAL
+                    or folder_path in dirty or (chat_id, folder) in forced
+                    or retry_due.get(folder_path, now + 1) <= now
+                )
+                scans[folder_path] = scan_media(folder_path) if changed else None
+                if changed:
+                    files, unsettled = scans[folder_path]
+                    # Unsettled files are picked up by the next pass even if the folder mtime stays put
+                    folder_marks[folder_path] = (None if unsettled else mtime_ns, now)
+                    retries[folder_path] = None
+            elif (chat_id, folder) in forced and scans[folder_path] is None:
+                scans[folder_path] = scan_media(folder_path)
+                retries.setdefault(folder_path, None)
+            if scans[folder_path] is None:
+                continue
+            report = sync_folder(chat_id, folder, scans[folder_path][0])
+            if report['retry_at']:
+                retries[folder_path] = min(retries.get(folder_path) or report['retry_at'], report['retry_at'])
+            summary = sync_summary(folder, report)
+            if summary:
+                bot.send_message(int(chat_id), summary, parse_mode="Markdown")
+        except Exception as e:
+            logging.error(f"Sync of {folder} to {chat_id} failed: {e}")
+    for folder_path, retry_at in retries.items():
+        if retry_at is None:
+            retry_due.pop(folder_path, None)
+        else:
+            retry_due[folder_path] = retry_at
+
+def sync_loop():
+    forced = set()
+    while True:
+        try:
+            run_sync_pass(forced)
+        except Exception as e:
+            logging.error(f"Sync pass failed: {e}")
+        sync_wakeup.wait(SYNC_POLL_INTERVAL)
+        sync_wakeup.clear()
+        with sync_lock:
+            forced = set(sync_forced)
+            sync_forced.clear()
+
+class FolderChangeHandler(FileSystemEventHandler):
+    """Wakes the sync loop when something changes in a synced folder"""
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        with sync_lock:
+            sync_dirty.add(self.folder_path)
+        sync_wakeup.set()
+
+def watch_folder(folder_path):
+    if folder_observer is None or folder_path in watched_folders:
+        return
+    try:
+        folder_observer.schedule(FolderChangeHandler(folder_path), folder_path, recursive=False)
+        watched_folders.add(folder_path)
+    except Exception as e:
+        logging.error(f"Cannot watch {folder_path}, relying on periodic checks: {e}")
+
+def start_folder_sync():
+    """Load the sync state and start the sync thread (and the watcher when watchdog is installed)"""
+    global folder_observer
+    load_sync_state()
+    load_file_id_cache()
+    if Observer is not None:
+        folder_observer = Observer()
+        folder_observer.daemon = True
+        folder_observer.start()
+        for folders in sync_state.values():
+            for folder, subscription in folders.items():
+                if subscription['active']:
+                    watch_folder(safe_join(ROOT_DIR, folder))
+    Thread(target=sync_loop, daemon=True).start()
+
+# Subscribe a chat to a folder
+@bot.message_handler(commands=['sync'])
+def sync_command(message):
+    chat_id = str(message.chat.id)
+    try:
+        parts = message.text.split(maxsplit=1)
+        if len(parts) == 1:
+            with sync_lock:
+                folders = {f: s for f, s in sync_state.get(chat_id, {}).items() if s['active']}
+            if not folders:
+                bot.reply_to(message, "Usage: /sync FOLDER\nNo folders are synced to this chat.")
+                return
+            reply = "🔄 *Synced folders:*\n\n"
+            for folder, subscription in folders.items():
+                reply += f"📁 {folder} - {len(subscription['delivered'])} files delivered\n"
+            bot.reply_to(message, reply, parse_mode="Markdown")
+            return
+        folder = parts[1].strip()
+        folder_path = safe_join(ROOT_DIR, folder)
+        if not os.path.isdir(folder_path):
+            bot.reply_to(message, "❌ Folder not found.")
+            return
+        with sync_lock:
+            subscription = sync_state.setdefault(chat_id, {}).setdefault(folder, {'active': True, 'delivered': {}})
+            subscription['active'] = True
+            subscription.pop('failed', None)  # Subscribing again retries files that were given up on
+            save_sync_state()
+            sync_forced.add((chat_id, folder))
+            delivered = len(subscription['delivered'])
+        watch_folder(folder_path)
+        sync_wakeup.set()
+        reply = f"🔄 *Syncing {folder}*\nNew and changed media will be sent here automatically."
+        if delivered:
+            reply += f"\n{delivered} files were already delivered and will not be sent again."
+        bot.reply_to(message, reply, parse_mode="Markdown")
+    except Exception as e:
+        bot.reply_to(message, f"Error: {e}")
+
+# Stop syncing a folder (what was delivered is remembered for a later /sync)
+@bot.message_handler(commands=['unsync'])
+def unsync_command(message):
+    chat_id = str(message.chat.id)
+    try:
+        folder = message.text.split(maxsplit=1)[1].strip()
+        with sync_lock:
+            subscription = sync_state.get(chat_id, {}).get(folder)
+            if subscription is None or not subscription['active']:
+                bot.reply_to(message, "❌ This folder is not synced here.")
+                return
+            subscription['active'] = False
+            save_sync_state()
+        bot.reply_to(message, f"⏹️ Stopped syncing {folder}", parse_mode="Markdown")
+    except IndexError:
+        bot.reply_to(message, "Usage: /unsync FOLDER")
+    except Exception as e:
+        bot.reply_to(message, f"Error: {e}")
+
+# Baskets: chat id -> {file path relative to ROOT_DIR: None}, kept in the order files were picked
+baskets = {}
+basket_lock = threading.Lock()
+basket_jobs = {}  # chat id -> running delivery thread
+
+# Helper: files (not folders) of a folder in a stable order, as numbered by listall and /select
+def folder_files(folder_path):
+    return sorted(
+        (entry.name for entry in os.scandir(folder_path) if entry.is_file()),
+        key=str.lower
+    )
+
+# Helper: basket key of a file, its normalized path relative to ROOT_DIR
+def basket_key(folder, name):
+    return os.path.relpath(safe_join(ROOT_DIR, folder, name), ROOT_DIR).replace(os.sep, '/')
+
+def basket_add(chat_id, folder, names):
+    """Returns how many files were new to the basket"""
+    keys = [basket_key(folder, name) for name in names]
+    with basket_lock:
+        basket = baskets.setdefault(chat_id, {})
+        before = len(basket)
+        for key in keys:
+            basket[key] = None
+        return len(basket) - before
+
+def basket_size(chat_id):
+    with basket_lock:
+        return len(baskets.get(chat_id, {}))
+
+def parse_selection(spec, files):
+    """Names picked by '1-20', '5', '*.mp4', 'images', 'videos' or 'all' (space or comma separated)"""
+    picked = {}
+    for part in spec.replace(',', ' ').split():
+        if part == 'all':
+            picked.update(dict.fromkeys(files))
+        elif part in ('images', 'videos'):
+            picked.update(dict.fromkeys(f for f in files if get_file_type(f) == part[:-1]))
+        elif part.replace('-', '').isdigit():
+            first, _, last = part.partition('-')
+            first, last = int(first), int(last or first)
+            if first < 1 or last < first:
+                raise ValueError(f"Invalid range: {part}")
+            picked.update(dict.fromkeys(files[first - 1:last]))
+        else:
+            picked.update(dict.fromkeys(fnmatch.filter(files, part)))
+    return list(picked)
+
+def selection_view(chat_id, folder, page):
+    """Toggle buttons for one page of a folder's files"""
+    folder_path = safe_join(ROOT_DIR, folder)
+    files = folder_files(folder_path)
+    token = path_token(folder)
+    pages = max(1, (len(files) + SELECT_PAGE_SIZE - 1) // SELECT_PAGE_SIZE)
+    page = min(max(page, 0), pages - 1)
+    with basket_lock:
+        basket = set(baskets.get(chat_id, {}))
+    reply = f"🧺 *Select from {folder}* (page {page + 1}/{pages})\n"
+    reply += f"Basket: {len(basket)} files\n"
+    reply += f"Or use `/select {folder} 1-20` or `/select {folder} *.mp4`"
+    markup = InlineKeyboardMarkup()
+    start = page * SELECT_PAGE_SIZE
+    for i, name in enumerate(files[start:start + SELECT_PAGE_SIZE], start):
+        picked = "✅" if basket_key(folder, name) in basket else "⬜"
+        markup.add(InlineKeyboardButton(f"{picked} {i + 1}. {name}", callback_data=f"tog::{token}::{i}"))
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"sel::{token}::{page - 1}"))
+    navigation.append(InlineKeyboardButton("☑️ Page", callback_data=f"selall::{token}::{page}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"sel::{token}::{page + 1}"))
+    markup.row(*navigation)
+    markup.row(
+        InlineKeyboardButton("📸 All Images", callback_data=f"selall::{token}::images"),
+        InlineKeyboardButton("🎥 All Videos", callback_data=f"selall::{token}::videos")
+    )
+    markup.row(
+        InlineKeyboardButton(f"🧺 Basket ({len(basket)})", callback_data="basket::show"),
+        InlineKeyboardButton("🔙 Back", callback_data=f"list::{token}")
+    )
+    return reply, markup
+
+def basket_view(chat_id):
+    with basket_lock:
+        paths = list(baskets.get(chat_id, {}))
+    if not paths:
+        return "🧺 Your basket is empty.\nPick files with 🧺 Select Files or /select FOLDER 1-20", None
+    total_size = 0
+    for path in paths:
+        try:
+            total_size += os.path.getsize(safe_join(ROOT_DIR, path))
+        except (OSError, ValueError):
+            continue
+    reply = f"🧺 *Basket: {len(paths)} files · {format_size(total_size)}*\n\n"
+    for path in paths[:10]:
+        reply += f"{file_caption(path)}\n"
+    if len(paths) > 10:
+        reply += f"... and {len(paths) - 10} more\n"
+    markup = InlineKeyboardMarkup()
+    markup.row(
+        InlineKeyboardButton("📤 Send", callback_data="basket::send"),
+        InlineKeyboardButton("🗜️ Send as ZIP", callback_data="basket::zip")
+    )
+    markup.add(InlineKeyboardButton("🗑️ Clear", callback_data="basket::clear"))
+    return reply, markup
+
+class ProgressMessage:
+    """One status message for a delivery job, edited in place at most every PROGRESS_EDIT_INTERVAL seconds"""
+
+    def __init__(self, chat_id, text):
+        self.chat_id = chat_id
+        self.text = text
+        self.edited_at = time.time()
+        self.message_id = bot.send_message(chat_id, text, parse_mode="Markdown").message_id
+
+    def update(self, text, force=False):
+        if text == self.text or (not force and time.time() - self.edited_at < PROGRESS_EDIT_INTERVAL):
+            return
+        try:
+            bot.edit_message_text(text, self.chat_id, self.message_id, parse_mode="Markdown")
+            self.text = text
+            self.edited_at = time.time()
+        except Exception as e:
+            logging.error(f"Could not update progress in {self.chat_id}: {e}")
+
+def archive_parts(file_paths):
+    """Split files into groups that fit one upload each (uncompressed sizes, plus zip overhead)"""
+    parts, current, current_size, too_large = [], [], 0, []
+    for path in file_paths:
+        size = os.path.getsize(path) + 1024
+        if size > ARCHIVE_PART_BYTES:
+            too_large.append(path)
+            continue
+        if current and current_size + size > ARCHIVE_PART_BYTES:
+            parts.append(current)
+            current, current_size = [], 0
+        current.append(path)
+        current_size += size
+    if current:
+        parts.append(current)
+    return parts, too_large
+
+def send_archive_part(chat_id, file_paths, number, count):
+    # Media is already compressed, storing it is as small and much faster
+    with tempfile.TemporaryFile(suffix='.zip') as tmp:
+        with zipfile.ZipFile(tmp, 'w') as archive:
+            for path in file_paths:
+                compress_type = zipfile.ZIP_STORED if is_media_file(path) else zipfile.ZIP_DEFLATED
+                archive.write(path, os.path.relpath(path, ROOT_DIR), compress_type=compress_type)
+        tmp.seek(0)
+        name = "basket.zip" if count == 1 else f"basket-{number}-of-{count}.zip"
+        call_with_retry(bot.send_document, chat_id, tmp, visible_file_name=name,
+                        caption=f"🗜️ {len(file_paths)} files")
+
+def deliver_basket(chat_id, paths, as_archive):
+    """One delivery job for a chat's basket; files that were sent leave the basket"""
+    file_paths = []
+    missing = 0
+    for path in paths:
+        try:
+            full_path = safe_join(ROOT_DIR, path)
+        except ValueError:
+            full_path = None
+        if full_path and os.path.isfile(full_path):
+            file_paths.append(full_path)
+        else:
+            missing += 1
+    total = len(file_paths)
+    sent, reused, errors = [], 0, missing
+    progress = None
+    try:
+        progress = ProgressMessage(chat_id, f"📤 *Sending {total} files...*")
+        if as_archive:
+            parts, too_large = archive_parts(file_paths)
+            errors += len(too_large)
+            for number, part in enumerate(parts, 1):
+                try:
+                    send_archive_part(chat_id, part, number, len(parts))
+                    sent.extend(part)
+                except Exception as e:
+                    errors += len(part)
+                    logging.error(f"Error sending archive to {chat_id}: {e}")
+                progress.update(f"🗜️ *Archiving {total} files...*\n📦 Part {number}/{len(parts)} · {len(sent)} files sent")
+        else:
+            # Groups of up to 10: photos and videos go together, documents are sent alone
+            media = [path for path in file_paths if send_kind(path) != 'document']
+            documents = [path for path in file_paths if send_kind(path) == 'document']
+            batches = [media[i:i + SYNC_BATCH_SIZE] for i in range(0, len(media), SYNC_BATCH_SIZE)]
+            batches += [[path] for path in documents]
+            for batch in batches:
+                batch_sent, batch_reused = deliver_batch(chat_id, batch)
+                sent.extend(batch_sent)
+                reused += batch_reused
+                errors += len(batch) - len(batch_sent)
+                progress.update(f"📤 *Sending {total} files...*\n✅ {len(sent)}/{total} sent")
+                time.sleep(SYNC_BATCH_DELAY)
+    finally:
+        with basket_lock:
+            basket = baskets.get(chat_id, {})
+            for path in sent:
+                basket.pop(os.path.relpath(path, ROOT_DIR).replace(os.sep, '/'), None)
+            basket_jobs.pop(chat_id, None)
+        try:
+            save_file_id_cache()
+        except Exception as e:
+            logging.error(f"Could not write {FILE_ID_CACHE_FILE}: {e}")
+        if progress is not None:
+            completion_msg = f"✅ *Completed!*\n📤 Sent: {len(sent)} files"
+            if reused:
+                completion_msg += f" ({reused} without re-uploading)"
+            if errors:
+                completion_msg += f"\n❌ Errors: {errors} files (kept in the basket)"
+            progress.update(completion_msg, force=True)
+
+def start_basket_job(chat_id, as_archive):
+    """Returns an error message if the job cannot start"""
+    with basket_lock:
+        if chat_id in basket_jobs:
+            return "A delivery is already running"
+        paths = list(baskets.get(chat_id, {}))
+        if not paths:
+            return "Your basket is empty"
+        thread = Thread(target=deliver_basket, args=(chat_id, paths, as_archive))
+        basket_jobs[chat_id] = thread
+    thread.start()
+    return None
+
+# Selection keyboard for a folder
+@bot.callback_query_handler(func=lambda call: call.data.startswith("sel::"))
+def show_selection(call):
+    try:
+        _, token, page = call.data.split("::")
+        reply, markup = selection_view(call.message.chat.id, resolve_token(token), int(page))
+        bot.edit_message_text(reply, call.message.chat.id, call.message.message_id,
+                            reply_markup=markup, parse_mode="Markdown")
+    except Exception as e:
+        bot.send_message(call.message.chat.id, f"Error: {e}")
+
+# Toggle one file in the basket
+@bot.callback_query_handler(func=lambda call: call.data.startswith("tog::"))
+def toggle_selection(call):
+    chat_id = call.message.chat.id
+    try:
+        _, token, index = call.data.split("::")
+        folder = resolve_token(token)
+        files = folder_files(safe_join(ROOT_DIR, folder))
+        index = int(index)
+        if index >= len(files):
+            bot.answer_callback_query(call.id, "The folder changed, refreshing...")
+        else:
+            path = basket_key(folder, files[index])
+            with basket_lock:
+                basket = baskets.setdefault(chat_id, {})
+                if path in basket:
+                    del basket[path]
+                else:
+                    basket[path] = None
+            bot.answer_callback_query(call.id)
+        reply, markup = selection_view(chat_id, folder, min(index, len(files) - 1) // SELECT_PAGE_SIZE)
+        bot.edit_message_text(reply, chat_id, call.message.message_id, reply_markup=markup, parse_mode="Markdown")
+    except Exception as e:
+        bot.send_message(chat_id, f"Error: {e}")
+
+# Select a whole page, or every image or video of a folder
+@bot.callback_query_handler(func=lambda call: call.data.startswith("selall::"))
+def select_many(call):
+    chat_id = call.message.chat.id
+    try:
+        _, token, what = call.data.split("::")
+        folder = resolve_token(token)
+        files = folder_files(safe_join(ROOT_DIR, folder))
+        if what.isdigit():
+            page = int(what)
+            names = files[page * SELECT_PAGE_SIZE:(page + 1) * SELECT_PAGE_SIZE]
+        else:
+            page = 0
+            names = parse_selection(what, files)
+        added = basket_add(chat_id, folder, names)
+        bot.answer_callback_query(call.id, f"Added {added} files")
+        reply, markup = selection_view(chat_id, folder, page)
+        bot.edit_message_text(reply, chat_id, call.message.message_id, reply_markup=markup, parse_mode="Markdown")
+    except Exception as e:
+        bot.send_message(chat_id, f"Error: {e}")
+
+# Basket actions
+@bot.callback_query_handler(func=lambda call: call.data.startswith("basket::"))
+def basket_callback(call):
+    chat_id = call.message.chat.id
+    action = call.data.split("::")[1]
+    try:
+        if action in ('send', 'zip'):
+            error = start_basket_job(chat_id, as_archive=action == 'zip')
+            bot.answer_callback_query(call.id, error or "Sending your basket...")
+            return
+        if action == 'clear':
+            with basket_lock:
+                baskets.pop(chat_id, None)
+            bot.answer_callback_query(call.id, "Basket cleared")
+        reply, markup = basket_view(chat_id)
+        bot.edit_message_text(reply, chat_id, call.message.message_id, reply_markup=markup, parse_mode="Markdown")
+    except Exception as e:
+        bot.send_message(chat_id, f"Error: {e}")
+
+# Add files to the basket by number, pattern or type
+@bot.message_handler(commands=['select'])
+def select_command(message):
+    try:
+        parts = message.text.split(maxsplit=2)
+        if len(parts) < 3:
+            bot.reply_to(message, "Usage: /select FOLDER 1-20 | 5 | *.mp4 | images | videos | all")
+            return
+        folder = parts[1].strip('/')
+        spec = parts[2]
+        files = folder_files(safe_join(ROOT_DIR, folder))
+        names = parse_selection(spec, files)
+        if not names:
+            bot.reply_to(message, "❌ Nothing matched.")
+            return
+        added = basket_add(message.chat.id, folder, names)
+        bot.reply_to(message, f"🧺 Added {added} files (basket: {basket_size(message.chat.id)} files)\nSend it with /basket")
+    except Exception as e:
+        bot.reply_to(message, f"Error: {e}")
+
+# Show the basket
+@bot.message_handler(commands=['basket'])
+def basket_command(message):
+    try:
+        reply, markup = basket_view(message.chat.id)
+        bot.send_message(message.chat.id, reply, reply_markup=markup, parse_mode="Markdown")
+    except Exception as e:
+        bot.reply_to(message, f"Error: {e}")
+
 # Manual command to list
 @bot.message_handler(commands=['list'])
 def list_files(message):
@@ -294,7 +1178,7 @@ def show_media_command(message):
         folder = message.text.split(maxsplit=1)[1]
         folder_path = safe_join(ROOT_DIR, folder)
         files = [f for f in os.listdir(folder_path) if is_media_file(f)]
-if not files:
+        if not files:
             bot.reply_to(message, "📂 No media files in this folder.")
             return
         
@@ -344,27 +1228,38 @@ def delete_file(message):
     except Exception as e:
         bot.reply_to(message, f"Error: {e}")
 
+# Help text (Markdown: every *, _ and ` must be paired)
+HELP_TEXT = (
+    "📌 *Bot Commands:*\n\n"
+    "🗂️ *Navigation:*\n"
+    "/folders - Show all folders\n"
+    "/list FOLDER - List files in folder\n\n"
+    "🎬 *Media Commands:*\n"
+    "/showmedia FOLDER - Send all media files fast\n"
+    "/get FOLDER FILE - Send specific file\n\n"
+    "🧺 *Basket:*\n"
+    "/select FOLDER 1-20 - Add files by number (see List All Files)\n"
+    "/select FOLDER `*.mp4` - Add files by pattern, images, videos or all\n"
+    "/basket - Send the basket as media groups or one ZIP\n\n"
+    "🔄 *Sync:*\n"
+    "/sync FOLDER - Send new media from a folder here as it appears\n"
+    "/unsync FOLDER - Stop syncing a folder\n"
+    "/sync - Show synced folders\n\n"
+    "🗑️ *Management:*\n"
+    "/delete FOLDER FILE - Delete file\n\n"
+    "💡 *Tips:*\n"
+    "• Use folder buttons for easy navigation\n"
+    "• Media files are sent with 0.5s delay\n"
+    "• Supports images: jpg, png, gif, etc.\n"
+    "• Supports videos: mp4, mov, mkv, etc."
+)
+
 # Help command
 @bot.message_handler(commands=['help'])
 def help_message(message):
-    help_text = (
-        "📌 *Bot Commands:*\n\n"
-        "🗂️ *Navigation:*\n"
-        "/folders - Show all folders\n"
-        "/list FOLDER - List files in folder\n\n"
-        "🎬 *Media Commands:*\n"
-        "/showmedia FOLDER - Send all media files fast\n"
-        "/get FOLDER FILE - Send specific file\n\n"
-        "🗑️ *Management:*\n"
-        "/delete FOLDER FILE - Delete file\n\n"
-        "💡 *Tips:*\n"
-        "• Use folder buttons for easy navigation\n"
-        "• Media files are sent with 0.5s delay\n"
-        "• Supports images: jpg, png, gif, etc.\n"
-        "• Supports videos: mp4, mov, mkv, etc."
-    )
-    bot.reply_to(message, help_text, parse_mode="Markdown")
+    bot.reply_to(message, HELP_TEXT, parse_mode="Markdown")
 
 # Start polling
+start_folder_sync()
 logging.info("Enhanced media bot running...")
 bot.infinity_polling()
\ No newline at end of file
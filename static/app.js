@@ -0,0 +1,1502 @@
+let socket;
+let currentChatId = null;
+let chats = [];
+const photoUrls = {};  // chat id -> thumbnail URL, or null when the chat has no photo
+let currentUser = 'User';
+let reconnectAttempts = 0;
+const maxReconnectAttempts = 5;
+
+// Windowed rendering: only rows near the viewport are in the DOM, the rest
+// are replaced by two spacers. Row heights are measured once a row has been
+// rendered and estimated until then.
+class VirtualList {
+    constructor(container, { keyOf, renderRow, estimate, overscan = 600, onRender = null }) {
+        this.container = container;
+        this.keyOf = keyOf;
+        this.renderRow = renderRow;
+        this.estimate = estimate;
+        this.overscan = overscan;  // Pixels rendered above and below the viewport
+        this.onRender = onRender;
+        this.items = [];
+        this.heights = new Map();  // key -> measured height, including the gap after the row
+        this.rows = new Map();  // key -> rendered element
+        this.top = document.createElement('div');
+        this.bottom = document.createElement('div');
+        this.top.className = this.bottom.className = 'virtual-spacer';
+        this.frame = null;
+        this.shift = 0;  // Pending scroll adjustment for rows added above the viewport
+        // Rows change height when images load or text is edited
+        this.resizeObserver = new ResizeObserver(() => this.schedule());
+        container.addEventListener('scroll', () => this.schedule(), { passive: true });
+    }
+
+    get mounted() {
+        return this.top.parentNode === this.container;
+    }
+
+    // Take over the container again after something else replaced its content
+    mount() {
+        if (this.mounted) return;
+        this.rows.forEach(el => this.resizeObserver.unobserve(el));
+        this.rows.clear();
+        this.container.replaceChildren(this.top, this.bottom);
+    }
+
+    setItems(items) {
+        this.items = items;
+        this.mount();
+        this.render();
+    }
+
+    // Forget rows and measurements, e.g. when another chat is opened
+    clear() {
+        this.items = [];
+        this.heights.clear();
+    }
+
+    append(items) {
+        this.items.push(...items);
+        this.schedule();
+    }
+
+    // Add rows above the current ones without moving what is on screen
+    prepend(items) {
+        this.items.unshift(...items);
+        this.shift += items.reduce((sum, item) => sum + this.heightOf(item), 0);
+        this.render();
+    }
+
+    remove(key) {
+        const index = this.indexOf(key);
+        if (index === -1) return;
+        this.items.splice(index, 1);
+        this.heights.delete(key);
+        this.schedule();
+    }
+
+    // Re-render a single row after its item changed
+    refresh(key) {
+        const el = this.rows.get(key);
+        const index = this.indexOf(key);
+        if (!el || index === -1) return;
+        const fresh = this.renderRow(this.items[index]);
+        this.resizeObserver.unobserve(el);
+        el.replaceWith(fresh);
+        this.resizeObserver.observe(fresh);
+        this.rows.set(key, fresh);
+        this.schedule();
+    }
+
+    indexOf(key) {
+        return this.items.findIndex(item => this.keyOf(item) === key);
+    }
+
+    heightOf(item) {
+        return this.heights.get(this.keyOf(item)) ?? this.estimate;
+    }
+
+    isAtEnd() {
+        const c = this.container;
+        return c.scrollHeight - c.scrollTop - c.clientHeight < 50;
+    }
+
+    scrollToEnd() {
+        // Measuring newly rendered rows can grow the list, so settle in a few passes
+        for (let pass = 0; pass < 3; pass++) {
+            this.container.scrollTop = this.container.scrollHeight;
+            this.render();
+        }
+    }
+
+    schedule() {
+        if (this.frame || !this.mounted) return;
+        this.frame = requestAnimationFrame(() => {
+            this.frame = null;
+            this.render();
+        });
+    }
+
+    render() {
+        if (!this.mounted) return;
+        let scrollTop = this.container.scrollTop + this.shift;
+        this.shift = 0;
+        const viewport = this.container.clientHeight;
+        const heights = this.items.map(item => this.heightOf(item));
+
+        let first = 0;
+        let start = 0;
+        while (first < heights.length && start + heights[first] < scrollTop - this.overscan) {
+            start += heights[first++];
+        }
+        let last = first;
+        let end = start;
+        while (last < heights.length && end < scrollTop + viewport + this.overscan) {
+            end += heights[last++];
+        }
+        const total = heights.reduce((sum, height) => sum + height, 0);
+        const visible = this.items.slice(first, last);
+
+        // Reuse rows that stay in the window, drop the rest, create the new ones
+        const keys = new Set(visible.map(this.keyOf));
+        this.rows.forEach((el, key) => {
+            if (keys.has(key)) return;
+            this.resizeObserver.unobserve(el);
+            el.remove();
+            this.rows.delete(key);
+        });
+        let previous = this.top;
+        visible.forEach(item => {
+            const key = this.keyOf(item);
+            let el = this.rows.get(key);
+            if (!el) {
+                el = this.renderRow(item);
+                this.rows.set(key, el);
+                this.resizeObserver.observe(el);
+            }
+            if (previous.nextSibling !== el) previous.after(el);
+            previous = el;
+        });
+        this.top.style.height = `${start}px`;
+        this.bottom.style.height = `${total - end}px`;
+
+        // Measure; rows above the viewport that changed height would move the
+        // content under the reader, so the scroll position moves with them
+        let offset = start;
+        visible.forEach((item, i) => {
+            const key = this.keyOf(item);
+            const el = this.rows.get(key);
+            const height = el.nextSibling.offsetTop - el.offsetTop;
+            const estimated = heights[first + i];
+            if (height !== estimated) {
+                this.heights.set(key, height);
+                if (offset + estimated <= scrollTop) scrollTop += height - estimated;
+            }
+            offset += estimated;
+        });
+        if (this.container.scrollTop !== scrollTop) this.container.scrollTop = scrollTop;
+        if (this.onRender) this.onRender(visible);
+    }
+}
+
+function htmlToElement(html) {
+    const template = document.createElement('template');
+    template.innerHTML = html.trim();
+    return template.content.firstElementChild;
+}
+
+// Browser-side cache: the dialog list and each chat's newest messages are kept
+// in IndexedDB, so a reload renders at once and then only asks the server
+// for what changed since the cached copy ("since" cursors)
+const CACHED_MESSAGES = 100;  // Newest messages kept per chat
+const cacheStore = {
+    db: null,
+    open() {
+        if (!this.db) {
+            this.db = new Promise((resolve, reject) => {
+                const request = indexedDB.open('telegram-web', 1);
+                request.onupgradeneeded = () => {
+                    request.result.createObjectStore('dialogs');
+                    request.result.createObjectStore('messages');
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => reject(request.error);
+            }).catch(error => {
+                console.error('IndexedDB unavailable:', error);
+                return null;
+            });
+        }
+        return this.db;
+    },
+    async run(store, mode, action) {
+        const db = await this.open();
+        if (!db) return undefined;
+        return new Promise(resolve => {
+            const request = action(db.transaction(store, mode).objectStore(store));
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => resolve(undefined);
+        });
+    },
+    get(store, key) {
+        return this.run(store, 'readonly', s => s.get(key));
+    },
+    put(store, key, value) {
+        return this.run(store, 'readwrite', s => s.put(value, key));
+    },
+    async clear() {
+        await this.run('dialogs', 'readwrite', s => s.clear());
+        await this.run('messages', 'readwrite', s => s.clear());
+        // Thumbnails cached by the service worker are private too
+        if ('caches' in window) await caches.delete('media-v1');
+    }
+};
+
+let dialogsSince = null;
+let dialogsSaveTimer = null;
+function saveDialogs() {
+    clearTimeout(dialogsSaveTimer);
+    dialogsSaveTimer = setTimeout(() => {
+        cacheStore.put('dialogs', 'list', { dialogs: chats, since: dialogsSince });
+    }, 1000);
+}
+
+const messagesSince = {};  // chat id -> journal cursor the cached page is current as of
+let messagesSaveTimer = null;
+function saveMessages(chatId) {
+    clearTimeout(messagesSaveTimer);
+    messagesSaveTimer = setTimeout(() => {
+        if (chatId !== currentChatId || !messagesSince[chatId]) return;
+        const confirmed = messageView.items.filter(msg => msg.id);
+        const kept = confirmed.slice(-CACHED_MESSAGES).map(({ key, fresh, ...msg }) => msg);
+        cacheStore.put('messages', chatId, {
+            messages: kept,
+            since: messagesSince[chatId],
+            next_cursor: kept.length < confirmed.length ? `before:${kept[0].id}` : historyCursor
+        });
+    }, 1000);
+}
+
+async function renderCachedChats() {
+    const cached = await cacheStore.get('dialogs', 'list');
+    if (!cached || chats.length) return;
+    // Logged in last time; checkLogin() shows the login form again if that changed
+    document.getElementById('loginModal').classList.add('hidden');
+    chats = cached.dialogs;
+    dialogsSince = cached.since;
+    renderChats(chats);
+}
+
+let chatView;
+let messageView;
+let pendingMessageKeys = 0;
+function messageKey(msg) {
+    // Optimistic messages have no ID until Telegram confirms them
+    if (!msg.key) msg.key = msg.id ? `m${msg.id}` : `p${++pendingMessageKeys}`;
+    return msg.key;
+}
+
+// API calls go over the socket while it is connected and over HTTP otherwise.
+// A call on a channel supersedes the previous call there, which resolves as
+// { cancelled: true } and stops its work on the server.
+const rpc = {
+    nextId: 0,
+    pending: new Map(),  // call id -> { channel, onPartial, http, retry, viaSocket, controller, resolve, reject }
+    channels: {},  // channel -> call id
+
+    call(method, params, { channel = null, onPartial = null, http, retry = true }) {
+        if (channel) this.cancelChannel(channel);
+        const id = ++this.nextId;
+        const call = { channel, onPartial, http, retry };
+        const result = new Promise((resolve, reject) => {
+            call.resolve = resolve;
+            call.reject = reject;
+        });
+        this.pending.set(id, call);
+        if (channel) this.channels[channel] = id;
+        if (socket && socket.connected) {
+            call.viaSocket = true;
+            socket.emit('rpc', { id, method, params, channel });
+        } else {
+            this.overHttp(id, call);
+        }
+        return result;
+    },
+
+    overHttp(id, call) {
+        call.viaSocket = false;
+        call.controller = new AbortController();
+        const partial = items => { if (this.pending.get(id) === call && call.onPartial) call.onPartial(items); };
+        call.http(call.controller.signal, partial).then(
+            data => { if (this.finish(id)) call.resolve(data); },
+            error => { if (this.finish(id)) call.reject(error); }
+        );
+    },
+
+    finish(id) {
+        const call = this.pending.get(id);
+        if (!call) return null;
+        this.pending.delete(id);
+        if (call.channel && this.channels[call.channel] === id) delete this.channels[call.channel];
+        return call;
+    },
+
+    cancel(id) {
+        const call = this.finish(id);
+        if (!call) return;
+        if (!call.viaSocket) call.controller.abort();
+        else if (socket.connected) socket.emit('rpc_cancel', { id });
+        call.resolve({ success: false, cancelled: true });
+    },
+
+    cancelChannel(channel) {
+        if (channel in this.channels) this.cancel(this.channels[channel]);
+    },
+
+    handlePartial(data) {
+        const call = this.pending.get(data.id);
+        if (call && call.onPartial) call.onPartial(data.items);
+    },
+
+    handleResult(data) {
+        const call = this.finish(data.id);
+        if (call) call.resolve(data);
+    },
+
+    // The server drops a client's calls when it goes away: finish them over HTTP
+    handleDisconnect() {
+        this.pending.forEach((call, id) => {
+            if (!call.viaSocket) return;
+            if (call.retry) {
+                this.overHttp(id, call);
+            } else {
+                this.finish(id);
+                call.resolve({ success: false, error: 'Disconnected from server' });
+            }
+        });
+    }
+};
+
+async function fetchJson(url, options = {}) {
+    const response = await fetch(url, options);
+    return response.json();
+}
+
+// Initialize Socket.IO with better error handling
+function initSocket() {
+    socket = io({
+        reconnection: true,
+        reconnectionDelay: 1000,
+        reconnectionDelayMax: 5000,
+        reconnectionAttempts: maxReconnectAttempts
+    });
+
+    socket.on('connect', () => {
+        console.log('Connected to server');
+        reconnectAttempts = 0;
+        socket.emit('subscribe_dialogs');
+        if (currentChatId) socket.emit('subscribe_chat', { chat_id: currentChatId });
+        checkLogin();
+    });
+
+    socket.on('disconnect', () => {
+        console.log('Disconnected from server');
+        rpc.handleDisconnect();
+        showToast('Disconnected from server', 'warning');
+    });
+
+    socket.on('connect_error', (error) => {
+        console.error('Connection error:', error);
+        reconnectAttempts++;
+        if (reconnectAttempts >= maxReconnectAttempts) {
+            showToast('Unable to connect to server', 'error');
+        }
+    });
+
+    socket.on('status', (status) => {
+        updateStatus(status);
+    });
+
+    socket.on('chat_updates', (data) => {
+        handleChatUpdates(data);
+    });
+
+    socket.on('dialog_updates', (data) => {
+        handleDialogUpdates(data);
+    });
+
+    socket.on('rpc_partial', (data) => {
+        rpc.handlePartial(data);
+    });
+
+    socket.on('rpc_result', (data) => {
+        rpc.handleResult(data);
+    });
+
+    socket.on('export_progress', (data) => {
+        handleExportProgress(data);
+    });
+}
+
+// Initialize on page load
+document.addEventListener('DOMContentLoaded', () => {
+    chatView = new VirtualList(document.getElementById('chatList'), {
+        keyOf: chat => chat.id,
+        renderRow: createChatElement,
+        estimate: 83,
+        // Avatars are only requested for rows that have been on screen
+        onRender: rows => loadPhotos(rows.map(chat => chat.id))
+    });
+    messageView = new VirtualList(document.getElementById('messagesContainer'), {
+        keyOf: messageKey,
+        renderRow: createMessageElement,
+        estimate: 90
+    });
+    renderCachedChats();
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/sw.js').catch(error => console.error('Service worker error:', error));
+    }
+    initSocket();
+    setupEventListeners();
+});
+
+function setupEventListeners() {
+    // Message input auto-resize
+    const messageInput = document.getElementById('messageInput');
+    messageInput.addEventListener('input', function() {
+        this.style.height = 'auto';
+        this.style.height = Math.min(this.scrollHeight, 120) + 'px';
+    });
+
+    // Send on Enter (but allow Shift+Enter for newlines)
+    messageInput.addEventListener('keydown', (e) => {
+        if (e.key === 'Enter' && !e.shiftKey) {
+            e.preventDefault();
+            sendMessage();
+        }
+    });
+
+    // Load older messages when scrolled near the top
+    document.getElementById('messagesContainer').addEventListener('scroll', function() {
+        if (this.scrollTop < 200) loadOlderMessages();
+    });
+
+    // Chat search
+    document.getElementById('chatSearch').addEventListener('input', function() {
+        filterChats(this.value);
+    });
+
+    // Message search with debounce
+    let searchTimeout;
+    document.getElementById('messageSearch').addEventListener('input', function() {
+        clearTimeout(searchTimeout);
+        const query = this.value.trim();
+        if (query.length > 2) {
+            searchTimeout = setTimeout(() => searchMessages(query), 500);
+        } else {
+            document.getElementById('searchResults').innerHTML = `
+                <div class="empty-state">
+                    <i class="fas fa-search"></i>
+                    <p>Type to search messages</p>
+                </div>
+            `;
+        }
+    });
+
+    // Login form handlers
+    document.getElementById('sendCodeBtn').addEventListener('click', sendCode);
+    document.getElementById('verifyCodeBtn').addEventListener('click', verifyCode);
+    document.getElementById('verifyPasswordBtn').addEventListener('click', verifyPassword);
+
+    // Enter key on login inputs
+    document.getElementById('phoneInput').addEventListener('keydown', (e) => {
+        if (e.key === 'Enter') sendCode();
+    });
+    document.getElementById('codeInput').addEventListener('keydown', (e) => {
+        if (e.key === 'Enter') verifyCode();
+    });
+    document.getElementById('passwordInput').addEventListener('keydown', (e) => {
+        if (e.key === 'Enter') verifyPassword();
+    });
+
+    // Toggle the metrics debug panel
+    document.addEventListener('keydown', (e) => {
+        if (e.ctrlKey && e.shiftKey && e.key.toLowerCase() === 'd') {
+            e.preventDefault();
+            toggleDebugPanel();
+        }
+    });
+    if (new URLSearchParams(location.search).has('debug')) toggleDebugPanel();
+
+    // Request notification permission
+    if ('Notification' in window && Notification.permission === 'default') {
+        Notification.requestPermission();
+    }
+}
+
+// Metrics debug panel
+let debugTimer = null;
+function toggleDebugPanel() {
+    const panel = document.getElementById('debugPanel');
+    panel.classList.toggle('show');
+    clearInterval(debugTimer);
+    debugTimer = null;
+    if (panel.classList.contains('show')) {
+        refreshDebugPanel();
+        debugTimer = setInterval(refreshDebugPanel, 2000);
+    }
+}
+
+async function refreshDebugPanel() {
+    try {
+        const response = await fetch('/api/metrics?format=json');
+        renderDebugPanel(await response.json());
+    } catch (error) {
+        document.getElementById('debugPanel').textContent = 'Metrics unavailable';
+    }
+}
+
+function renderDebugPanel(data) {
+    const ms = value => value.toFixed(1);
+    const histogramRows = (name, label) => (data.histograms[name] || []).slice(0, 12).map(row => `
+        <tr><td>${escapeHtml(label(row.labels))}</td><td>${row.count}</td>
+        <td>p50 ${ms(row.p50_ms)}</td><td>p95 ${ms(row.p95_ms)}</td></tr>`).join('');
+    const lag = (data.histograms.event_loop_lag_seconds || [])[0];
+    const bytes = (data.counters.http_response_bytes_total || []).reduce((sum, row) => sum + row.value, 0);
+    const caches = Object.entries(data.caches).map(([name, c]) => `
+        <tr><td>${escapeHtml(name)}</td><td>${c.hit}/${c.hit + c.miss}</td>
+        <td>${c.ratio === null ? '-' : (c.ratio * 100).toFixed(0) + '%'}</td></tr>`).join('');
+    document.getElementById('debugPanel').innerHTML = `
+        <h4>Event loop lag</h4>
+        ${lag ? `p50 ${ms(lag.p50_ms)} ms, p95 ${ms(lag.p95_ms)} ms (${lag.count} samples)` : 'no samples'}
+        <h4>Routes (${(bytes / 1048576).toFixed(1)} MB served)</h4>
+        <table>${histogramRows('http_request_duration_seconds', l => `${l.method} ${l.route} ${l.status}`)}</table>
+        <h4>Telegram</h4>
+        <table>${histogramRows('telegram_request_duration_seconds', l => `${l.op}${l.status === 'ok' ? '' : ' ' + l.status}`)}</table>
+        <h4>Caches</h4>
+        <table>${caches}</table>
+        <h4>Gauges</h4>
+        ${Object.entries(data.gauges).map(([name, value]) => `${escapeHtml(name)} ${value}`).join('<br>')}
+    `;
+}
+
+// API Functions
+async function checkLogin() {
+    try {
+        const response = await fetch('/api/check_login');
+        const data = await response.json();
+        
+        if (data.logged_in) {
+            document.getElementById('loginModal').classList.add('hidden');
+            await loadUserInfo();
+            // Both only ask for what changed while we were away
+            await loadChats();
+            if (currentChatId) await catchUpChat(currentChatId);
+            await loadExports();
+        } else {
+            document.getElementById('loginModal').classList.remove('hidden');
+            if (chats.length) {
+                chats = [];
+                dialogsSince = null;
+                renderChats(chats);
+            }
+            await cacheStore.clear();
+        }
+    } catch (error) {
+        console.error('Check login error:', error);
+        showToast('Connection error', 'error');
+    }
+}
+
+async function loadUserInfo() {
+    try {
+        const response = await fetch('/api/user_info');
+        const data = await response.json();
+        if (data.success) {
+            currentUser = data.name || 'User';
+            document.getElementById('userName').textContent = currentUser;
+        }
+    } catch (error) {
+        console.error('Load user info error:', error);
+    }
+}
+
+async function sendCode() {
+    const phone = document.getElementById('phoneInput').value.trim();
+    if (!phone) {
+        showLoginError('Please enter a phone number');
+        return;
+    }
+
+    const btn = document.getElementById('sendCodeBtn');
+    setButtonLoading(btn, true);
+    hideLoginError();
+
+    try {
+        const response = await fetch('/api/send_code', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ phone })
+        });
+        const data = await response.json();
+
+        if (data.success) {
+            showStep(2);
+            setTimeout(() => document.getElementById('codeInput').focus(), 100);
+        } else {
+            showLoginError(data.error || 'Failed to send code');
+        }
+    } catch (error) {
+        showLoginError('Connection error: ' + error.message);
+    } finally {
+        setButtonLoading(btn, false);
+    }
+}
+
+async function verifyCode() {
+    const code = document.getElementById('codeInput').value.trim();
+    if (!code) {
+        showLoginError('Please enter the verification code');
+        return;
+    }
+
+    const btn = document.getElementById('verifyCodeBtn');
+    setButtonLoading(btn, true);
+    hideLoginError();
+
+    try {
+        const response = await fetch('/api/verify_code', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ code })
+        });
+        const data = await response.json();
+
+        if (data.success) {
+            document.getElementById('loginModal').classList.add('hidden');
+            await loadUserInfo();
+            await loadChats();
+            showToast('Successfully logged in!', 'success');
+        } else {
+            if (data.error === '2fa_required') {
+                showStep(3);
+                setTimeout(() => document.getElementById('passwordInput').focus(), 100);
+            } else {
+                showLoginError(data.error || 'Verification failed');
+            }
+        }
+    } catch (error) {
+        showLoginError('Connection error: ' + error.message);
+    } finally {
+        setButtonLoading(btn, false);
+    }
+}
+
+async function verifyPassword() {
+    const password = document.getElementById('passwordInput').value;
+    if (!password) {
+        showLoginError('Please enter your password');
+        return;
+    }
+
+    const btn = document.getElementById('verifyPasswordBtn');
+    setButtonLoading(btn, true);
+    hideLoginError();
+
+    try {
+        const response = await fetch('/api/verify_code', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ password })
+        });
+        const data = await response.json();
+
+        if (data.success) {
+            document.getElementById('loginModal').classList.add('hidden');
+            await loadUserInfo();
+            await loadChats();
+            showToast('Successfully logged in!', 'success');
+        } else {
+            showLoginError(data.error || 'Login failed');
+        }
+    } catch (error) {
+        showLoginError('Connection error: ' + error.message);
+    } finally {
+        setButtonLoading(btn, false);
+    }
+}
+
+async function logout() {
+    if (!confirm('Are you sure you want to logout?')) return;
+
+    try {
+        const response = await fetch('/api/logout', { method: 'POST' });
+        if (response.ok) {
+            await cacheStore.clear();
+            chats = [];
+            dialogsSince = null;
+            exportStates = {};
+            renderChats(chats);
+            // Reset UI
+            document.getElementById('loginModal').classList.remove('hidden');
+            showStep(1);
+            document.getElementById('phoneInput').value = '';
+            document.getElementById('codeInput').value = '';
+            document.getElementById('passwordInput').value = '';
+            document.getElementById('messagesContainer').innerHTML = `
+                <div class="welcome-screen">
+                    <div class="welcome-icon"><i class="fab fa-telegram"></i></div>
+                    <h2>Welcome to Telegram Web</h2>
+                    <p>Select a chat from the sidebar to start messaging</p>
+                </div>
+            `;
+            document.getElementById('messageInputContainer').style.display = 'none';
+            currentChatId = null;
+            renderExportStatus();
+            showToast('Logged out successfully', 'success');
+        }
+    } catch (error) {
+        showToast('Logout error: ' + error.message, 'error');
+    }
+}
+
+async function loadChats(refresh = false) {
+    const chatList = document.getElementById('chatList');
+    if (chats.length === 0 || refresh) {
+        chatList.innerHTML = `
+            <div style="padding: 40px; text-align: center;">
+                <div class="loading-spinner"></div>
+                <p style="margin-top: 10px; color: var(--text-secondary);">Loading chats...</p>
+            </div>
+        `;
+    }
+
+    try {
+        // Dialogs are paginated with a cursor; render the first page right away
+        let data = await fetchDialogPage(null, refresh, refresh ? null : dialogsSince);
+        if (data.success && data.removed) {
+            applyDialogChanges(data);
+        } else if (data.success) {
+            const since = data.since;
+            const loaded = data.dialogs;
+            chats = loaded;
+            renderChats(chats);
+            while (data.success && data.next_cursor) {
+                data = await fetchDialogPage(data.next_cursor, false);
+                if (data.success) loaded.push(...data.dialogs);
+            }
+            chats = loaded;
+            dialogsSince = since;
+            filterChats(document.getElementById('chatSearch').value);
+            saveDialogs();
+        } else {
+            chatList.innerHTML = `
+                <div class="empty-state">
+                    <i class="fas fa-exclamation-circle"></i>
+                    <p>Failed to load chats</p>
+                </div>
+            `;
+            showToast('Failed to load chats', 'error');
+        }
+    } catch (error) {
+        chatList.innerHTML = `
+            <div class="empty-state">
+                <i class="fas fa-exclamation-circle"></i>
+                <p>Connection error</p>
+            </div>
+        `;
+        showToast('Connection error', 'error');
+    }
+}
+
+async function fetchDialogPage(cursor, refresh, since = null) {
+    const params = { limit: 100 };
+    if (cursor) params.cursor = cursor;
+    if (refresh) params.refresh = 1;
+    if (since) params.since = since;
+    return rpc.call('dialogs', params, {
+        http: signal => fetchJson(`/api/dialogs?${new URLSearchParams(params)}`, { signal })
+    });
+}
+
+// Merge the dialogs that changed since the cached list
+function applyDialogChanges(data) {
+    const removed = new Set(data.removed);
+    chats = chats.filter(chat => !removed.has(chat.id));
+    data.dialogs.forEach(dialog => {
+        const chat = chats.find(c => c.id === dialog.id);
+        if (chat) Object.assign(chat, dialog);
+        else chats.push(dialog);
+    });
+    chats.sort((a, b) => (b.timestamp || 0) - (a.timestamp || 0));
+    dialogsSince = data.since;
+    filterChats(document.getElementById('chatSearch').value);
+    saveDialogs();
+}
+
+function renderChats(chatList) {
+    const chatListEl = document.getElementById('chatList');
+    
+    if (chatList.length === 0) {
+        chatListEl.innerHTML = `
+            <div class="empty-state">
+                <i class="fas fa-comments"></i>
+                <p>No conversations found</p>
+            </div>
+        `;
+        return;
+    }
+
+    chatView.setItems(chatList);
+}
+
+function createChatElement(chat) {
+    const initials = chat.name.split(' ').map(n => n[0]).join('').substring(0, 2).toUpperCase();
+    const time = chat.date ? formatTime(new Date(chat.date)) : '';
+    const photo = photoUrls[chat.id];
+    return htmlToElement(`
+            <div class="chat-item${chat.id === currentChatId ? ' active' : ''}" data-chat-id="${chat.id}" onclick="selectChat(${chat.id}, '${escapeHtml(chat.name)}')">
+                <div class="chat-avatar">${photo ? `<img src="${photo}" alt="" loading="lazy" decoding="async">` : initials}</div>
+                <div class="chat-info">
+                    <div class="chat-header">
+                        <div class="chat-name">${escapeHtml(chat.name)}</div>
+                        ${time ? `<div class="chat-time">${time}</div>` : ''}
+                    </div>
+                    <div class="chat-preview">
+                        ${escapeHtml(chat.last_message || '')}
+                        ${chat.unread_count > 0 ? `<span class="unread-badge">${chat.unread_count}</span>` : ''}
+                    </div>
+                </div>
+            </div>
+    `);
+}
+
+// Resolve avatars for chats we have not asked about yet, in batches
+let photoRequest = null;
+async function loadPhotos(chatIds) {
+    const missing = chatIds.filter(id => !(id in photoUrls));
+    if (missing.length === 0 || photoRequest) return;
+    missing.forEach(id => { photoUrls[id] = null; });
+
+    photoRequest = (async () => {
+        for (let i = 0; i < missing.length; i += 100) {
+            try {
+                const params = { chat_ids: missing.slice(i, i + 100) };
+                const data = await rpc.call('photos', params, {
+                    http: signal => fetchJson('/api/photos', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify(params),
+                        signal
+                    })
+                });
+                if (!data.success) continue;
+                Object.entries(data.photos).forEach(([id, url]) => {
+                    photoUrls[id] = url;
+                    const avatar = url && document.querySelector(`[data-chat-id="${id}"] .chat-avatar`);
+                    if (avatar) avatar.innerHTML = `<img src="${url}" alt="" loading="lazy" decoding="async">`;
+                });
+            } catch (error) {
+                console.error('Load photos error:', error);
+            }
+        }
+    })();
+    await photoRequest;
+    photoRequest = null;
+    // Rows that scrolled into view while the request was running
+    chatView.schedule();
+}
+
+function filterChats(query) {
+    if (!query) {
+        renderChats(chats);
+        return;
+    }
+
+    const filtered = chats.filter(chat => 
+        chat.name.toLowerCase().includes(query.toLowerCase())
+    );
+    renderChats(filtered);
+}
+
+async function sendMessage() {
+    const input = document.getElementById('messageInput');
+    const message = input.value.trim();
+    
+    if (!message || !currentChatId) return;
+
+    // Optimistic UI update
+    appendMessage({
+        text: message,
+        sender_name: currentUser,
+        date: new Date().toISOString(),
+        is_outgoing: true
+    });
+
+    input.value = '';
+    input.style.height = 'auto';
+
+    try {
+        const params = { chat_id: currentChatId, message };
+        // Never resent after a disconnect: the server may already have sent it
+        const data = await rpc.call('send_message', params, {
+            retry: false,
+            http: signal => fetchJson('/api/send_message', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(params),
+                signal
+            })
+        });
+        if (!data.success) {
+            showToast('Failed to send message', 'error');
+        }
+    } catch (error) {
+        showToast('Error sending message', 'error');
+    }
+}
+
+// Read an NDJSON response line by line; resolves with the trailing summary line
+async function fetchNdjson(url, onItem, signal = undefined) {
+    const response = await fetch(url, { headers: { 'Accept': 'application/x-ndjson' }, signal });
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let summary = null;
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter(line => line).forEach(line => {
+            const item = JSON.parse(line);
+            if (item.done) summary = item;
+            else onItem(item);
+        });
+    }
+    return summary || { success: false, error: 'Incomplete response' };
+}
+
+function renderSearchResult(result) {
+    return `
+        <div class="chat-item" onclick="selectChat(${result.chat_id}, '${escapeHtml(result.chat_name)}')">
+            <div class="chat-avatar">
+                <i class="fas fa-comment"></i>
+            </div>
+            <div class="chat-info">
+                <div class="chat-header">
+                    <div class="chat-name">${escapeHtml(result.chat_name)}</div>
+                    <div class="chat-time">${formatDate(new Date(result.date))}</div>
+                </div>
+                <div class="chat-preview">${escapeHtml(result.text)}</div>
+            </div>
+        </div>
+    `;
+}
+
+let searchResultCount = 0;
+
+function showSearchEmpty(icon, text) {
+    document.getElementById('searchResults').innerHTML = `
+        <div class="empty-state">
+            <i class="fas ${icon}"></i>
+            <p>${text}</p>
+        </div>
+    `;
+}
+
+function renderSearchResults(results) {
+    const resultsEl = document.getElementById('searchResults');
+    if (searchResultCount === 0) resultsEl.innerHTML = '';
+    searchResultCount += results.length;
+    resultsEl.insertAdjacentHTML('beforeend', results.map(renderSearchResult).join(''));
+}
+
+async function searchMessages(query) {
+    const resultsEl = document.getElementById('searchResults');
+    searchResultCount = 0;
+    resultsEl.innerHTML = `
+        <div style="padding: 40px; text-align: center;">
+            <div class="loading-spinner"></div>
+        </div>
+    `;
+
+    try {
+        // Results are rendered batch by batch as they arrive; a new query cancels the old one
+        const data = await rpc.call('search', { q: query, fanout: true }, {
+            channel: 'search',
+            onPartial: renderSearchResults,
+            http: (signal, partial) => fetchNdjson(
+                `/api/search?q=${encodeURIComponent(query)}`,
+                result => partial([result]),
+                signal
+            )
+        });
+        if (data.cancelled || searchResultCount > 0) return;
+        if (data.success) showSearchEmpty('fa-search', 'No results found');
+        else showSearchEmpty('fa-exclamation-circle', 'Search error');
+    } catch (error) {
+        if (searchResultCount === 0) showSearchEmpty('fa-exclamation-circle', 'Search error');
+    }
+}
+
+// Chat exports run on the server; progress arrives as 'export_progress' events
+let exportStates = {};  // chat id -> export state
+
+async function loadExports() {
+    try {
+        const response = await fetch('/api/exports');
+        const data = await response.json();
+        if (!data.success) return;
+        exportStates = {};
+        data.exports.forEach(state => { exportStates[state.chat_id] = state; });
+        renderExportStatus();
+    } catch (error) {
+        console.error('Load exports error:', error);
+    }
+}
+
+function isExportActive(state) {
+    return state && (state.status === 'queued' || state.status === 'running');
+}
+
+function handleExportProgress(state) {
+    const previous = exportStates[state.chat_id];
+    exportStates[state.chat_id] = state;
+    if (state.chat_id === currentChatId) renderExportStatus();
+    if (isExportActive(previous) && state.status === 'done') {
+        showToast(`Export of ${state.chat_name} finished`, 'success');
+    } else if (isExportActive(previous) && state.status === 'failed') {
+        showToast(`Export of ${state.chat_name} failed: ${state.error}`, 'error');
+    }
+}
+
+function renderExportStatus() {
+    const statusEl = document.getElementById('exportStatus');
+    const button = document.getElementById('exportBtn');
+    const state = exportStates[currentChatId];
+    const active = isExportActive(state);
+    button.style.display = currentChatId ? '' : 'none';
+    button.title = active ? 'Stop export' : state ? 'Export new messages' : 'Export chat history';
+    button.innerHTML = `<i class="fas ${active ? 'fa-stop' : 'fa-file-export'}"></i>`;
+    if (!state) {
+        statusEl.textContent = '';
+        return;
+    }
+    const count = state.total
+        ? `${state.exported.toLocaleString()} / ${state.total.toLocaleString()}`
+        : state.exported.toLocaleString();
+    const files = `/api/export/${state.chat_id}/files`;
+    if (state.status === 'queued') {
+        statusEl.textContent = 'Export queued';
+    } else if (state.status === 'running') {
+        statusEl.textContent = `Exporting: ${count} messages, ${state.media} media files`;
+    } else if (state.status === 'failed') {
+        statusEl.textContent = `Export failed after ${count} messages: ${state.error}`;
+    } else {
+        statusEl.innerHTML = `
+            ${state.status === 'paused' ? 'Export paused at' : 'Exported'} ${count} messages
+            · <a href="${files}/${state.messages_file}">messages</a>
+            ${state.manifest_size ? `· <a href="${files}/${state.manifest_file}">media manifest</a>` : ''}
+        `;
+    }
+}
+
+// Start (or resume, or update) the open chat's export, or stop it while it runs
+async function toggleExport() {
+    const chatId = currentChatId;
+    if (!chatId) return;
+    const active = isExportActive(exportStates[chatId]);
+    try {
+        const response = await fetch(`/api/export/${chatId}${active ? '/cancel' : ''}`, { method: 'POST' });
+        const data = await response.json();
+        if (!data.success && !active) {
+            showToast('Export error: ' + data.error, 'error');
+        } else if (data.export) {
+            handleExportProgress(data.export);
+        }
+    } catch (error) {
+        showToast('Connection error', 'error');
+    }
+}
+
+// UI Helper Functions
+function switchTab(tab) {
+    document.querySelectorAll('.tab').forEach(t => t.classList.remove('active'));
+    event.target.classList.add('active');
+    
+    document.getElementById('chatsTab').style.display = tab === 'chats' ? 'flex' : 'none';
+    document.getElementById('searchTab').style.display = tab === 'search' ? 'flex' : 'none';
+}
+
+function showStep(step) {
+    document.querySelectorAll('.login-step').forEach(el => el.classList.remove('active'));
+    document.querySelectorAll('.step').forEach((el, i) => {
+        el.classList.toggle('active', i === step - 1);
+    });
+
+    const steps = ['phone', 'code', 'password'];
+    document.getElementById(`${steps[step - 1]}Step`).classList.add('active');
+}
+
+function showLoginError(message) {
+    const errorEl = document.getElementById('loginError');
+    errorEl.textContent = message;
+    errorEl.classList.add('show');
+}
+
+function hideLoginError() {
+    document.getElementById('loginError').classList.remove('show');
+}
+
+function setButtonLoading(btn, loading) {
+    const span = btn.querySelector('span');
+    if (loading) {
+        btn.disabled = true;
+        span.innerHTML = '<div class="loading-spinner"></div>';
+    } else {
+        btn.disabled = false;
+        span.textContent = btn.id === 'sendCodeBtn' ? 'Send Code' : 
+                           btn.id === 'verifyCodeBtn' ? 'Verify Code' : 'Sign In';
+    }
+}
+
+function updateStatus(status) {
+    const dot = document.getElementById('statusDot');
+    const text = document.getElementById('statusText');
+    
+    if (status.connected && status.authenticated) {
+        dot.classList.remove('offline');
+        text.textContent = status.warmup === 'running' ? 'Online (loading chats...)' : 'Online';
+    } else if (status.ready === false) {
+        dot.classList.add('offline');
+        text.textContent = status.phase === 'authorizing' ? 'Authorizing...' : 'Connecting...';
+    } else {
+        dot.classList.add('offline');
+        text.textContent = 'Disconnected';
+    }
+}
+
+function showToast(message, type = 'info') {
+    const toast = document.getElementById('toast');
+    const icon = type === 'success' ? 'check-circle' : 
+                type === 'error' ? 'exclamation-circle' : 
+                type === 'warning' ? 'exclamation-triangle' : 'info-circle';
+    
+    toast.innerHTML = `<i class="fas fa-${icon}" style="margin-right: 10px;"></i> ${message}`;
+    toast.classList.add('show');
+    
+    setTimeout(() => toast.classList.remove('show'), 3000);
+}
+
+function showNotification(title, body) {
+    if (!document.hasFocus() && 'Notification' in window && Notification.permission === 'granted') {
+        new Notification(title, {
+            body: body,
+            icon: 'https://telegram.org/img/t_logo.png',
+            badge: 'https://telegram.org/img/t_logo.png'
+        });
+    }
+}
+
+function scrollToBottom() {
+    messageView.scrollToEnd();
+}
+
+function formatTime(date) {
+    const hours = date.getHours();
+    const minutes = date.getMinutes();
+    const ampm = hours >= 12 ? 'PM' : 'AM';
+    const formattedHours = hours % 12 || 12;
+    return `${formattedHours}:${minutes.toString().padStart(2, '0')} ${ampm}`;
+}
+
+function formatDate(date) {
+    return date.toLocaleDateString('en-US', {
+        month: 'short',
+        day: 'numeric',
+        year: 'numeric'
+    });
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+// Ask for the smallest thumbnail width that is sharp at 320 CSS pixels on this screen
+const THUMB_WIDTHS = [160, 320, 640, 1280];
+function thumbnailUrl(url) {
+    if (!url.startsWith('/api/media/')) return url;
+    const wanted = 320 * (window.devicePixelRatio || 1);
+    const width = THUMB_WIDTHS.find(w => w >= wanted) || THUMB_WIDTHS[THUMB_WIDTHS.length - 1];
+    return url.replace(/([?&])w=\d+/, `$1w=${width}`);
+}
+
+function createMessageElement(msg) {
+    const messageEl = document.createElement('div');
+    messageEl.className = `message ${msg.is_outgoing ? 'outgoing' : 'incoming'}`;
+    if (msg.fresh) {
+        messageEl.classList.add('fresh');
+        delete msg.fresh;
+    }
+    if (msg.id) messageEl.dataset.messageId = msg.id;
+    else if (msg.is_outgoing) messageEl.dataset.pending = '1';
+
+    const initials = (msg.sender_name || 'U').split(' ').map(n => n[0]).join('').substring(0, 2).toUpperCase();
+    const time = formatTime(new Date(msg.date));
+
+    // Determine bubble content (text + optional media)
+    let mediaHtml = '';
+    if (msg.media && msg.media_type) {
+        // Previews are Telegram's own thumbnails; the full file is only fetched on click
+        const isImage = (msg.media_type === 'photo' || msg.media_type === 'image') && typeof msg.media === 'string'
+                && (msg.media.startsWith('/api/media/') || msg.media.startsWith('data:image/'));
+        const preview = isImage ? msg.media : msg.media_thumb;
+        if (msg.media_type === 'video' && msg.media_full) {
+            // Streamed with Range requests; nothing is fetched until playback starts
+            const size = msg.media_width && msg.media_height
+                ? `width="${msg.media_width}" height="${msg.media_height}"` : '';
+            const poster = preview ? `poster="${thumbnailUrl(preview)}"` : '';
+            mediaHtml = `
+                <div class="message-media">
+                    <video controls preload="none" ${poster} ${size} src="${msg.media_full}"></video>
+                </div>
+            `;
+        } else if (preview) {
+            const size = msg.media_width && msg.media_height
+                ? `width="${msg.media_width}" height="${msg.media_height}"` : '';
+            // The inline blurred placeholder shows until the thumbnail arrives
+            const placeholder = msg.media_placeholder
+                ? `style="background-image: url('${msg.media_placeholder}')"` : '';
+            const play = msg.media_type === 'video' ? '<span class="media-play"><i class="fas fa-play"></i></span>' : '';
+            const caption = !isImage && msg.media_type !== 'video'
+                ? `<em>${escapeHtml(String(msg.media))}</em>` : '';
+            mediaHtml = `
+                <div class="message-media">
+                    <a class="media-preview" href="${msg.media_full || preview}" target="_blank" rel="noopener">
+                        <img src="${thumbnailUrl(preview)}" alt="${escapeHtml(msg.media_type)}" ${size} ${placeholder} loading="lazy" decoding="async" />
+                        ${play}
+                    </a>
+                    ${caption}
+                </div>
+            `;
+        } else if (msg.media_full) {
+            mediaHtml = `<div class="message-media"><a href="${msg.media_full}" target="_blank" rel="noopener"><em>${escapeHtml(String(msg.media))}</em></a></div>`;
+        } else {
+            // show textual placeholder (image too large, document, etc.)
+            mediaHtml = `<div class="message-media"><em>${escapeHtml(String(msg.media))}</em></div>`;
+        }
+    }
+
+    // message text (escapeHtml) - if message.text can be empty, we still want to show media
+    const textHtml = msg.text ? `<div class="message-text">${escapeHtml(msg.text)}</div>` : '';
+
+    messageEl.innerHTML = `
+        <div class="message-avatar">${initials}</div>
+        <div>
+            ${!msg.is_outgoing ? `<div class="message-sender">${escapeHtml(msg.sender_name)}</div>` : ''}
+            <div class="message-bubble">
+                ${mediaHtml}
+                ${textHtml}
+                <div class="message-time">
+                    ${time}
+                    ${msg.is_outgoing ? '<i class="fas fa-check"></i>' : ''}
+                </div>
+            </div>
+        </div>
+    `;
+    return messageEl;
+}
+
+function findMessage(id) {
+    return messageView.items.find(msg => msg.id === id);
+}
+
+function appendMessage(msg) {
+    msg.fresh = true;
+    messageView.mount();
+    messageView.append([msg]);
+    scrollToBottom();
+}
+
+// Insert an older page above the current messages without moving the viewport
+function prependMessages(messages) {
+    messageView.prepend(messages.filter(msg => !findMessage(msg.id)));
+}
+
+// Older history is paged with the cursor returned by /api/messages
+let historyCursor = null;
+let historyLoading = false;
+async function loadOlderMessages() {
+    if (!currentChatId || !historyCursor || historyLoading) return;
+    const chatId = currentChatId;
+    historyLoading = true;
+    try {
+        const params = { chat_id: chatId, cursor: historyCursor };
+        const data = await rpc.call('messages', params, {
+            channel: 'history',
+            http: signal => fetchJson(`/api/messages/${chatId}?${new URLSearchParams({ cursor: historyCursor })}`, { signal })
+        });
+        if (data.cancelled || chatId !== currentChatId) return;
+        if (data.success) {
+            historyCursor = data.next_cursor;
+            prependMessages(data.messages);
+            saveMessages(chatId);
+        }
+    } catch (error) {
+        console.error('Load older messages error:', error);
+    } finally {
+        historyLoading = false;
+    }
+}
+
+// Batched updates for the open chat: new, edited and deleted messages
+function handleChatUpdates(data) {
+    if (!currentChatId || data.chat_id != currentChatId || !messageView.mounted) return;
+    const stick = messageView.isAtEnd();
+
+    const added = [];
+    (data.added || []).forEach(msg => {
+        if (findMessage(msg.id)) return;
+        // Our own messages are already shown optimistically; just attach the ID
+        const pending = msg.is_outgoing && messageView.items.find(m => !m.id && m.is_outgoing);
+        if (pending) {
+            pending.id = msg.id;
+            messageView.refresh(messageKey(pending));
+            return;
+        }
+        msg.fresh = true;
+        added.push(msg);
+    });
+    if (added.length) messageView.append(added);
+
+    // Only the affected rows are touched; rows outside the window just update their item
+    (data.edited || []).forEach(change => {
+        const msg = findMessage(change.id);
+        if (!msg || change.text === undefined) return;
+        msg.text = change.text;
+        messageView.refresh(messageKey(msg));
+    });
+
+    (data.deleted || []).forEach(id => {
+        const msg = findMessage(id);
+        if (msg) messageView.remove(messageKey(msg));
+    });
+
+    if (added.length && stick) scrollToBottom();
+    saveMessages(currentChatId);
+}
+
+// Dialog summary diffs: patch the cached list instead of reloading it
+function handleDialogUpdates(data) {
+    let unknown = false;
+    let reorder = false;
+    (data.dialogs || []).forEach(diff => {
+        const chat = chats.find(c => c.id === diff.id);
+        if (!chat) {
+            if (diff.name !== undefined) chats.push(diff);
+            else unknown = true;
+            reorder = true;
+            return;
+        }
+        const previousUnread = chat.unread_count;
+        Object.assign(chat, diff);
+        if (diff.timestamp !== undefined) reorder = true;
+        if (diff.unread_count > previousUnread && chat.id !== currentChatId) {
+            showNotification(chat.name, chat.last_message);
+        }
+        chatView.refresh(chat.id);
+    });
+    if (unknown) {
+        loadChats();
+        return;
+    }
+    if (reorder) {
+        // Rows already rendered are reused, so this only moves them
+        chats.sort((a, b) => (b.timestamp || 0) - (a.timestamp || 0));
+        filterChats(document.getElementById('chatSearch').value);
+    }
+    saveDialogs();
+}
+
+// The latest page of a chat, or only its changes when we have a since cursor
+function fetchLatestMessages(chatId, since) {
+    const params = since ? { since } : {};
+    return rpc.call('messages', { chat_id: chatId, ...params }, {
+        channel: 'messages',
+        http: signal => fetchJson(`/api/messages/${chatId}?${new URLSearchParams(params)}`, { signal })
+    });
+}
+
+function applyLatestMessages(chatId, data) {
+    if (data.added) {
+        handleChatUpdates({ chat_id: chatId, ...data });
+    } else {
+        messageView.setItems(data.messages);
+        historyCursor = data.next_cursor;
+        scrollToBottom();
+    }
+    messagesSince[chatId] = data.since;
+    saveMessages(chatId);
+}
+
+// Updates pushed while the socket was down were missed; fetch them as a delta
+async function catchUpChat(chatId) {
+    if (!messagesSince[chatId]) return;
+    try {
+        const data = await fetchLatestMessages(chatId, messagesSince[chatId]);
+        if (data.success && !data.cancelled && chatId === currentChatId) applyLatestMessages(chatId, data);
+    } catch (error) {
+        console.error('Catch-up error:', error);
+    }
+}
+
+// ensure that when loading messages from /api/messages they render media too
+async function selectChat(chatId, chatName) {
+    if (socket && currentChatId !== chatId) {
+        if (currentChatId) socket.emit('unsubscribe_chat', { chat_id: currentChatId });
+        socket.emit('subscribe_chat', { chat_id: chatId });
+    }
+    currentChatId = chatId;
+    historyCursor = null;
+    // Loads for the chat we are leaving are no longer wanted
+    rpc.cancelChannel('messages');
+    rpc.cancelChannel('history');
+    messageView.clear();
+    document.getElementById('chatTitle').textContent = chatName;
+    document.getElementById('messageInputContainer').style.display = 'flex';
+    renderExportStatus();
+
+    const container = document.getElementById('messagesContainer');
+    container.innerHTML = `
+        <div style="margin: auto;">
+            <div class="loading-spinner"></div>
+        </div>
+    `;
+
+    // Update active chat
+    document.querySelectorAll('.chat-item').forEach(el => el.classList.remove('active'));
+    document.querySelector(`[data-chat-id="${chatId}"]`)?.classList.add('active');
+
+    // Show the cached page first, then fetch only what changed since it was saved
+    const cached = await cacheStore.get('messages', chatId);
+    if (chatId !== currentChatId) return;
+    if (cached) {
+        messageView.setItems(cached.messages);
+        historyCursor = cached.next_cursor;
+        messagesSince[chatId] = cached.since;
+        scrollToBottom();
+    }
+
+    try {
+        const data = await fetchLatestMessages(chatId, cached ? cached.since : null);
+        if (data.cancelled || chatId !== currentChatId) return;
+
+        if (data.success) {
+            applyLatestMessages(chatId, data);
+        } else if (cached) {
+            showToast('Showing cached messages', 'warning');
+        } else {
+            container.innerHTML = `
+                <div class="empty-state">
+                    <i class="fas fa-exclamation-circle"></i>
+                    <p>Failed to load messages</p>
+                </div>
+            `;
+        }
+    } catch (error) {
+        if (cached) {
+            showToast('Offline: showing cached messages', 'warning');
+            return;
+        }
+        container.innerHTML = `
+            <div class="empty-state">
+                <i class="fas fa-exclamation-circle"></i>
+                <p>Connection error</p>
+            </div>
+        `;
+    }
+}
+
+
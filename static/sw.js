@@ -0,0 +1,76 @@
+// Service worker for the web client: keeps the page shell, its assets and
+// media thumbnails in Cache Storage so a reload paints without the network.
+// Dialogs and messages are cached by the page itself, in IndexedDB.
+const SHELL_CACHE = 'shell-v1';
+const ASSET_CACHE = 'assets-v1';
+const ASSET_CACHE_ENTRIES = 100;  // Room for a few deploys' worth of fingerprinted files
+const MEDIA_CACHE = 'media-v1';
+const MEDIA_CACHE_ENTRIES = 1000;
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.add('/'))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(
+                keys.filter(key => ![SHELL_CACHE, ASSET_CACHE, MEDIA_CACHE].includes(key)).map(key => caches.delete(key))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+
+    if (request.mode === 'navigate') {
+        // The page changes on deploys, so prefer the network and fall back offline
+        event.respondWith(
+            fetch(request)
+                .then(response => {
+                    const copy = response.clone();
+                    if (response.ok) caches.open(SHELL_CACHE).then(cache => cache.put('/', copy));
+                    return response;
+                })
+                .catch(() => caches.match('/'))
+        );
+    } else if (url.origin === location.origin && url.pathname.startsWith('/static/dist/')) {
+        // Fingerprinted assets never change under the same name
+        event.respondWith(cacheFirst(ASSET_CACHE, request, ASSET_CACHE_ENTRIES));
+    } else if (isThumbnail(url)) {
+        event.respondWith(cacheFirst(MEDIA_CACHE, request, MEDIA_CACHE_ENTRIES));
+    }
+});
+
+// Chat media previews and versioned profile thumbnails; never originals or streams
+function isThumbnail(url) {
+    if (/^\/api\/photo\/-?\d+\/thumb$/.test(url.pathname)) return url.searchParams.has('v');
+    return url.pathname.startsWith('/api/media/') && !url.searchParams.has('full');
+}
+
+async function cacheFirst(cacheName, request, maxEntries = 0) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(request);
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.ok) {
+        await cache.put(request, response.clone());
+        if (maxEntries) trimCache(cache, maxEntries);
+    }
+    return response;
+}
+
+async function trimCache(cache, maxEntries) {
+    // Keys come back in insertion order, so the oldest entries go first
+    const keys = await cache.keys();
+    for (let i = 0; i < keys.length - maxEntries; i++) {
+        await cache.delete(keys[i]);
+    }
+}
@@ -0,0 +1,903 @@
+#!/usr/bin/env python3
+"""
+Offline load test for telemain.py
+Usage: python telebench.py [run|serve|load] [options]
+
+`serve` runs the web client against FakeTelegramClient, an in-process
+stand-in for Telethon with generated dialogs, messages, media and update
+bursts, simulated latency and flood waits. `load` drives the HTTP API and
+Socket.IO of a running server concurrently and reports throughput, latency
+percentiles, event-loop lag and peak RSS. `run` (the default) does both.
+"""
+
+import argparse
+import asyncio
+import heapq
+import io
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+from telethon import TelegramClient, events, functions, utils
+from telethon.errors import FloodWaitError
+from telethon.tl import types
+from telethon.tl.custom import Dialog
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import aiohttp
+    import socketio
+except ImportError:
+    aiohttp = None
+    socketio = None
+
+logger = logging.getLogger('telebench')
+
+SELF_ID = 999
+USER_BASE_ID = 1000
+CHAT_BASE_ID = 2000
+CHANNEL_BASE_ID = 3000
+SENDER_POOL = 50  # Group members shared by every group chat
+PAGE_SIZE = 100  # Messages per simulated history/search request
+MESSAGE_SPACING = 300  # Seconds between generated messages in a chat
+WORDS = (
+    "hello world photo video meeting lunch project deadline release build test "
+    "server client cache socket thread loop image archive music travel weekend "
+    "coffee morning evening report invoice budget design review merge branch "
+    "bug fix deploy backup update download upload search index query result "
+    "family friends party birthday holiday ticket flight hotel train city"
+).split()
+FIRST_NAMES = ("Alice", "Bob", "Carol", "Dave", "Eve", "Frank", "Grace", "Heidi", "Ivan", "Judy")
+LAST_NAMES = ("Smith", "Jones", "Brown", "Miller", "Davis", "Garcia", "Wilson", "Moore", None)
+
+class EmptyEntityCache:
+    """Entity cache that never has an input peer, so entities passed along are used"""
+
+    def get(self, entity_id):
+        return None
+
+class FakeTelegramClient:
+    """Stand-in for TelegramClient serving generated data with simulated latency"""
+
+    def __init__(self, config, session=None, api_id=None, api_hash=None, **kwargs):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self._self_id = SELF_ID
+        self._mb_entity_cache = EmptyEntityCache()
+        self.parse_mode = None  # Message.text returns the raw text
+        self.flood_sleep_threshold = kwargs.get('flood_sleep_threshold', 60)
+        self.connected = False
+        self.handlers = []
+        self.burst_task = None
+        self.calls = Counter()
+        self.flood_waits = 0
+        self.jpegs = {}
+        self.me = types.User(
+            id=SELF_ID, is_self=True, access_hash=SELF_ID,
+            first_name='Bench', last_name='User', username='bench', phone='10000000000'
+        )
+        self.entities = {SELF_ID: self.me}
+        self.chat_ids = []
+        self.texts = {}  # chat_id -> message texts, index = message id - 1
+        self.last_dates = {}  # chat_id -> timestamp of the newest message
+        self.unread = Counter()
+        self.overrides = {}  # (chat_id, message_id) -> edited or newly sent message
+        self.deleted = set()
+        self.index = defaultdict(lambda: defaultdict(list))  # word -> chat_id -> message ids
+        self.build_world()
+
+    # World generation
+
+    def build_world(self):
+        now = time.time()
+        for i in range(SENDER_POOL):
+            self.make_user(USER_BASE_ID + self.config.dialogs + i)
+        for i in range(self.config.dialogs):
+            kind = i % 7
+            if kind < 4:
+                entity = self.make_user(USER_BASE_ID + i)
+            elif kind < 6:
+                entity = types.Chat(
+                    id=CHAT_BASE_ID + i, title=f"Group {i}", photo=self.make_chat_photo(i),
+                    participants_count=SENDER_POOL, date=None, version=1
+                )
+            else:
+                entity = types.Channel(
+                    id=CHANNEL_BASE_ID + i, title=f"Channel {i}", photo=self.make_chat_photo(i),
+                    date=None, broadcast=True, access_hash=CHANNEL_BASE_ID + i
+                )
+            chat_id = utils.get_peer_id(entity)
+            self.entities[chat_id] = entity
+            self.chat_ids.append(chat_id)
+
+            count = self.config.messages
+            texts = []
+            for message_id in range(1, count + 1):
+                text = ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(3, 12)))
+                texts.append(text)
+                for word in set(text.split()):
+                    self.index[word][chat_id].append(message_id)
+            self.texts[chat_id] = texts
+            # Activity falls off with the dialog's position, like a real account
+            self.last_dates[chat_id] = now - i * 600 - self.random.random() * 600
+
+    def make_user(self, user_id):
+        rng = random.Random(user_id)
+        photo = None
+        if rng.random() < 0.7:
+            photo = types.UserProfilePhoto(photo_id=user_id * 10, dc_id=1)
+        user = types.User(
+            id=user_id, access_hash=user_id,
+            first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+            photo=photo
+        )
+        self.entities[user_id] = user
+        return user
+
+    def make_chat_photo(self, i):
+        if i % 3 == 0:
+            return types.ChatPhotoEmpty()
+        return types.ChatPhoto(photo_id=(CHAT_BASE_ID + i) * 10, dc_id=1)
+
+    def make_photo(self, photo_id):
+        return types.Photo(
+            id=photo_id, access_hash=photo_id, file_reference=b'', date=None, dc_id=1,
+            sizes=[
+                types.PhotoStrippedSize(type='i', bytes=b'\x01\x28\x1e' + bytes(64)),
+                types.PhotoSize(type='m', w=320, h=240, size=20_000),
+                types.PhotoSize(type='x', w=800, h=600, size=90_000),
+                types.PhotoSizeProgressive(type='y', w=1280, h=960, sizes=[40_000, 120_000, 210_000])
+            ]
+        )
+
+    def make_video(self, document_id):
+        return types.Document(
+            id=document_id, access_hash=document_id, file_reference=b'', date=None,
+            mime_type='video/mp4', size=self.config.video_size, dc_id=1,
+            attributes=[types.DocumentAttributeVideo(duration=30, w=1280, h=720, supports_streaming=True)],
+            thumbs=[
+                types.PhotoStrippedSize(type='i', bytes=b'\x01\x28\x17' + bytes(64)),
+                types.PhotoSize(type='m', w=320, h=180, size=15_000)
+            ]
+        )
+
+    def top_id(self, chat_id):
+        return len(self.texts[chat_id])
+
+    def message_date(self, chat_id, message_id):
+        return self.last_dates[chat_id] - (self.top_id(chat_id) - message_id) * MESSAGE_SPACING
+
+    def make_message(self, chat_id, message_id):
+        """Build (or look up) one message; generated ones are derived from their ids"""
+        key = (chat_id, message_id)
+        if key in self.deleted or not 0 < message_id <= self.top_id(chat_id):
+            return None
+        if key in self.overrides:
+            return self.overrides[key]
+
+        entity = self.entities[chat_id]
+        rng = random.Random(hash(key) ^ self.config.seed)
+        peer = utils.get_peer(entity)
+        out = False
+        from_id = None
+        post = None
+        if isinstance(entity, types.User):
+            out = rng.random() < 0.4
+            from_id = types.PeerUser(SELF_ID if out else entity.id)
+        elif isinstance(entity, types.Chat):
+            out = rng.random() < 0.1
+            sender = SELF_ID if out else USER_BASE_ID + self.config.dialogs + rng.randrange(SENDER_POOL)
+            from_id = types.PeerUser(sender)
+        else:
+            post = True
+
+        media = None
+        if rng.random() < self.config.media_ratio:
+            media_id = abs(chat_id) * 100_000 + message_id
+            if rng.random() < 0.8:
+                media = types.MessageMediaPhoto(photo=self.make_photo(media_id))
+            else:
+                media = types.MessageMediaDocument(document=self.make_video(media_id))
+
+        return types.Message(
+            id=message_id, peer_id=peer, from_id=from_id, out=out, post=post,
+            date=datetime.fromtimestamp(self.message_date(chat_id, message_id), timezone.utc),
+            message=self.texts[chat_id][message_id - 1], media=media
+        )
+
+    def finish(self, message):
+        message._finish_init(self, self.entities, None)
+        return message
+
+    # Simulated network
+
+    async def rpc(self, name, size=0):
+        """Simulate one request: maybe a flood wait, then latency plus transfer time"""
+        self.calls[name] += 1
+        config = self.config
+        if config.flood_rate and self.random.random() < config.flood_rate:
+            self.flood_waits += 1
+            if config.flood_seconds > self.flood_sleep_threshold:
+                raise FloodWaitError(request=None, capture=config.flood_seconds)
+            # Telethon sleeps through short flood waits by itself
+            await asyncio.sleep(config.flood_seconds)
+        jitter = self.random.uniform(1 - config.jitter, 1 + config.jitter)
+        await asyncio.sleep(config.latency * jitter + size / (config.bandwidth * 1024 * 1024))
+
+    def jpeg(self, width, height):
+        """A cached JPEG of the given size (random bytes without Pillow)"""
+        key = (width, height)
+        if key not in self.jpegs:
+            if Image is None:
+                self.jpegs[key] = os.urandom(width * height // 10)
+            else:
+                buffer = io.BytesIO()
+                color = tuple(self.random.randrange(256) for _ in range(3))
+                Image.new('RGB', key, color).save(buffer, 'JPEG', quality=80)
+                self.jpegs[key] = buffer.getvalue()
+        return self.jpegs[key]
+
+    # TelegramClient API used by telemain.py
+
+    async def connect(self):
+        await self.rpc('connect')
+        self.connected = True
+        if self.config.burst_interval > 0 and self.burst_task is None:
+            self.burst_task = asyncio.ensure_future(self.run_bursts())
+
+    async def disconnect(self):
+        self.connected = False
+        if self.burst_task:
+            self.burst_task.cancel()
+            self.burst_task = None
+
+    def is_connected(self):
+        return self.connected
+
+    async def is_user_authorized(self):
+        return True
+
+    async def get_me(self):
+        await self.rpc('users.getUsers')
+        return self.me
+
+    async def log_out(self):
+        await self.disconnect()
+        return True
+
+    def on(self, event):
+        def decorator(handler):
+            self.handlers.append((event, handler))
+            return handler
+        return decorator
+
+    def resolve(self, entity):
+        if isinstance(entity, (types.InputPeerSelf, types.PeerUser)) and getattr(entity, 'user_id', SELF_ID) == SELF_ID:
+            return SELF_ID
+        chat_id = utils.get_peer_id(entity)
+        if chat_id not in self.entities:
+            raise ValueError(f"Could not find the input entity for {entity!r}")
+        return chat_id
+
+    async def get_entity(self, entity):
+        await self.rpc('users.getUsers')
+        return self.entities[self.resolve(entity)]
+
+    async def get_input_entity(self, entity):
+        return utils.get_input_peer(self.entities[self.resolve(entity)])
+
+    def build_dialog(self, chat_id):
+        top = self.top_id(chat_id)
+        message = None
+        while top > 0 and message is None:
+            message = self.make_message(chat_id, top)
+            top -= 1
+        raw = types.Dialog(
+            peer=utils.get_peer(self.entities[chat_id]),
+            top_message=message.id if message else 0,
+            read_inbox_max_id=0, read_outbox_max_id=0,
+            unread_count=self.unread[chat_id], unread_mentions_count=0,
+            unread_reactions_count=0, unread_poll_votes_count=0,
+            notify_settings=types.PeerNotifySettings()
+        )
+        return raw, message
+
+    async def iter_dialogs(self, limit=None, **kwargs):
+        ordered = sorted(self.chat_ids, key=lambda chat_id: -self.last_dates[chat_id])
+        if limit is not None:
+            ordered = ordered[:limit]
+        for start in range(0, len(ordered), PAGE_SIZE):
+            await self.rpc('messages.getDialogs')
+            for chat_id in ordered[start:start + PAGE_SIZE]:
+                raw, message = self.build_dialog(chat_id)
+                if message:
+                    self.finish(message)
+                yield Dialog(self, raw, self.entities, message)
+
+    async def __call__(self, request):
+        if isinstance(request, functions.messages.GetPeerDialogsRequest):
+            await self.rpc('messages.getPeerDialogs')
+            dialogs, messages, chats, users = [], [], [], []
+            for peer in request.peers:
+                chat_id = self.resolve(peer.peer)
+                raw, message = self.build_dialog(chat_id)
+                dialogs.append(raw)
+                if message:
+                    messages.append(message)
+                entity = self.entities[chat_id]
+                (users if isinstance(entity, types.User) else chats).append(entity)
+            users.extend(
+                self.entities[user_id] for user_id in range(USER_BASE_ID, USER_BASE_ID + self.config.dialogs + SENDER_POOL)
+                if user_id in self.entities
+            )
+            return types.messages.PeerDialogs(
+                dialogs=dialogs, messages=messages, chats=chats, users=users,
+                state=types.updates.State(pts=0, qts=0, date=None, seq=0, unread_count=0)
+            )
+        raise NotImplementedError(f"{type(request).__name__} is not simulated")
+
+    def matching_ids(self, chat_id, query):
+        """Ids in a chat whose text contains every word of the query, newest first"""
+        words = query.lower().split()
+        if not words:
+            return []
+        candidates = set()
+        for word in WORDS:
+            if word.startswith(words[0]):
+                candidates.update(self.index[word].get(chat_id, ()))
+        texts = self.texts[chat_id]
+        return sorted(
+            (message_id for message_id in candidates if all(word in texts[message_id - 1].lower() for word in words[1:])),
+            reverse=True
+        )
+
+    def history_ids(self, chat_id, offset_id=0, max_id=0, min_id=0, reverse=False):
+        top = self.top_id(chat_id)
+        upper = min(x for x in (offset_id, max_id, top + 1) if x) - 1
+        if reverse:
+            return range(min_id + 1, top + 1)
+        return range(upper, min_id, -1)
+
+    async def iter_messages(self, entity, limit=None, *, offset_id=0, max_id=0, min_id=0,
+                            search=None, reverse=False, ids=None, **kwargs):
+        if ids is not None:
+            yield await self.get_messages(entity, ids=ids)
+            return
+        if limit == 0:
+            return
+
+        if entity is None:
+            # Global search: newest matches across every chat
+            def stream(chat_id):
+                return (
+                    (-self.message_date(chat_id, message_id), chat_id, message_id)
+                    for message_id in self.matching_ids(chat_id, search or '')
+                )
+            streams = [stream(chat_id) for chat_id in self.chat_ids]
+            keys = ((chat_id, message_id) for _, chat_id, message_id in heapq.merge(*streams))
+            request_name = 'messages.searchGlobal'
+        else:
+            chat_id = self.resolve(entity)
+            if search:
+                ids_iter = (
+                    message_id for message_id in self.matching_ids(chat_id, search)
+                    if (not offset_id or message_id < offset_id) and message_id > min_id
+                )
+                request_name = 'messages.search'
+            else:
+                ids_iter = self.history_ids(chat_id, offset_id, max_id, min_id, reverse)
+                request_name = 'messages.getHistory'
+            keys = ((chat_id, message_id) for message_id in ids_iter)
+
+        count = 0
+        for chat_id, message_id in keys:
+            if count % PAGE_SIZE == 0:
+                await self.rpc(request_name)
+            message = self.make_message(chat_id, message_id)
+            if message is None:
+                continue
+            yield self.finish(message)
+            count += 1
+            if limit is not None and count >= limit:
+                return
+
+    async def get_messages(self, entity, limit=None, ids=None, **kwargs):
+        if ids is not None:
+            await self.rpc('messages.getMessages')
+            chat_id = self.resolve(entity)
+            if isinstance(ids, list):
+                return [self.finish(m) if m else None for m in (self.make_message(chat_id, i) for i in ids)]
+            message = self.make_message(chat_id, ids)
+            return self.finish(message) if message else None
+        return [message async for message in self.iter_messages(entity, limit, **kwargs)]
+
+    def media_bytes(self, message, thumb=None):
+        media = message.media
+        photo = getattr(media, 'photo', None)
+        if photo is not None:
+            sizes = [size for size in photo.sizes if hasattr(size, 'w')]
+            size = next((size for size in sizes if size.type == thumb), sizes[-1])
+            return self.jpeg(size.w, size.h)
+        document = getattr(media, 'document', None)
+        if document is None:
+            return None
+        if thumb is not None:
+            size = next((size for size in document.thumbs if getattr(size, 'type', None) == thumb), None)
+            return self.jpeg(size.w, size.h) if size and hasattr(size, 'w') else None
+        return bytes(document.size)
+
+    async def download_media(self, message, file=None, thumb=None, **kwargs):
+        data = self.media_bytes(message, thumb)
+        if data is None:
+            return None
+        await self.rpc('upload.getFile', len(data))
+        if file is bytes or file is None:
+            return data
+        # Like Telethon, a path without an extension gets one and the path written is returned
+        if thumb is not None or getattr(message.media, 'photo', None) is not None:
+            extension = '.jpg'
+        else:
+            extension = utils.get_extension(message.media)
+        file = TelegramClient._get_proper_filename(file, 'media', extension)
+        with open(file, 'wb') as f:
+            f.write(data)
+        return file
+
+    async def download_profile_photo(self, entity, file=None, download_big=False, **kwargs):
+        photo = getattr(entity, 'photo', None)
+        if not getattr(photo, 'photo_id', None):
+            return None
+        data = self.jpeg(640, 640) if download_big else self.jpeg(160, 160)
+        await self.rpc('upload.getFile', len(data))
+        return data
+
+    async def iter_download(self, file, offset=0, limit=None, request_size=512 * 1024,
+                            file_size=None, **kwargs):
+        size = file_size or getattr(file, 'size', 0)
+        count = 0
+        while offset < size and (limit is None or count < limit):
+            chunk = min(request_size, size - offset)
+            await self.rpc('upload.getFile', chunk)
+            yield bytes(chunk)
+            offset += chunk
+            count += 1
+
+    async def send_message(self, entity, message, **kwargs):
+        await self.rpc('messages.sendMessage')
+        chat_id = self.resolve(entity)
+        sent = self.add_message(chat_id, message, out=True)
+        asyncio.ensure_future(self.dispatch(events.NewMessage.Event(sent)))
+        return sent
+
+    # Update bursts
+
+    def add_message(self, chat_id, text, out=False):
+        entity = self.entities[chat_id]
+        texts = self.texts[chat_id]
+        texts.append(text)
+        message_id = len(texts)
+        for word in set(text.split()):
+            self.index[word][chat_id].append(message_id)
+        self.last_dates[chat_id] = time.time()
+        if isinstance(entity, types.User):
+            from_id = types.PeerUser(SELF_ID if out else entity.id)
+        elif isinstance(entity, types.Chat):
+            from_id = types.PeerUser(
+                SELF_ID if out else USER_BASE_ID + self.config.dialogs + self.random.randrange(SENDER_POOL)
+            )
+        else:
+            from_id = None
+        if not out:
+            self.unread[chat_id] += 1
+        message = types.Message(
+            id=message_id, peer_id=utils.get_peer(entity), from_id=from_id, out=out,
+            post=True if from_id is None else None,
+            date=datetime.fromtimestamp(self.last_dates[chat_id], timezone.utc), message=text
+        )
+        self.overrides[(chat_id, message_id)] = message
+        return self.finish(message)
+
+    async def dispatch(self, event):
+        event._entities = self.entities
+        event._set_client(self)
+        for builder, handler in self.handlers:
+            if type(event) is builder.Event:
+                try:
+                    await handler(event)
+                except Exception as e:
+                    logger.error(f"Handler {handler.__name__} failed: {e}", exc_info=True)
+
+    def pick_chat(self):
+        """Recently active chats get most of the traffic"""
+        ordered = sorted(self.chat_ids, key=lambda chat_id: -self.last_dates[chat_id])
+        return ordered[min(int(self.random.expovariate(1 / 10)), len(ordered) - 1)]
+
+    async def run_bursts(self):
+        while True:
+            await asyncio.sleep(self.config.burst_interval)
+            for _ in range(self.config.burst_size):
+                chat_id = self.pick_chat()
+                roll = self.random.random()
+                if roll < 0.1:
+                    message_id = self.top_id(chat_id)
+                    message = self.make_message(chat_id, message_id)
+                    if message is None:
+                        continue
+                    edited = types.Message(
+                        id=message.id, peer_id=message.peer_id, from_id=message.from_id,
+                        out=message.out, post=message.post, date=message.date, media=message.media,
+                        message=message.message + ' (edited)', edit_date=datetime.now(timezone.utc)
+                    )
+                    self.overrides[(chat_id, message_id)] = edited
+                    await self.dispatch(events.MessageEdited.Event(self.finish(edited)))
+                elif roll < 0.13:
+                    message_id = self.top_id(chat_id)
+                    self.deleted.add((chat_id, message_id))
+                    # Like Telegram, only channel deletions say which chat they belong to
+                    entity = self.entities[chat_id]
+                    peer = utils.get_peer(entity) if isinstance(entity, types.Channel) else None
+                    await self.dispatch(events.MessageDeleted.Event([message_id], peer))
+                else:
+                    text = ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(3, 12)))
+                    message = self.add_message(chat_id, text)
+                    await self.dispatch(events.NewMessage.Event(message))
+
+class LoopLagSampler:
+    """Measure how late the event loop wakes up from short sleeps"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    def reset(self):
+        self.samples = []
+
+    def summary(self):
+        return {
+            'samples': len(self.samples),
+            'p50_ms': percentile(self.samples, 50) * 1000,
+            'p99_ms': percentile(self.samples, 99) * 1000,
+            'max_ms': max(self.samples, default=0) * 1000
+        }
+
+def percentile(values, pct):
+    """Nearest-rank percentile, 0 for no values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def serve(config):
+    """Run telemain.py's server with the fake backend"""
+    os.makedirs(config.workdir, exist_ok=True)
+    os.chdir(config.workdir)  # Session, message store and caches are relative paths
+    import telemain
+    import uvicorn
+    from quart import jsonify
+
+    logging.getLogger().setLevel(config.log_level.upper())
+    fake_clients = []
+
+    def factory(*args, **kwargs):
+        client = FakeTelegramClient(config, *args, **kwargs)
+        fake_clients.append(client)
+        return client
+
+    telemain.telegram_client_factory = factory
+    if config.scheduler_rate:
+        telemain.SCHEDULER_RATE = telemain.SCHEDULER_BURST = config.scheduler_rate
+    sampler = LoopLagSampler()
+
+    @telemain.app.before_serving
+    async def start_sampler():
+        sampler.start()
+
+    @telemain.app.route('/bench/stats')
+    async def bench_stats():
+        fake = fake_clients[-1] if fake_clients else None
+        return jsonify({
+            'loop_lag': sampler.summary(),
+            'peak_rss_mb': peak_rss_mb(),
+            'telegram_calls': dict(fake.calls) if fake else {},
+            'flood_waits': fake.flood_waits if fake else 0
+        })
+
+    @telemain.app.route('/bench/reset', methods=['POST'])
+    async def bench_reset():
+        sampler.reset()
+        for fake in fake_clients:
+            fake.calls.clear()
+            fake.flood_waits = 0
+        return jsonify({'success': True})
+
+    logger.info(f"Serving fake backend from {config.workdir} on port {config.port}")
+    uvicorn.run(telemain.asgi_app, host=config.host, port=config.port,
+                log_level='warning', access_log=False)
+
+class LoadRecorder:
+    """Latencies, errors and bytes per request label"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.bytes = Counter()
+
+    def record(self, label, seconds, ok=True, size=0):
+        self.latencies[label].append(seconds)
+        self.bytes[label] += size
+        if not ok:
+            self.errors[label] += 1
+
+    def report(self, elapsed):
+        rows = {}
+        for label, values in sorted(self.latencies.items()):
+            rows[label] = {
+                'requests': len(values),
+                'errors': self.errors[label],
+                'rps': len(values) / elapsed,
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'mb': self.bytes[label] / (1024 * 1024)
+            }
+        return rows
+
+async def timed_get(session, recorder, label, url, missing_ok=False):
+    """GET a URL, record its latency and return the decoded JSON body (if any)"""
+    start = time.perf_counter()
+    ok = True
+    body = None
+    size = 0
+    try:
+        async with session.get(url) as response:
+            data = await response.read()
+            size = len(data)
+            ok = response.status < 400 or (missing_ok and response.status == 404)
+            if response.status < 400 and response.content_type == 'application/json':
+                body = json.loads(data)
+                ok = body.get('success', True) is not False
+    except Exception:
+        ok = False
+    recorder.record(label, time.perf_counter() - start, ok, size)
+    return body
+
+async def http_worker(session, base_url, recorder, state, deadline, rng):
+    scenarios = ['dialogs'] * 2 + ['messages'] * 4 + ['search'] + ['photo'] * 3 + ['media'] * 2
+    while time.monotonic() < deadline:
+        scenario = rng.choice(scenarios)
+        if scenario == 'dialogs':
+            await timed_get(session, recorder, 'GET /api/dialogs', f"{base_url}/api/dialogs?limit=100")
+        elif scenario == 'messages':
+            chat_id = rng.choice(state['chat_ids'])
+            url = f"{base_url}/api/messages/{chat_id}?limit=50"
+            body = await timed_get(session, recorder, 'GET /api/messages', url)
+            if body and body.get('next_cursor') and rng.random() < 0.5:
+                # Scroll up one page, as the chat view does
+                body = await timed_get(
+                    session, recorder, 'GET /api/messages (older)',
+                    f"{url}&cursor={body['next_cursor']}"
+                ) or body
+            for message in (body or {}).get('messages', []):
+                for key in ('media', 'media_thumb'):
+                    if str(message.get(key) or '').startswith('/api/media/'):
+                        state['media_urls'].append(message[key])
+            del state['media_urls'][:-500]
+        elif scenario == 'search':
+            await timed_get(session, recorder, 'GET /api/search', f"{base_url}/api/search?q={rng.choice(WORDS)}")
+        elif scenario == 'photo':
+            chat_id = rng.choice(state['chat_ids'])
+            await timed_get(session, recorder, 'GET /api/photo/thumb', f"{base_url}/api/photo/{chat_id}/thumb",
+                            missing_ok=True)
+        elif state['media_urls']:
+            await timed_get(session, recorder, 'GET /api/media', base_url + rng.choice(state['media_urls']))
+
+async def socket_worker(base_url, recorder, state, deadline, rng, counters):
+    client = socketio.AsyncClient(reconnection=False)
+    pending = {}
+
+    @client.on('chat_updates')
+    async def on_chat_updates(data):
+        counters['chat_updates'] += 1
+
+    @client.on('dialog_updates')
+    async def on_dialog_updates(data):
+        counters['dialog_updates'] += 1
+
+    @client.on('search_results')
+    async def on_search_results(data):
+        counters['search_results'] += len(data.get('results', []))
+
+    @client.on('search_done')
+    async def on_search_done(data):
+        future = pending.pop(data.get('request_id'), None)
+        if future and not future.done():
+            future.set_result(data)
+
+    start = time.perf_counter()
+    try:
+        await client.connect(base_url, transports=['websocket'])
+    except Exception:
+        recorder.record('socket connect', time.perf_counter() - start, ok=False)
+        return
+    recorder.record('socket connect', time.perf_counter() - start)
+    try:
+        await client.emit('subscribe_dialogs')
+        for chat_id in rng.sample(state['chat_ids'], min(3, len(state['chat_ids']))):
+            await client.emit('subscribe_chat', {'chat_id': chat_id})
+        request_id = 0
+        while time.monotonic() < deadline:
+            request_id += 1
+            future = asyncio.get_running_loop().create_future()
+            pending[request_id] = future
+            start = time.perf_counter()
+            await client.emit('search', {'q': rng.choice(WORDS), 'request_id': request_id, 'fanout': True})
+            try:
+                done = await asyncio.wait_for(future, timeout=max(1.0, deadline - time.monotonic() + 5))
+                recorder.record('socket search', time.perf_counter() - start, bool(done.get('success')))
+            except asyncio.TimeoutError:
+                recorder.record('socket search', time.perf_counter() - start, ok=False)
+            await asyncio.sleep(rng.uniform(0.5, 1.5))
+    finally:
+        await client.disconnect()
+
+async def run_load(config):
+    """Drive a running server and return the report"""
+    if aiohttp is None:
+        raise RuntimeError("The load generator needs aiohttp and python-socketio[asyncio_client]")
+    base_url = config.url.rstrip('/')
+    rng = random.Random(config.seed)
+    recorder = LoadRecorder()
+    counters = Counter()
+    timeout = aiohttp.ClientTimeout(total=180)
+    connector = aiohttp.TCPConnector(limit=config.concurrency * 2)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        # Wait for the server and its (fake) login
+        for _ in range(300):
+            try:
+                async with session.get(f"{base_url}/api/status") as response:
+                    if (await response.json()).get('authenticated'):
+                        break
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+        else:
+            raise RuntimeError(f"Server at {base_url} did not come up")
+
+        async with session.get(f"{base_url}/api/dialogs?limit=1000") as response:
+            dialogs = (await response.json()).get('dialogs', [])
+        state = {'chat_ids': [dialog['id'] for dialog in dialogs], 'media_urls': []}
+        if not state['chat_ids']:
+            raise RuntimeError("Server returned no dialogs")
+
+        await session.post(f"{base_url}/bench/reset")
+        start = time.monotonic()
+        deadline = start + config.duration
+        workers = [
+            http_worker(session, base_url, recorder, state, deadline, random.Random(rng.getrandbits(64)))
+            for _ in range(config.concurrency)
+        ]
+        workers += [
+            socket_worker(base_url, recorder, state, deadline, random.Random(rng.getrandbits(64)), counters)
+            for _ in range(config.sockets)
+        ]
+        await asyncio.gather(*workers)
+        elapsed = time.monotonic() - start
+
+        async with session.get(f"{base_url}/bench/stats") as response:
+            server = await response.json()
+
+    return {
+        'duration_s': elapsed,
+        'concurrency': config.concurrency,
+        'sockets': config.sockets,
+        'requests': recorder.report(elapsed),
+        'socket_events': dict(counters),
+        'server': server
+    }
+
+def print_report(report):
+    print(f"\nDuration {report['duration_s']:.1f}s, {report['concurrency']} HTTP workers, "
+          f"{report['sockets']} Socket.IO clients\n")
+    print(f"{'request':32} {'count':>7} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'MB':>8}")
+    for label, row in report['requests'].items():
+        print(f"{label:32} {row['requests']:7d} {row['errors']:5d} {row['rps']:8.1f} "
+              f"{row['p50_ms']:8.1f} {row['p95_ms']:8.1f} {row['p99_ms']:8.1f} {row['mb']:8.2f}")
+    events_received = ', '.join(f"{name} {count}" for name, count in sorted(report['socket_events'].items()))
+    print(f"\nSocket.IO events received: {events_received or 'none'}")
+    server = report['server']
+    lag = server['loop_lag']
+    print(f"Event loop lag: p50 {lag['p50_ms']:.1f} ms, p99 {lag['p99_ms']:.1f} ms, max {lag['max_ms']:.1f} ms")
+    print(f"Peak RSS: {server['peak_rss_mb']:.1f} MB")
+    calls = ', '.join(f"{name} {count}" for name, count in sorted(server['telegram_calls'].items()))
+    print(f"Fake Telegram calls: {calls} (flood waits: {server['flood_waits']})")
+
+def load(config):
+    report = asyncio.run(run_load(config))
+    print_report(report)
+    if config.json:
+        with open(config.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+def run(config):
+    """Start a fake-backed server in a subprocess, load it, then stop it"""
+    args = [sys.executable, os.path.abspath(__file__), 'serve'] + [
+        arg for arg in sys.argv[1:] if arg != 'run'
+    ]
+    server = subprocess.Popen(args)
+    try:
+        load(config)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for telemain.py")
+    parser.add_argument('mode', nargs='?', default='run', choices=('run', 'serve', 'load'))
+    fake = parser.add_argument_group('fake Telegram backend (serve)')
+    fake.add_argument('--dialogs', type=int, default=200)
+    fake.add_argument('--messages', type=int, default=200, help="messages per dialog")
+    fake.add_argument('--media-ratio', type=float, default=0.3, help="share of messages with media")
+    fake.add_argument('--video-size', type=int, default=4 * 1024 * 1024, help="bytes per video")
+    fake.add_argument('--latency', type=float, default=0.05, help="seconds per Telegram request")
+    fake.add_argument('--jitter', type=float, default=0.5, help="relative latency jitter")
+    fake.add_argument('--bandwidth', type=float, default=10.0, help="download MB/s")
+    fake.add_argument('--flood-rate', type=float, default=0.002, help="chance of a flood wait per request")
+    fake.add_argument('--flood-seconds', type=int, default=1)
+    fake.add_argument('--scheduler-rate', type=float, default=0,
+                      help="override telemain's Telegram requests per second (0 = keep)")
+    fake.add_argument('--burst-interval', type=float, default=2.0, help="seconds between update bursts (0 = off)")
+    fake.add_argument('--burst-size', type=int, default=20, help="updates per burst")
+    fake.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'telebench'))
+    fake.add_argument('--host', default='127.0.0.1')
+    fake.add_argument('--port', type=int, default=5001)
+    fake.add_argument('--log-level', default='warning')
+    driver = parser.add_argument_group('load generator (load)')
+    driver.add_argument('--url', default=None, help="server to load (default: the serve host/port)")
+    driver.add_argument('--duration', type=float, default=20.0)
+    driver.add_argument('--concurrency', type=int, default=16, help="concurrent HTTP workers")
+    driver.add_argument('--sockets', type=int, default=8, help="concurrent Socket.IO clients")
+    driver.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--seed', type=int, default=1)
+    config = parser.parse_args(argv)
+    if config.url is None:
+        config.url = f"http://{config.host}:{config.port}"
+    return config
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    config = parse_args()
+    if config.mode == 'serve':
+        serve(config)
+    elif config.mode == 'load':
+        load(config)
+    else:
+        run(config)
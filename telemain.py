@@ -1,14 +1,33 @@
 import asyncio
+import contextvars
 import json
 import os
+import resource
 import threading
 import base64
+import hashlib
 import logging
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from flask_socketio import SocketIO, emit
-from telethon import TelegramClient, events
-from telethon.tl.types import User, Channel, Chat, PeerUser, PeerChat, PeerChannel
+import mimetypes
+import re
+import shutil
+import sqlite3
+import time
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from itertools import count
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import uvicorn
+from quart import Quart, Response, render_template, request, jsonify, send_file
+from werkzeug.security import safe_join
+from socketio import AsyncServer, ASGIApp
+from telethon import TelegramClient, events, functions, utils
+from telethon.tl.custom import Dialog
+from telethon.tl.types import (
+    User, Channel, Chat, PeerUser, PeerChat, PeerChannel,
+    PhotoSize, PhotoCachedSize, PhotoSizeProgressive, PhotoStrippedSize, DocumentAttributeVideo
+)
 from telethon.errors import (
     SessionPasswordNeededError, 
     PhoneCodeInvalidError, 
@@ -16,9 +35,28 @@ from telethon.errors import (
     FloodWaitError,
     PhoneNumberInvalidError
 )
-from werkzeug.serving import make_server
 import sys
 
+# Optional fast JSON encoder and brotli compression
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+# Optional zstd compression for chat exports (gzip otherwise)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+# Optional image transcoding for chat media thumbnails
+try:
+    from PIL import Image, features as image_features
+except ImportError:
+    Image = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -26,10 +64,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+app = Quart(__name__, static_folder=None)  # static/ is served by static_asset()
 app.config['SECRET_KEY'] = os.urandom(24).hex()
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', ping_timeout=60, ping_interval=25)
+# HTTP routes, Socket.IO and Telethon all share the server's event loop
+socketio = AsyncServer(async_mode='asgi', cors_allowed_origins="*", ping_timeout=60, ping_interval=25)
 
 # Global variables
 telegram_client = None
@@ -39,10 +78,14 @@ client_status = {
     'phone': None, 
     'name': None, 
     'username': None,
-    'user_id': None
+    'user_id': None,
+    'phase': 'starting',  # starting, connecting, authorizing, login_required, ready or failed
+    'warmup': None  # running, done or failed once authorized
 }
+client_ready = asyncio.Event()  # Set once the client has finished starting, whatever the outcome
+startup_task = None
 client_loop = None
-client_thread = None
+telegram_client_factory = TelegramClient  # telebench.py swaps in a fake Telethon backend
 pending_phone = None
 phone_code_hash = None
 
@@ -51,31 +94,1590 @@ API_ID = "36608140"  # Replace with your API ID
 API_HASH = "a0ef79f014d19d5f5f217afab1127330"  # Replace with your API Hash
 SESSION_NAME = "web_client_session"
 
+# Local message store (SQLite + FTS5) used to answer searches without Telegram
+MESSAGE_STORE_PATH = f"{SESSION_NAME}_messages.db"
+SYNC_BACKFILL_LIMIT = 1000  # Messages back-filled per chat on first sync
+SYNC_BATCH_SIZE = 200  # Rows written to the store per transaction
+SYNC_DIALOG_DELAY = 0.5  # Pause between chats so the sync stays under flood limits
+
+# Startup
+CLIENT_READY_TIMEOUT = 30  # Seconds a request waits for the client to finish starting
+WARMUP_ENABLED = True  # Preload dialogs and recent chats' photos once authorized
+WARMUP_CHATS = 50  # Most recent chats whose profile thumbnails are preloaded
+
+# Dialog list served from memory
+DIALOG_PAGE_SIZE = 100
+
+# Recent message changes kept (in the message store, so they survive restarts) for browsers
+# to ask for what changed since their cached copy
+JOURNAL_LIMIT = 5000
+
+# Catching up on updates missed while disconnected or stopped
+CATCH_UP_ENABLED = True  # Keep Telegram's update state in the session and fetch the difference
+RECONCILE_DIALOGS = 20  # Most recent dialogs checked for gaps the difference could not fill
+RECONCILE_DELAY = 3  # Seconds the update loop gets to apply the difference before the check
+
+# Socket.IO updates are coalesced per room and emitted on this interval
+EMIT_BATCH_INTERVAL = 0.25
+DIALOGS_ROOM = 'dialogs'
+
+# Profile photos are served as small thumbnails cached on disk
+PHOTO_CACHE_DIR = f"{SESSION_NAME}_photos"
+PHOTO_CACHE_MAX_AGE = 30 * 24 * 3600  # Thumbnail URLs are versioned, so cache them for long
+PHOTO_NEGATIVE_TTL = 3600  # Re-check chats without a photo after an hour
+PHOTO_FETCH_CONCURRENCY = 8
+PHOTO_BATCH_LIMIT = 200
+
+# Chat history paging and background prefetch of older pages
+HISTORY_PAGE_SIZE = 50
+HISTORY_CACHE_CHATS = 8  # Chats whose prefetched pages are kept in memory
+HISTORY_WINDOW_PAGES = 6  # Prefetched pages kept per chat
+PREFETCH_MAX_DEPTH = 3  # Pages fetched ahead once the user keeps scrolling
+
+# Chat media: size-bounded thumbnails transcoded in a process pool and cached on disk
+MEDIA_CACHE_DIR = f"{SESSION_NAME}_media"
+MEDIA_CACHE_MAX_BYTES = 512 * 1024 * 1024
+MEDIA_CACHE_MAX_AGE = 7 * 24 * 3600
+MEDIA_REFS_LIMIT = 2000  # Recently listed messages kept to avoid re-fetching them
+THUMB_WIDTHS = (160, 320, 640, 1280)
+THUMB_DEFAULT_WIDTH = 320
+THUMB_QUALITY = 80
+TRANSCODE_WORKERS = 2
+STREAM_CHUNK_SIZE = 512 * 1024  # Largest Telegram file request; offsets stay aligned to it
+STREAM_READ_AHEAD = 4  # Chunks downloaded ahead of the one being sent
+
+# Chat history export: compressed JSONL plus content-addressed media files, resumable
+EXPORT_DIR = f"{SESSION_NAME}_exports"
+EXPORT_COMPRESSION = 'zstd' if zstandard else 'gzip'
+EXPORT_ZSTD_LEVEL = 10
+EXPORT_GZIP_LEVEL = 6
+EXPORT_CHUNK_MESSAGES = 500  # Messages per compressed frame; progress is saved after each one
+EXPORT_MEDIA = True  # Download media into the export (listed in its manifest)
+EXPORT_MEDIA_MAX_BYTES = 256 * 1024 * 1024  # Larger files are listed but not downloaded
+EXPORT_CONCURRENCY = 1  # Chats exported at the same time
+EXPORT_PROGRESS_INTERVAL = 1.0  # Seconds between 'export_progress' events
+
+# Streaming search
+SEARCH_BATCH_SIZE = 20  # Results per 'search_results' event
+SEARCH_BATCH_INTERVAL = 0.2  # Seconds before a partial batch is sent anyway
+SEARCH_FANOUT_CHATS = 20  # Most recently active dialogs searched one by one
+SEARCH_FANOUT_CONCURRENCY = 4
+SEARCH_FANOUT_PER_CHAT = 10
+
+# API responses
+COMPRESS_MIN_SIZE = 1024  # Smaller bodies are not worth compressing
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4  # Favour speed, responses are generated per request
+
+# Static assets; `python build_static.py` writes fingerprinted, precompressed copies to static/dist
+STATIC_DIR = os.path.join(app.root_path, 'static')
+ASSET_MANIFEST = os.path.join(STATIC_DIR, 'dist', 'manifest.json')
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # Fingerprinted names change with their content
+
+# Telegram request scheduling
+SCHEDULER_CONCURRENCY = 8  # Telegram requests in flight at once
+SCHEDULER_RATE = 30  # Requests per second overall
+SCHEDULER_BURST = 60
+SCHEDULER_OP_RATES = {  # Requests per second for operations Telegram limits harder
+    'search_messages': 2,
+    'iter_dialogs': 1,
+    'get_entity': 10,
+    'download_profile_photo': 10,
+}
+FLOOD_SLEEP_THRESHOLD = 5  # Telethon sleeps through shorter flood waits itself
+FLOOD_WAIT_MAX = 60  # Longer flood waits fail instead of being retried
+FLOOD_RETRIES = 3
+INTERACTIVE, BACKGROUND = 0, 1
+request_priority = contextvars.ContextVar('request_priority', default=INTERACTIVE)
+
+# Metrics
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOOP_LAG_INTERVAL = 0.1  # Seconds between event loop lag samples
+METRIC_HELP = {
+    'http_request_duration_seconds': 'HTTP request time until the last body byte, by route',
+    'http_response_bytes_total': 'HTTP response body bytes sent, by route',
+    'telegram_request_duration_seconds': 'Time spent waiting on Telethon, by operation',
+    'telegram_queue_wait_seconds': 'Time requests waited for the scheduler, by priority',
+    'telegram_flood_waits_total': 'Flood waits reported by Telegram, by operation',
+    'telegram_coalesced_total': 'Requests that shared an identical in-flight request',
+    'telegram_catch_ups_total': 'Catch-ups on missed updates, by reason (start or reconnect)',
+    'event_loop_lag_seconds': 'How late the event loop woke up from a short sleep',
+    'cache_requests_total': 'Cache lookups by cache and result (hit or miss)',
+    'socketio_events_total': 'Socket.IO events emitted, by event',
+    'rpc_duration_seconds': 'Socket.IO RPC call time, by method and outcome',
+    'dialogs_cached': 'Dialogs held in the in-memory dialog cache',
+    'media_jobs_inflight': 'Media downloads and transcodes currently running',
+    'process_peak_rss_bytes': 'Peak resident set size of the server process',
+}
+
+class Metrics:
+    """In-process counters, gauges and histograms in the Prometheus text format"""
+
+    def __init__(self):
+        self.counters = {}  # name -> {labels: value}
+        self.histograms = {}  # name -> {labels: [count per bucket..., +Inf count, sum]}
+        self.gauges = {}  # name -> function returning the current value
+
+    @staticmethod
+    def key(labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = self.key(labels)
+        series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = self.key(labels)
+        data = series.get(key)
+        if data is None:
+            data = series[key] = [0] * (len(METRIC_BUCKETS) + 1) + [0.0]
+        data[bisect_left(METRIC_BUCKETS, value)] += 1
+        data[-1] += value
+
+    def hit(self, cache, hit):
+        self.inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    @staticmethod
+    def format_labels(key, extra=()):
+        pairs = [*key, *extra]
+        if not pairs:
+            return ''
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+    @staticmethod
+    def quantile(data, q):
+        """Estimate a quantile from bucket counts, interpolating inside the bucket"""
+        counts = data[:-1]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for index, hits in enumerate(counts):
+            if cumulative + hits >= rank and hits:
+                lower = METRIC_BUCKETS[index - 1] if index else 0.0
+                upper = METRIC_BUCKETS[index] if index < len(METRIC_BUCKETS) else METRIC_BUCKETS[-1]
+                return lower + (upper - lower) * (rank - cumulative) / hits
+            cumulative += hits
+        return METRIC_BUCKETS[-1]
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines += [f"# HELP {name} {METRIC_HELP.get(name, name)}", f"# TYPE {name} counter"]
+            lines += [f"{name}{self.format_labels(key)} {value}" for key, value in sorted(series.items())]
+        for name, function in sorted(self.gauges.items()):
+            lines += [f"# HELP {name} {METRIC_HELP.get(name, name)}", f"# TYPE {name} gauge"]
+            lines.append(f"{name} {function()}")
+        for name, series in sorted(self.histograms.items()):
+            lines += [f"# HELP {name} {METRIC_HELP.get(name, name)}", f"# TYPE {name} histogram"]
+            for key, data in sorted(series.items()):
+                cumulative = 0
+                for bound, hits in zip((*METRIC_BUCKETS, '+Inf'), data[:-1]):
+                    cumulative += hits
+                    lines.append(f"{name}_bucket{self.format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{self.format_labels(key)} {data[-1]}")
+                lines.append(f"{name}_count{self.format_labels(key)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Compact summary for the on-page debug panel"""
+        histograms = {}
+        for name, series in self.histograms.items():
+            rows = []
+            for key, data in series.items():
+                total = sum(data[:-1])
+                rows.append({
+                    'labels': dict(key),
+                    'count': total,
+                    'avg_ms': data[-1] / total * 1000 if total else 0,
+                    'p50_ms': self.quantile(data, 0.5) * 1000,
+                    'p95_ms': self.quantile(data, 0.95) * 1000
+                })
+            histograms[name] = sorted(rows, key=lambda row: -row['count'])
+        caches = {}
+        for key, value in self.counters.get('cache_requests_total', {}).items():
+            labels = dict(key)
+            caches.setdefault(labels['cache'], {'hit': 0, 'miss': 0})[labels['result']] += value
+        for counts in caches.values():
+            total = counts['hit'] + counts['miss']
+            counts['ratio'] = counts['hit'] / total if total else None
+        return {
+            'histograms': histograms,
+            'caches': caches,
+            'counters': {
+                name: [{'labels': dict(key), 'value': value} for key, value in series.items()]
+                for name, series in self.counters.items() if name != 'cache_requests_total'
+            },
+            'gauges': {name: function() for name, function in self.gauges.items()}
+        }
+
+metrics = Metrics()
+
+class MessageStore:
+    """Persistent message store with a full-text index"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            chat_id INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            sender_id INTEGER,
+            sender_name TEXT,
+            date INTEGER NOT NULL,
+            text TEXT NOT NULL DEFAULT '',
+            is_outgoing INTEGER NOT NULL DEFAULT 0,
+            is_channel INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS messages_date ON messages (date);
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            text, content='messages', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF text ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+            INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+        END;
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            name TEXT
+        );
+        CREATE TABLE IF NOT EXISTS sync_state (
+            chat_id INTEGER PRIMARY KEY,
+            newest_id INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS journal (
+            seq INTEGER PRIMARY KEY,
+            chat_id INTEGER,
+            kind TEXT NOT NULL,
+            payload TEXT
+        );
+        CREATE TABLE IF NOT EXISTS journal_state (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            epoch TEXT NOT NULL,
+            floor INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(self.SCHEMA)
+
+    @staticmethod
+    def to_timestamp(value):
+        """Convert a datetime (or ISO string) to a UTC unix timestamp"""
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+
+    @staticmethod
+    def build_match_query(query):
+        """Turn free text into a safe FTS5 prefix query"""
+        terms = re.findall(r'\w+', query or '')
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def upsert_messages(self, rows):
+        """Insert or update messages (dicts matching the messages table)"""
+        if not rows:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO messages (chat_id, id, sender_id, sender_name, date, text, is_outgoing, is_channel)
+                VALUES (:chat_id, :id, :sender_id, :sender_name, :date, :text, :is_outgoing, :is_channel)
+                ON CONFLICT (chat_id, id) DO UPDATE SET
+                    sender_name = excluded.sender_name,
+                    text = excluded.text
+                """,
+                rows
+            )
+
+    def delete_messages(self, chat_id, message_ids):
+        """Delete messages; chat_id is None for private chats and basic groups"""
+        if not message_ids:
+            return
+        ids = list(message_ids)
+        placeholders = ','.join('?' * len(ids))
+        with self.lock, self.conn:
+            if chat_id is None:
+                # Message IDs outside channels are unique per account
+                self.conn.execute(
+                    f"DELETE FROM messages WHERE is_channel = 0 AND id IN ({placeholders})",
+                    ids
+                )
+            else:
+                self.conn.execute(
+                    f"DELETE FROM messages WHERE chat_id = ? AND id IN ({placeholders})",
+                    [chat_id, *ids]
+                )
+
+    def find_chat_ids(self, message_ids):
+        """Map private/basic-group message IDs to their chat IDs"""
+        ids = list(message_ids)
+        if not ids:
+            return {}
+        placeholders = ','.join('?' * len(ids))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, chat_id FROM messages WHERE is_channel = 0 AND id IN ({placeholders})",
+                ids
+            ).fetchall()
+        return {row['id']: row['chat_id'] for row in rows}
+
+    def set_chat_name(self, chat_id, name):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO chats (chat_id, name) VALUES (?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET name = excluded.name",
+                (chat_id, name)
+            )
+
+    def get_newest_id(self, chat_id):
+        """Get the newest message ID already synced for a chat"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT newest_id FROM sync_state WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+        return row['newest_id'] if row else 0
+
+    def set_newest_id(self, chat_id, newest_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO sync_state (chat_id, newest_id) VALUES (?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET newest_id = MAX(newest_id, excluded.newest_id)",
+                (chat_id, newest_id)
+            )
+
+    def search(self, query=None, chat_id=None, date_from=None, date_to=None, limit=50):
+        """Search stored messages by text, chat and date range (newest first)"""
+        match = self.build_match_query(query)
+        if query and not match:
+            return []
+
+        conditions = []
+        params = []
+        if match:
+            sql = (
+                "SELECT m.chat_id, m.id, m.sender_name, m.date, m.text, c.name AS chat_name "
+                "FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid "
+                "LEFT JOIN chats c ON c.chat_id = m.chat_id"
+            )
+            conditions.append("messages_fts MATCH ?")
+            params.append(match)
+        else:
+            sql = (
+                "SELECT m.chat_id, m.id, m.sender_name, m.date, m.text, c.name AS chat_name "
+                "FROM messages m LEFT JOIN chats c ON c.chat_id = m.chat_id"
+            )
+            conditions.append("m.text != ''")
+        if chat_id is not None:
+            conditions.append("m.chat_id = ?")
+            params.append(chat_id)
+        if date_from is not None:
+            conditions.append("m.date >= ?")
+            params.append(self.to_timestamp(date_from))
+        if date_to is not None:
+            conditions.append("m.date < ?")
+            params.append(self.to_timestamp(date_to))
+        sql += " WHERE " + " AND ".join(conditions) + " ORDER BY m.date DESC LIMIT ?"
+        params.append(limit)
+
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [
+            {
+                'id': row['id'],
+                'text': row['text'][:200],  # Limit text length
+                'chat_name': row['chat_name'] or 'Unknown',
+                'sender_name': row['sender_name'] or 'Unknown',
+                'date': datetime.fromtimestamp(row['date'], timezone.utc).isoformat(),
+                'chat_id': row['chat_id']
+            }
+            for row in rows
+        ]
+
+    def get_latest_ids(self):
+        """Newest stored message ID per chat, from live updates as well as the sync"""
+        with self.lock:
+            rows = self.conn.execute("SELECT chat_id, MAX(id) AS id FROM messages GROUP BY chat_id").fetchall()
+        return {row['chat_id']: row['id'] for row in rows}
+
+    def load_journal(self, limit):
+        """(epoch, floor, newest entries oldest first) of the saved change journal, or None"""
+        with self.lock:
+            state = self.conn.execute("SELECT epoch, floor FROM journal_state WHERE id = 0").fetchone()
+            if state is None:
+                return None
+            rows = self.conn.execute(
+                "SELECT seq, chat_id, kind, payload FROM journal ORDER BY seq DESC LIMIT ?", (limit,)
+            ).fetchall()
+        entries = [
+            (row['seq'], row['chat_id'], row['kind'], json.loads(row['payload']))
+            for row in reversed(rows)
+        ]
+        return state['epoch'], state['floor'], entries
+
+    def reset_journal(self, epoch):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM journal")
+            self.conn.execute(
+                "INSERT INTO journal_state (id, epoch, floor) VALUES (0, ?, 0) "
+                "ON CONFLICT (id) DO UPDATE SET epoch = excluded.epoch, floor = 0",
+                (epoch,)
+            )
+
+    def append_journal(self, seq, chat_id, kind, payload, floor):
+        """Save a journal entry and drop the ones at or below floor"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO journal (seq, chat_id, kind, payload) VALUES (?, ?, ?, ?)",
+                (seq, chat_id, kind, json.dumps(payload))
+            )
+            if floor:
+                self.conn.execute("DELETE FROM journal WHERE seq <= ?", (floor,))
+                self.conn.execute("UPDATE journal_state SET floor = ? WHERE id = 0", (floor,))
+
+    def clear(self):
+        """Remove everything (used on logout)"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM messages")
+            self.conn.execute("DELETE FROM chats")
+            self.conn.execute("DELETE FROM sync_state")
+            self.conn.execute("DELETE FROM journal")
+            self.conn.execute("DELETE FROM journal_state")
+            self.conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+class StoreWriter:
+    """Runs store calls in order on a worker thread, batching the ones that queue up meanwhile
+
+    Update handlers submit() writes without waiting; run() waits for a call
+    (a read that must see earlier writes, or a write that needs backpressure).
+    """
+
+    def __init__(self):
+        self.pending = []  # (func, args, future or None)
+        self.task = None
+
+    def submit(self, func, *args):
+        """Queue a call; failures are logged"""
+        self._queue(func, args, None)
+
+    async def run(self, func, *args):
+        """Queue a call and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue(func, args, future)
+        return await future
+
+    def _queue(self, func, args, future):
+        self.pending.append((func, args, future))
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.drain())
+
+    async def drain(self):
+        while self.pending:
+            batch, self.pending = self.pending, []
+            outcomes = await asyncio.to_thread(self.execute, batch)
+            for (func, _, future), (result, error) in zip(batch, outcomes):
+                if future is None:
+                    if error is not None:
+                        logger.error(f"Store write {func.__name__} failed: {error}")
+                elif not future.done():
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+
+    @staticmethod
+    def execute(batch):
+        outcomes = []
+        for func, args, _ in batch:
+            try:
+                outcomes.append((func(*args), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+
+class TokenBucket:
+    """Token bucket rate limiter on the event loop clock"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class RequestScheduler:
+    """Admit Telegram requests by priority under rate limits, flood waits and a concurrency cap
+
+    Interactive requests go before background ones (sync, prefetch, warm-up),
+    a flood wait holds back every request of that operation, and identical
+    in-flight requests can be coalesced so concurrent callers share one result.
+    """
+
+    def __init__(self):
+        self.waiters = []  # sorted (priority, seq, op, future)
+        self.seq = count()
+        self.active = 0
+        self.bucket = TokenBucket(SCHEDULER_RATE, SCHEDULER_BURST)
+        self.op_buckets = {op: TokenBucket(rate, rate) for op, rate in SCHEDULER_OP_RATES.items()}
+        self.blocked_until = {}  # op -> loop time at which its flood wait ends
+        self.inflight = {}  # coalescing key -> [future, number of callers waiting on it]
+        self.wakeup = None
+
+    def dispatch(self):
+        """Grant as many waiting requests as the limits allow, then re-arm the timer"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.wakeup:
+            self.wakeup.cancel()
+            self.wakeup = None
+        retry_at = None
+        remaining = []
+        for index, entry in enumerate(self.waiters):
+            future = entry[3]
+            if future.done():
+                continue  # Cancelled while waiting
+            if self.active >= SCHEDULER_CONCURRENCY:
+                remaining.extend(self.waiters[index:])
+                break
+            op = entry[2]
+            bucket = self.op_buckets.get(op)
+            delay = max(
+                self.blocked_until.get(op, now) - now,
+                self.bucket.wait_time(now),
+                bucket.wait_time(now) if bucket else 0.0
+            )
+            if delay > 0:
+                retry_at = min(retry_at or now + delay, now + delay)
+                remaining.append(entry)
+                continue
+            self.bucket.take()
+            if bucket:
+                bucket.take()
+            self.active += 1
+            future.set_result(None)
+        self.waiters = [entry for entry in remaining if not entry[3].done()]
+        if retry_at is not None:
+            self.wakeup = loop.call_at(retry_at, self.dispatch)
+
+    async def acquire(self, op):
+        loop = asyncio.get_running_loop()
+        priority = request_priority.get()
+        future = loop.create_future()
+        insort(self.waiters, (priority, next(self.seq), op, future))
+        start = loop.time()
+        self.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Granted just before the caller went away
+            raise
+        metrics.observe(
+            'telegram_queue_wait_seconds', loop.time() - start,
+            priority='background' if priority == BACKGROUND else 'interactive'
+        )
+
+    def release(self):
+        self.active -= 1
+        self.dispatch()
+
+    def flood_wait(self, op, seconds):
+        logger.warning(f"Flood wait of {seconds}s on {op}")
+        metrics.inc('telegram_flood_waits_total', op=op)
+        until = asyncio.get_running_loop().time() + seconds
+        self.blocked_until[op] = max(self.blocked_until.get(op, 0), until)
+
+    async def coalesce(self, key, factory):
+        """Run factory() once per key; concurrent callers share the same result
+
+        The shared call is cancelled once every caller waiting on it has been
+        cancelled, so abandoned loads stop spending Telegram quota.
+        """
+        entry = self.inflight.get(key)
+        if entry is None:
+            entry = self.inflight[key] = [asyncio.ensure_future(factory()), 0]
+
+            def forget(_):
+                if self.inflight.get(key) is entry:
+                    del self.inflight[key]
+            entry[0].add_done_callback(forget)
+        else:
+            metrics.inc('telegram_coalesced_total', op=str(key[0]) if isinstance(key, tuple) else str(key))
+        future = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            entry[1] -= 1
+            if not entry[1] and not future.done():
+                self.inflight.pop(key, None)
+                future.cancel()
+
+    async def call(self, op, factory, key=None):
+        """Await factory() once admitted, retrying after flood waits
+
+        factory must create a new awaitable on every call so it can be retried.
+        """
+        if key is not None:
+            return await self.coalesce(key, lambda: self.call(op, factory))
+        attempts = 0
+        while True:
+            await self.acquire(op)
+            start = time.perf_counter()
+            status = 'ok'
+            try:
+                return await factory()
+            except FloodWaitError as e:
+                status = 'flood_wait'
+                self.flood_wait(op, e.seconds)
+                attempts += 1
+                if e.seconds > FLOOD_WAIT_MAX or attempts > FLOOD_RETRIES:
+                    raise
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                self.release()
+                metrics.observe('telegram_request_duration_seconds', time.perf_counter() - start, op=op, status=status)
+
+    async def iterate(self, op, factory, page_size=100):
+        """Iterate factory() with one admission per page Telethon requests
+
+        A flood wait before the first item restarts the iteration once the wait
+        is over; later ones are raised, as the position cannot be resumed generically.
+        """
+        iterator = factory()
+        yielded = 0
+        attempts = 0
+        waited = 0.0
+        status = 'ok'
+        try:
+            while True:
+                admitted = yielded % page_size == 0
+                if admitted:
+                    await self.acquire(op)
+                start = time.perf_counter()
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                except FloodWaitError as e:
+                    self.flood_wait(op, e.seconds)
+                    attempts += 1
+                    if yielded or e.seconds > FLOOD_WAIT_MAX or attempts > FLOOD_RETRIES:
+                        status = 'flood_wait'
+                        raise
+                    # Release the abandoned iterator's state before starting over
+                    await close_iterator(iterator)
+                    iterator = factory()
+                    continue
+                finally:
+                    waited += time.perf_counter() - start
+                    if admitted:
+                        self.release()
+                yielded += 1
+                yield item
+        except Exception:
+            if status == 'ok':
+                status = 'error'
+            raise
+        finally:
+            # Also when the consumer stops early (break, aclose() or cancellation)
+            await close_iterator(iterator)
+            metrics.observe('telegram_request_duration_seconds', waited, op=op, status=status)
+
+async def close_iterator(iterator):
+    """Close an async iterator that supports it, releasing its request state now rather than at GC"""
+    if hasattr(iterator, 'aclose'):
+        await iterator.aclose()
+
+def make_preview(message):
+    """Build the short last-message preview shown in the dialog list"""
+    if not message:
+        return "No messages"
+    preview = message.text or '[Media]'
+    if len(preview) > 50:
+        preview = preview[:47] + "..."
+    return preview
+
+class DialogCache:
+    """Dialog list kept in memory and ordered by last activity"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dialogs = {}  # chat_id -> dialog info
+        self.entities = {}  # chat_id -> Telethon entity
+        self.order = []  # Sorted (-timestamp, chat_id) keys, newest first
+        self.loaded = False
+        # Change tracking for "since" requests; a new epoch invalidates older cursors
+        self.epoch = os.urandom(4).hex()
+        self.version = 0
+        self.versions = {}  # chat_id -> version of its last change
+        self.removed = {}  # chat_id -> version at which it left the list
+
+    @staticmethod
+    def sort_key(info):
+        return (-info['timestamp'], info['id'])
+
+    @staticmethod
+    def encode_cursor(key):
+        return f"{-key[0]}_{key[1]}"
+
+    @staticmethod
+    def decode_cursor(cursor):
+        timestamp, chat_id = cursor.rsplit('_', 1)
+        return (-float(timestamp), int(chat_id))
+
+    def replace(self, dialogs):
+        """Replace the whole list with (info, entity) pairs"""
+        with self.lock:
+            previous = self.dialogs
+            self.dialogs = {info['id']: info for info, _ in dialogs}
+            for chat_id, info in self.dialogs.items():
+                if previous.get(chat_id) != info:
+                    self._touch(chat_id)
+            for chat_id in previous.keys() - self.dialogs.keys():
+                self._touch(chat_id, removed=True)
+            self.entities = {info['id']: entity for info, entity in dialogs}
+            self.order = sorted(self.sort_key(info) for info in self.dialogs.values())
+            self.loaded = True
+
+    def upsert(self, info, entity=None):
+        """Add a dialog or replace an existing one"""
+        with self.lock:
+            self._remove_key(info['id'])
+            self.dialogs[info['id']] = info
+            if entity is not None:
+                self.entities[info['id']] = entity
+            insort(self.order, self.sort_key(info))
+            self._touch(info['id'])
+
+    def get(self, chat_id):
+        with self.lock:
+            info = self.dialogs.get(chat_id)
+            return dict(info) if info else None
+
+    def page(self, cursor=None, limit=DIALOG_PAGE_SIZE):
+        """Return one page of dialogs and the cursor for the next page"""
+        with self.lock:
+            start = bisect_right(self.order, self.decode_cursor(cursor)) if cursor else 0
+            keys = self.order[start:start + limit]
+            page = [dict(self.dialogs[chat_id]) for _, chat_id in keys]
+            next_cursor = None
+            if start + limit < len(self.order) and keys:
+                next_cursor = self.encode_cursor(keys[-1])
+            return page, next_cursor
+
+    def apply_message(self, chat_id, message, preview, incoming):
+        """Move a dialog to the top for a new message; False if the chat is unknown"""
+        with self.lock:
+            info = self.dialogs.get(chat_id)
+            if info is None:
+                return False
+            if message.id < info['last_message_id']:
+                return True
+            self._remove_key(chat_id)
+            info.update({
+                'last_message': preview,
+                'last_message_id': message.id,
+                'date': message.date.isoformat(),
+                'timestamp': message.date.timestamp()
+            })
+            if incoming:
+                info['unread_count'] += 1
+            insort(self.order, self.sort_key(info))
+            self._touch(chat_id)
+            return True
+
+    def apply_edit(self, chat_id, message_id, preview):
+        """Update the preview when the last message of a dialog is edited"""
+        with self.lock:
+            info = self.dialogs.get(chat_id)
+            if info and info['last_message_id'] == message_id:
+                info['last_message'] = preview
+                self._touch(chat_id)
+
+    def apply_read(self, chat_id, max_id):
+        """Mark a dialog read up to max_id; False if the unread count is now unknown"""
+        with self.lock:
+            info = self.dialogs.get(chat_id)
+            if info is None:
+                return True
+            if max_id >= info['last_message_id']:
+                if info['unread_count']:
+                    info['unread_count'] = 0
+                    self._touch(chat_id)
+                return True
+            return False
+
+    def find_last_message(self, message_ids, chat_id=None):
+        """Find dialogs whose last message is one of message_ids"""
+        ids = set(message_ids)
+        with self.lock:
+            if chat_id is not None:
+                info = self.dialogs.get(chat_id)
+                return [chat_id] if info and info['last_message_id'] in ids else []
+            return [
+                info['id'] for info in self.dialogs.values()
+                if not info['is_channel'] and info['last_message_id'] in ids
+            ]
+
+    def cursor(self):
+        """Opaque position for changes(); stale once the epoch changes"""
+        with self.lock:
+            return f"{self.epoch}:{self.version}"
+
+    def changes(self, cursor):
+        """Dialogs changed and chat IDs removed after cursor, plus the new cursor
+
+        Returns None if the cursor belongs to another epoch (a restart or a logout),
+        in which case the caller has to send the whole list.
+        """
+        epoch, _, version = (cursor or '').partition(':')
+        with self.lock:
+            if epoch != self.epoch or not version.isdigit() or int(version) > self.version:
+                return None
+            version = int(version)
+            changed = [
+                dict(self.dialogs[chat_id]) for chat_id, changed_at in self.versions.items()
+                if changed_at > version
+            ]
+            removed = [chat_id for chat_id, removed_at in self.removed.items() if removed_at > version]
+            return changed, removed, f"{self.epoch}:{self.version}"
+
+    def clear(self):
+        with self.lock:
+            self.dialogs = {}
+            self.entities = {}
+            self.order = []
+            self.loaded = False
+            self.epoch = os.urandom(4).hex()
+            self.version = 0
+            self.versions = {}
+            self.removed = {}
+
+    def _touch(self, chat_id, removed=False):
+        self.version += 1
+        if removed:
+            self.versions.pop(chat_id, None)
+            self.removed[chat_id] = self.version
+        else:
+            self.removed.pop(chat_id, None)
+            self.versions[chat_id] = self.version
+
+    def _remove_key(self, chat_id):
+        info = self.dialogs.get(chat_id)
+        if info is None:
+            return
+        key = self.sort_key(info)
+        index = bisect_right(self.order, key) - 1
+        if index >= 0 and self.order[index] == key:
+            del self.order[index]
+
+class ChangeJournal:
+    """Recent new, edited and deleted messages, numbered so clients can catch up from a cursor
+
+    With a store the journal is saved as it grows and picked up again on the
+    next start, so cursors browsers hold stay valid across restarts. Saves
+    after startup go through the writer, off the event loop.
+    """
+
+    def __init__(self, limit=JOURNAL_LIMIT, store=None, writer=None):
+        self.limit = limit
+        self.store = store
+        self.writer = None  # Loading (and a first reset) happen before the event loop runs
+        self.entries = deque()  # (seq, chat_id, kind, payload); chat_id None = any non-channel chat
+        if not self.load():
+            self.reset()
+        self.writer = writer
+
+    def save(self, func, *args):
+        if self.writer:
+            self.writer.submit(func, *args)
+        else:
+            func(*args)
+
+    def load(self):
+        saved = self.store.load_journal(self.limit) if self.store else None
+        if saved is None:
+            return False
+        self.epoch, self.floor, entries = saved
+        self.entries.clear()
+        self.entries.extend(entries)
+        if entries:
+            self.floor = max(self.floor, entries[0][0] - 1)
+        self.seq = entries[-1][0] if entries else self.floor
+        return True
+
+    def reset(self):
+        self.epoch = os.urandom(4).hex()
+        self.seq = 0
+        self.floor = 0  # Changes up to this seq have been dropped
+        self.entries.clear()
+        if self.store:
+            self.save(self.store.reset_journal, self.epoch)
+
+    def cursor(self):
+        return f"{self.epoch}:{self.seq}"
+
+    def record(self, chat_id, kind, payload):
+        """Record an 'added' message, an 'edited' {id, text} change, 'deleted' message IDs
+        or a 'reset' of a chat whose missed changes are unknown"""
+        self.seq += 1
+        self.entries.append((self.seq, chat_id, kind, payload))
+        while len(self.entries) > self.limit:
+            self.floor = self.entries.popleft()[0]
+        if self.store:
+            self.save(self.store.append_journal, self.seq, chat_id, kind, payload, self.floor)
+
+    def latest_added(self, chat_id):
+        """Newest message ID recorded as added to a chat (0 if none is)"""
+        return max(
+            (payload['id'] for _, entry_chat, kind, payload in self.entries if entry_chat == chat_id and kind == 'added'),
+            default=0
+        )
+
+    def since(self, cursor, chat_id, is_channel):
+        """Changes to one chat after cursor, or None if they are no longer all known"""
+        epoch, _, seq = (cursor or '').partition(':')
+        if epoch != self.epoch or not seq.isdigit() or not self.floor <= int(seq) <= self.seq:
+            return None
+        seq = int(seq)
+        added = {}
+        edited = {}
+        deleted = set()
+        for entry_seq, entry_chat, kind, payload in reversed(self.entries):
+            if entry_seq <= seq:
+                break
+            if entry_chat != chat_id and not (entry_chat is None and not is_channel):
+                continue
+            if kind == 'reset':
+                return None
+            if kind == 'added':
+                added.setdefault(payload['id'], payload)
+            elif kind == 'edited':
+                edited.setdefault(payload['id'], payload)
+            else:
+                deleted.update(payload)
+        # Fold edits into messages that are new to the client; deletions win over both
+        for message_id in edited.keys() & added.keys():
+            added[message_id] = {**added[message_id], **edited.pop(message_id)}
+        return {
+            'added': sorted((m for i, m in added.items() if i not in deleted), key=lambda m: m['id']),
+            'edited': [e for i, e in edited.items() if i not in deleted],
+            'deleted': sorted(deleted),
+            'since': self.cursor()
+        }
+
+def chat_room(chat_id):
+    return f"chat:{chat_id}"
+
+class EventBatcher:
+    """Coalesces chat and dialog updates and emits them as batched diffs"""
+
+    # Dialog fields sent to the summary channel (timestamp is used for ordering)
+    DIALOG_FIELDS = (
+        'id', 'name', 'unread_count', 'last_message', 'date', 'timestamp',
+        'is_user', 'is_group', 'is_channel'
+    )
+
+    def __init__(self, server, interval=EMIT_BATCH_INTERVAL):
+        self.server = server
+        self.interval = interval
+        self.chats = {}  # chat_id -> pending added/edited/deleted messages
+        self.dialogs = {}  # chat_id -> pending dialog summary
+        self.snapshots = {}  # chat_id -> dialog summary last emitted
+        self.flush_task = None
+
+    def has_subscribers(self, room):
+        return bool(self.server.manager.rooms.get('/', {}).get(room))
+
+    def _chat(self, chat_id):
+        return self.chats.setdefault(chat_id, {'added': {}, 'edited': {}, 'deleted': set()})
+
+    def add_message(self, chat_id, message_info):
+        if not self.has_subscribers(chat_room(chat_id)):
+            return
+        self._chat(chat_id)['added'][message_info['id']] = message_info
+        self._schedule()
+
+    def edit_message(self, chat_id, message_id, fields):
+        if not self.has_subscribers(chat_room(chat_id)):
+            return
+        pending = self._chat(chat_id)
+        if message_id in pending['added']:
+            pending['added'][message_id].update(fields)
+        else:
+            pending['edited'].setdefault(message_id, {'id': message_id}).update(fields)
+        self._schedule()
+
+    def delete_messages(self, chat_id, message_ids):
+        if not self.has_subscribers(chat_room(chat_id)):
+            return
+        pending = self._chat(chat_id)
+        for message_id in message_ids:
+            pending['added'].pop(message_id, None)
+            pending['edited'].pop(message_id, None)
+            pending['deleted'].add(message_id)
+        self._schedule()
+
+    def update_dialog(self, info):
+        """Queue the latest summary of a dialog; only changed fields are emitted"""
+        if not info:
+            return
+        self.dialogs[info['id']] = {field: info.get(field) for field in self.DIALOG_FIELDS}
+        self._schedule()
+
+    def _schedule(self):
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self):
+        chats, self.chats = self.chats, {}
+        dialogs, self.dialogs = self.dialogs, {}
+
+        for chat_id, pending in chats.items():
+            payload = {'chat_id': chat_id}
+            if pending['added']:
+                payload['added'] = sorted(pending['added'].values(), key=lambda m: m['id'])
+            if pending['edited']:
+                payload['edited'] = list(pending['edited'].values())
+            if pending['deleted']:
+                payload['deleted'] = sorted(pending['deleted'])
+            await self.server.emit('chat_updates', payload, room=chat_room(chat_id))
+            metrics.inc('socketio_events_total', event='chat_updates')
+
+        diffs = []
+        for chat_id, summary in dialogs.items():
+            previous = self.snapshots.get(chat_id)
+            self.snapshots[chat_id] = summary
+            if previous is None:
+                diffs.append(summary)
+                continue
+            diff = {key: value for key, value in summary.items() if previous.get(key) != value}
+            if diff:
+                diff['id'] = chat_id
+                diffs.append(diff)
+        if diffs and self.has_subscribers(DIALOGS_ROOM):
+            await self.server.emit('dialog_updates', {'dialogs': diffs}, room=DIALOGS_ROOM)
+            metrics.inc('socketio_events_total', event='dialog_updates')
+
+    def reset(self):
+        self.chats = {}
+        self.dialogs = {}
+        self.snapshots = {}
+
+class HistoryPrefetcher:
+    """Bounded per-chat window of prefetched (older) history pages"""
+
+    def __init__(self, fetch_page, is_watched):
+        self.fetch_page = fetch_page  # async (chat_id, cursor, limit) -> page
+        self.is_watched = is_watched  # chat_id -> whether anyone has the chat open
+        self.windows = OrderedDict()  # chat_id -> OrderedDict((cursor, limit) -> page)
+        self.tasks = {}  # chat_id -> running prefetch task
+        self.depth = {}  # chat_id -> pages to fetch ahead
+
+    def get(self, chat_id, cursor, limit):
+        window = self.windows.get(chat_id)
+        if window is None:
+            return None
+        self.windows.move_to_end(chat_id)
+        return window.get((cursor, limit))
+
+    def put(self, chat_id, cursor, limit, page):
+        window = self.windows.setdefault(chat_id, OrderedDict())
+        self.windows.move_to_end(chat_id)
+        window[(cursor, limit)] = page
+        while len(window) > HISTORY_WINDOW_PAGES:
+            window.popitem(last=False)
+        while len(self.windows) > HISTORY_CACHE_CHATS:
+            evicted, _ = self.windows.popitem(last=False)
+            self.stop(evicted)
+
+    def schedule(self, chat_id, next_cursor, limit, hit):
+        """Prefetch ahead of the page just served; scrolling into prefetched pages widens the window"""
+        if not next_cursor:
+            return
+        if hit:
+            self.depth[chat_id] = min(self.depth.get(chat_id, 1) + 1, PREFETCH_MAX_DEPTH)
+        else:
+            self.depth[chat_id] = 1
+        task = self.tasks.get(chat_id)
+        if task and not task.done():
+            task.cancel()
+        self.tasks[chat_id] = asyncio.ensure_future(
+            self._prefetch(chat_id, next_cursor, limit, self.depth[chat_id])
+        )
+
+    async def _prefetch(self, chat_id, cursor, limit, depth):
+        request_priority.set(BACKGROUND)
+        try:
+            for _ in range(depth):
+                if not cursor or not self.is_watched(chat_id):
+                    return
+                page = self.get(chat_id, cursor, limit)
+                if page is None:
+                    page = await self.fetch_page(chat_id, cursor, limit)
+                    self.put(chat_id, cursor, limit, page)
+                cursor = page['next_cursor']
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error prefetching history for chat {chat_id}: {e}")
+
+    def invalidate(self, chat_id):
+        """Drop cached pages after edits or deletes in a chat"""
+        self.windows.pop(chat_id, None)
+
+    def stop(self, chat_id):
+        """Cancel prefetching and drop the window when a chat is closed"""
+        task = self.tasks.pop(chat_id, None)
+        if task and not task.done():
+            task.cancel()
+        self.windows.pop(chat_id, None)
+        self.depth.pop(chat_id, None)
+
+    def clear(self):
+        for chat_id in list(self.tasks):
+            self.stop(chat_id)
+        self.windows.clear()
+
+def transcode_image(source, target, width, image_format):
+    """Write a thumbnail of source at most width pixels wide (runs in a worker process)"""
+    with Image.open(source) as image:
+        image.seek(0)  # First frame of animated images
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        tmp_path = target + '.tmp'
+        if image_format == 'WEBP':
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            image.save(tmp_path, 'WEBP', quality=THUMB_QUALITY, method=4)
+        else:
+            image.convert('RGB').save(tmp_path, 'JPEG', quality=THUMB_QUALITY, optimize=True)
+    os.replace(tmp_path, target)
+    return target
+
+def read_file(path, offset=0, size=-1):
+    """Read size bytes of a file from offset (runs in an executor)"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+def write_file(path, data):
+    """Atomically write a cache file (runs in an executor)"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def append_file(path, data):
+    """Append to a file and flush it to disk; returns the new size (runs in an executor)"""
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+def truncate_file(path, size):
+    """Cut a file back to size, dropping anything written after the last checkpoint"""
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        os.truncate(path, size)
+
+def hash_file(path):
+    """(sha256 hex digest, size) of a file, read in chunks (runs in an executor)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def sniff_image_mime(path):
+    """Mime type of a downloaded thumbnail from its magic bytes (JPEG unless WebP/PNG)"""
+    with open(path, 'rb') as f:
+        header = f.read(12)
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    if header[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    return 'image/jpeg'
+
+def prune_cache_dir(path, max_bytes):
+    """Delete the least recently modified files until the directory fits max_bytes"""
+    entries = []
+    total = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    for _, size, file_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(file_path)
+            total -= size
+        except OSError:
+            pass
+
+async def merge_iterators(*iterators):
+    """Yield items from several async iterators as soon as any of them produces one"""
+    queue = asyncio.Queue()
+    done = object()
+
+    async def drain(iterator):
+        try:
+            async for item in iterator:
+                await queue.put(item)
+        finally:
+            await queue.put(done)
+
+    tasks = [asyncio.ensure_future(drain(iterator)) for iterator in iterators]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item = await queue.get()
+            if item is done:
+                remaining -= 1
+                continue
+            yield item
+        for task in tasks:
+            task.result()  # Surface producer errors
+    finally:
+        for task in tasks:
+            task.cancel()
+
+class ChatExporter:
+    """Background export of whole chats to compressed JSONL with a media manifest
+
+    Each chat gets a directory holding messages.jsonl.<zst|gz> (one message per
+    line, oldest first, written as independently compressed frames), media/
+    (files named by their SHA-256), manifest.jsonl (one line per media file)
+    and state.json. State is saved after every frame, so an interrupted or
+    cancelled export resumes after the last saved message ID, and running it
+    again later appends only the messages sent since.
+    """
+
+    EXTENSIONS = {'zstd': 'zst', 'gzip': 'gz'}
+
+    def __init__(self, web_client, root=EXPORT_DIR):
+        self.web = web_client
+        self.root = root
+        self.tasks = {}  # chat_id -> running export task
+        self.semaphore = asyncio.Semaphore(EXPORT_CONCURRENCY)
+        self.last_report = {}  # chat_id -> loop time of the last progress event
+        os.makedirs(root, exist_ok=True)
+
+    def chat_dir(self, chat_id):
+        return os.path.join(self.root, str(chat_id))
+
+    def state_path(self, chat_id):
+        return os.path.join(self.chat_dir(chat_id), 'state.json')
+
+    def load_state(self, chat_id):
+        try:
+            with open(self.state_path(chat_id)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state['status'] in ('queued', 'running') and not self.is_running(chat_id):
+            # Interrupted by a restart
+            state['status'] = 'paused'
+        return state
+
+    def save_state(self, state):
+        write_file(self.state_path(state['chat_id']), json.dumps(state, indent=2).encode())
+
+    def is_running(self, chat_id):
+        task = self.tasks.get(chat_id)
+        return task is not None and not task.done()
+
+    def states(self):
+        """State of every export on disk, most recently updated first"""
+        states = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_dir() and entry.name.lstrip('-').isdigit():
+                    state = self.load_state(int(entry.name))
+                    if state:
+                        states.append(state)
+        return sorted(states, key=lambda state: state['updated'], reverse=True)
+
+    def start(self, chat_id, chat_name):
+        """Start or resume exporting a chat; returns its state"""
+        state = self.load_state(chat_id)
+        if state is None:
+            if EXPORT_COMPRESSION == 'zstd' and zstandard is None:
+                raise RuntimeError('zstandard is not installed')
+            compression = EXPORT_COMPRESSION
+            state = {
+                'chat_id': chat_id,
+                'chat_name': chat_name,
+                'compression': compression,
+                'messages_file': f"messages.jsonl.{self.EXTENSIONS[compression]}",
+                'manifest_file': 'manifest.jsonl',
+                'messages_size': 0,
+                'manifest_size': 0,
+                'last_id': 0,
+                'exported': 0,
+                'media': 0,
+                'media_bytes': 0,
+                'total': None,
+                'started': datetime.now(timezone.utc).isoformat(),
+                'error': None
+            }
+            os.makedirs(os.path.join(self.chat_dir(chat_id), 'media'), exist_ok=True)
+        elif state['compression'] == 'zstd' and zstandard is None:
+            raise RuntimeError('This export is zstd-compressed and zstandard is not installed')
+        if not self.is_running(chat_id):
+            state.update({'status': 'queued', 'error': None, 'updated': time.time()})
+            self.save_state(state)
+            self.tasks[chat_id] = asyncio.ensure_future(self.run(state))
+        return state
+
+    def cancel(self, chat_id):
+        task = self.tasks.pop(chat_id, None)
+        if task and not task.done():
+            task.cancel()
+            return True
+        return False
+
+    def cancel_all(self):
+        for chat_id in list(self.tasks):
+            self.cancel(chat_id)
+
+    def compress(self, compression, data):
+        if compression == 'zstd':
+            return zstandard.ZstdCompressor(level=EXPORT_ZSTD_LEVEL).compress(data)
+        return zlib.compress(data, EXPORT_GZIP_LEVEL, wbits=31)
+
+    async def report(self, state, force=False, unsaved=0):
+        """Send progress to browsers, at most every EXPORT_PROGRESS_INTERVAL unless forced
+
+        unsaved counts messages exported since the last checkpoint.
+        """
+        now = asyncio.get_running_loop().time()
+        if not force and now - self.last_report.get(state['chat_id'], 0) < EXPORT_PROGRESS_INTERVAL:
+            return
+        self.last_report[state['chat_id']] = now
+        await socketio.emit('export_progress', {**state, 'exported': state['exported'] + unsaved})
+        metrics.inc('socketio_events_total', event='export_progress')
+
+    async def run(self, state):
+        """Export the chat from state['last_id'] onwards"""
+        request_priority.set(BACKGROUND)
+        chat_id = state['chat_id']
+        directory = self.chat_dir(chat_id)
+        messages_path = os.path.join(directory, state['messages_file'])
+        manifest_path = os.path.join(directory, state['manifest_file'])
+        lines = []
+        manifest = []
+        pending = {'last_id': state['last_id'], 'media': 0, 'media_bytes': 0}
+
+        async def checkpoint():
+            if lines:
+                data = self.compress(state['compression'], b'\n'.join(lines) + b'\n')
+                state['messages_size'] = await asyncio.to_thread(append_file, messages_path, data)
+            if manifest:
+                data = b''.join(dumps(entry) + b'\n' for entry in manifest)
+                state['manifest_size'] = await asyncio.to_thread(append_file, manifest_path, data)
+            state['exported'] += len(lines)
+            state['last_id'] = pending['last_id']
+            state['media'] += pending['media']
+            state['media_bytes'] += pending['media_bytes']
+            state['updated'] = time.time()
+            await asyncio.to_thread(self.save_state, state)
+            lines.clear()
+            manifest.clear()
+            pending.update(media=0, media_bytes=0)
+
+        try:
+            await self.report(state, force=True)
+            async with self.semaphore:
+                state['status'] = 'running'
+                await self.report(state, force=True)
+                # A crash may have left a partial frame after the last checkpoint
+                await asyncio.to_thread(truncate_file, messages_path, state['messages_size'])
+                await asyncio.to_thread(truncate_file, manifest_path, state['manifest_size'])
+                counted = await self.web.scheduler.call(
+                    'get_messages', lambda: self.web.client.get_messages(chat_id, limit=0)
+                )
+                state['total'] = getattr(counted, 'total', None)
+                logger.info(f"Exporting chat {chat_id} after message {state['last_id']}")
+                async for message in self.web.scheduler.iterate('iter_messages', lambda: self.web.client.iter_messages(
+                    chat_id,
+                    reverse=True,
+                    min_id=state['last_id']
+                )):
+                    record = await self.build_record(message, directory, manifest, pending)
+                    lines.append(dumps(record))
+                    pending['last_id'] = message.id
+                    if len(lines) >= EXPORT_CHUNK_MESSAGES:
+                        await checkpoint()
+                    await self.report(state, unsaved=len(lines))
+                await checkpoint()
+            state['status'] = 'done'
+            logger.info(f"Export of chat {chat_id} finished, {state['exported']} messages")
+        except asyncio.CancelledError:
+            # Only what was checkpointed counts; the next run picks up from there
+            state['status'] = 'paused'
+            raise
+        except Exception as e:
+            logger.error(f"Export of chat {chat_id} failed: {e}", exc_info=True)
+            state.update({'status': 'failed', 'error': str(e)})
+        finally:
+            state['updated'] = time.time()
+            self.save_state(state)
+            if self.tasks.get(chat_id) is asyncio.current_task():
+                del self.tasks[chat_id]
+            asyncio.ensure_future(self.report(state, force=True))
+
+    async def build_record(self, message, directory, manifest, pending):
+        """One exported message; media is downloaded and referenced by its hash"""
+        record = {
+            'id': message.id,
+            'date': message.date.isoformat(),
+            'edit_date': message.edit_date.isoformat() if message.edit_date else None,
+            'sender_id': message.sender_id,
+            'sender_name': await self.web.get_sender_name(message),
+            'is_outgoing': bool(message.out),
+            'reply_to_id': getattr(message, 'reply_to_msg_id', None),
+            'text': message.message or '',
+            'media': None
+        }
+        if not message.media:
+            return record
+        media_type = self.web.describe_media(message)['media_type']
+        file = message.file if getattr(message.media, 'photo', None) or getattr(message.media, 'document', None) else None
+        record['media'] = {'type': media_type}
+        if file is None:
+            return record
+        entry = {
+            'message_id': message.id,
+            'type': media_type,
+            'mime_type': file.mime_type,
+            'name': file.name,
+            'size': file.size
+        }
+        if EXPORT_MEDIA and (file.size or 0) <= EXPORT_MEDIA_MAX_BYTES:
+            # Telethon adds an extension to names without one, so use the path it returns
+            part_path = os.path.join(directory, 'media', f"{message.id}.part")
+            downloaded = await self.web.scheduler.call(
+                'download_media', lambda: self.web.client.download_media(message, file=part_path)
+            )
+            if downloaded:
+                digest, size = await asyncio.to_thread(hash_file, downloaded)
+                relative = f"media/{digest[:2]}/{digest}{file.ext or ''}"
+                target = os.path.join(directory, relative)
+                if os.path.exists(target):
+                    # Same content as an earlier message (e.g. a forward)
+                    os.remove(downloaded)
+                else:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(downloaded, target)
+                    pending['media_bytes'] += size
+                entry.update({'sha256': digest, 'path': relative, 'size': size})
+                pending['media'] += 1
+        manifest.append(entry)
+        record['media'].update({key: entry.get(key) for key in ('sha256', 'path', 'mime_type', 'size')})
+        return record
+
 class TelegramWebClient:
-    def __init__(self, api_id, api_hash, session_name):
+    def __init__(self, api_id, api_hash, session_name, client_factory=TelegramClient):
         self.api_id = api_id
         self.api_hash = api_hash
         self.session_name = session_name
+        self.client_factory = client_factory
         self.client = None
         self.loop = None
         self._message_handler_registered = False
+        self.store = MessageStore(MESSAGE_STORE_PATH)
+        self.store_writer = StoreWriter()
+        self.scheduler = RequestScheduler()
+        self.sync_task = None
+        self.warmup_task = None
+        self.catch_up_task = None
+        self.exporter = ChatExporter(self)
+        self.dialog_cache = DialogCache()
+        self.journal = ChangeJournal(store=self.store, writer=self.store_writer)
+        self.batcher = EventBatcher(socketio)
+        self.prefetcher = HistoryPrefetcher(
+            self.load_history_page,
+            lambda chat_id: self.batcher.has_subscribers(chat_room(chat_id))
+        )
+        self.no_photo = {}  # chat_id -> monotonic time until which "no photo" is trusted
+        self.photo_semaphore = asyncio.Semaphore(PHOTO_FETCH_CONCURRENCY)
+        os.makedirs(PHOTO_CACHE_DIR, exist_ok=True)
+        self.media_refs = OrderedDict()  # (chat_id, message_id) -> Telethon message
+        self.media_inflight = {}  # cache path -> future of the download/transcode producing it
+        self.transcode_pool = None
+        self.media_writes = 0
+        os.makedirs(MEDIA_CACHE_DIR, exist_ok=True)
         
     async def start_client(self):
         """Initialize and start the Telegram client"""
         try:
-            self.client = TelegramClient(
+            set_phase('connecting')
+            self.client = self.client_factory(
                 self.session_name, 
                 self.api_id, 
                 self.api_hash,
                 connection_retries=5,
                 retry_delay=1,
-                auto_reconnect=True
+                auto_reconnect=True,
+                flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD,
+                catch_up=CATCH_UP_ENABLED
             )
+            # Registered before connecting so the updates replayed on connect are not lost
+            self.setup_message_handler()
+            self.watch_reconnects()
             
             await self.client.connect()
             
+            set_phase('authorizing')
             if await self.client.is_user_authorized():
-                me = await self.client.get_me()
+                me = await self.scheduler.call('get_me', self.client.get_me)
                 client_status.update({
                     'authenticated': True,
                     'connected': True,
@@ -84,7 +1686,8 @@ class TelegramWebClient:
                     'username': me.username,
                     'user_id': me.id
                 })
-                self.setup_message_handler()
+                self.start_background_jobs(catch_up=True)
+                set_phase('ready')
                 logger.info(f"Client authenticated as {me.phone}")
                 return True
             else:
@@ -92,6 +1695,7 @@ class TelegramWebClient:
                     'connected': True,
                     'authenticated': False
                 })
+                set_phase('login_required')
                 logger.info("Client connected but not authenticated")
                 return False
         except Exception as e:
@@ -100,6 +1704,7 @@ class TelegramWebClient:
                 'connected': False,
                 'authenticated': False
             })
+            set_phase('failed')
             return False
         
     def setup_message_handler(self):
@@ -110,24 +1715,295 @@ class TelegramWebClient:
         @self.client.on(events.NewMessage)
         async def handle_new_message(event):
             try:
-                sender_name = await self.get_sender_name(event.message)
-                chat_name = await self.get_chat_name(event.message.peer_id)
-                
-                message_data = {
-                    'type': 'new_message',
-                    'chat_name': chat_name,
-                    'sender_name': sender_name,
-                    'message': event.message.message or '[Media]',
-                    'timestamp': event.message.date.strftime('%H:%M:%S'),
-                    'chat_id': self.get_chat_id_from_peer(event.message.peer_id)
-                }
-                socketio.emit('new_message', message_data)
+                message = event.message
+                sender_name = await self.get_sender_name(message)
+                cached = self.dialog_cache.get(event.chat_id)
+                chat_name = cached['name'] if cached else await self.get_chat_name(message.peer_id)
                 logger.info(f"New message in {chat_name} from {sender_name}")
+                
+                self.store_writer.submit(self.store.set_chat_name, event.chat_id, chat_name)
+                self.store_writer.submit(self.store.upsert_messages, [
+                    self.build_store_row(event.chat_id, message, sender_name)
+                ])
+                
+                live = self.build_live_message(message, sender_name)
+                self.batcher.add_message(event.chat_id, live)
+                self.journal.record(event.chat_id, 'added', live)
+                if self.dialog_cache.loaded:
+                    if self.dialog_cache.apply_message(
+                        event.chat_id,
+                        message,
+                        make_preview(message),
+                        not message.out
+                    ):
+                        self.publish_dialog(event.chat_id)
+                    else:
+                        await self.refresh_dialog(event.chat_id)
             except Exception as e:
                 logger.error(f"Error handling new message: {e}", exc_info=True)
         
+        @self.client.on(events.MessageEdited)
+        async def handle_message_edited(event):
+            try:
+                sender_name = await self.get_sender_name(event.message)
+                self.store_writer.submit(self.store.upsert_messages, [
+                    self.build_store_row(event.chat_id, event.message, sender_name)
+                ])
+                change = {'text': event.message.text or '[Media]'}
+                self.batcher.edit_message(event.chat_id, event.message.id, change)
+                self.journal.record(event.chat_id, 'edited', {'id': event.message.id, **change})
+                self.prefetcher.invalidate(event.chat_id)
+                self.dialog_cache.apply_edit(
+                    event.chat_id,
+                    event.message.id,
+                    make_preview(event.message)
+                )
+                self.publish_dialog(event.chat_id)
+            except Exception as e:
+                logger.error(f"Error storing edited message: {e}", exc_info=True)
+        
+        @self.client.on(events.MessageDeleted)
+        async def handle_message_deleted(event):
+            try:
+                if event.chat_id is None:
+                    # Private chats and basic groups: look the chats up in the store
+                    by_chat = {}
+                    # Through the writer, so messages stored just before are seen
+                    found = await self.store_writer.run(self.store.find_chat_ids, event.deleted_ids)
+                    for message_id, chat_id in found.items():
+                        by_chat.setdefault(chat_id, []).append(message_id)
+                else:
+                    by_chat = {event.chat_id: event.deleted_ids}
+                for chat_id, message_ids in by_chat.items():
+                    self.batcher.delete_messages(chat_id, message_ids)
+                    self.prefetcher.invalidate(chat_id)
+                # Recorded even when the store does not know the chat; None covers every non-channel chat
+                self.journal.record(event.chat_id, 'deleted', list(event.deleted_ids))
+                
+                self.store_writer.submit(self.store.delete_messages, event.chat_id, event.deleted_ids)
+                # A deleted last message changes the preview, so reload those dialogs
+                for chat_id in self.dialog_cache.find_last_message(event.deleted_ids, event.chat_id):
+                    await self.refresh_dialog(chat_id)
+            except Exception as e:
+                logger.error(f"Error removing deleted messages: {e}", exc_info=True)
+        
+        @self.client.on(events.MessageRead(inbox=True))
+        async def handle_message_read(event):
+            try:
+                if self.dialog_cache.apply_read(event.chat_id, event.max_id):
+                    self.publish_dialog(event.chat_id)
+                else:
+                    await self.refresh_dialog(event.chat_id)
+            except Exception as e:
+                logger.error(f"Error handling read receipt: {e}", exc_info=True)
+        
+        @self.client.on(events.ChatAction)
+        async def handle_chat_action(event):
+            try:
+                # Covers new chats, joins and title/photo changes
+                if self.dialog_cache.loaded:
+                    await self.refresh_dialog(event.chat_id)
+            except Exception as e:
+                logger.error(f"Error handling chat action: {e}", exc_info=True)
+        
         self._message_handler_registered = True
     
+    def start_background_jobs(self, catch_up):
+        """Start warm-up, the store sync and (on a restart) the catch-up check"""
+        # A fresh login has nothing to catch up on
+        if catch_up and not (self.catch_up_task and not self.catch_up_task.done()):
+            # What the previous run had seen, taken before the sync adds messages the journal never saw
+            known = self.store.get_latest_ids()
+            self.catch_up_task = asyncio.ensure_future(self.catch_up('start', known))
+        self.start_background_sync()
+        self.start_warmup()
+    
+    def watch_reconnects(self):
+        """Fetch the missed updates whenever Telethon reconnects on its own"""
+        # Telethon's reconnect callback only pings Telegram; its catch-up there is disabled
+        sender = getattr(self.client, '_sender', None)
+        if sender is None or not hasattr(sender, '_auto_reconnect_callback'):
+            return
+        callback = sender._auto_reconnect_callback
+        
+        async def on_reconnect():
+            if callback:
+                await callback()
+            if client_status.get('authenticated') and not (self.catch_up_task and not self.catch_up_task.done()):
+                if self.dialog_cache.loaded:
+                    known = {info['id']: info['last_message_id'] for info in self.dialog_cache.dialogs.values()}
+                else:
+                    known = await self.store_writer.run(self.store.get_latest_ids)
+                self.catch_up_task = asyncio.ensure_future(self.catch_up('reconnect', known))
+        sender._auto_reconnect_callback = on_reconnect
+    
+    async def catch_up(self, reason, known):
+        """Replay missed updates through the handlers, then look for gaps they left
+        
+        Telegram answers with only the updates after the saved state, so this
+        costs a few small requests; the handlers apply them to the caches and
+        journal and push them to browsers like live updates.
+        """
+        request_priority.set(BACKGROUND)
+        try:
+            if CATCH_UP_ENABLED:
+                start = time.perf_counter()
+                metrics.inc('telegram_catch_ups_total', reason=reason)
+                if reason == 'reconnect':
+                    # On start Telethon asks for the difference itself
+                    await self.client.catch_up()
+                await asyncio.sleep(RECONCILE_DELAY)
+                gaps = await self.reconcile_dialogs(known)
+                logger.info(
+                    f"Caught up after {reason} in {time.perf_counter() - start:.1f}s"
+                    f"{f', {len(gaps)} chats reset' if gaps else ''}"
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Catch-up after {reason} failed: {e}", exc_info=True)
+    
+    async def reconcile_dialogs(self, known, limit=RECONCILE_DIALOGS):
+        """Check the most recent dialogs against what the updates delivered
+        
+        known maps chat IDs to the newest message seen before the outage. A chat
+        whose top message is newer than that and than anything the updates
+        added has a gap (e.g. Telegram's difference was too long); its journal
+        history is reset so browsers reload it, and its dialog summary is refreshed.
+        """
+        gaps = []
+        async for dialog in self.scheduler.iterate('iter_dialogs', lambda: self.client.iter_dialogs(limit=limit)):
+            if not dialog.entity:
+                continue
+            info = self.build_dialog_info(dialog)
+            cached = self.dialog_cache.get(dialog.id)
+            seen = max(known.get(dialog.id, 0), self.journal.latest_added(dialog.id))
+            if info['last_message_id'] > seen:
+                gaps.append(dialog.id)
+                self.journal.record(dialog.id, 'reset', None)
+                self.prefetcher.invalidate(dialog.id)
+            if self.dialog_cache.loaded and (
+                cached is None or any(cached.get(field) != info[field] for field in EventBatcher.DIALOG_FIELDS)
+            ):
+                self.dialog_cache.upsert(info, dialog.entity)
+                self.publish_dialog(dialog.id)
+        return gaps
+    
+    def build_live_message(self, message, sender_name):
+        """Build the message payload pushed to subscribed chat rooms"""
+        self.remember_media(message)
+        return {
+            'id': message.id,
+            'text': message.text or '[Media]',
+            'sender_name': sender_name,
+            'date': message.date.isoformat(),
+            'is_outgoing': message.out,
+            **self.describe_media(message)
+        }
+    
+    def publish_dialog(self, chat_id):
+        """Queue the current dialog summary for the dialog channel"""
+        self.batcher.update_dialog(self.dialog_cache.get(chat_id))
+    
+    def build_store_row(self, chat_id, message, sender_name):
+        """Convert a Telethon message into a message store row"""
+        return {
+            'chat_id': chat_id,
+            'id': message.id,
+            'sender_id': message.sender_id,
+            'sender_name': sender_name,
+            'date': MessageStore.to_timestamp(message.date),
+            'text': message.message or '',
+            'is_outgoing': int(bool(message.out)),
+            'is_channel': int(isinstance(message.peer_id, PeerChannel))
+        }
+    
+    def start_background_sync(self):
+        """Start back-filling the message store if it is not already running"""
+        if self.sync_task and not self.sync_task.done():
+            return
+        self.sync_task = asyncio.ensure_future(self.sync_message_store())
+    
+    def start_warmup(self):
+        """Start preloading caches for the first page load, if enabled and not already running"""
+        if not WARMUP_ENABLED or (self.warmup_task and not self.warmup_task.done()):
+            return
+        self.warmup_task = asyncio.ensure_future(self.warm_up())
+    
+    async def warm_up(self):
+        """Preload dialogs, chat names and recent chats' thumbnails at background priority"""
+        request_priority.set(BACKGROUND)
+        set_warmup('running')
+        try:
+            start = time.perf_counter()
+            if not self.dialog_cache.loaded:
+                # Dialogs carry the chat entities, so chat names resolve from memory afterwards
+                await self.scheduler.coalesce('load_dialogs', self.load_dialogs)
+            recent, _ = self.dialog_cache.page(None, WARMUP_CHATS)
+            await self.get_profile_thumbs([dialog['id'] for dialog in recent])
+            set_warmup('done')
+            logger.info(f"Warm-up finished in {time.perf_counter() - start:.1f}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Warm-up failed: {e}", exc_info=True)
+            set_warmup('failed')
+    
+    async def sync_message_store(self):
+        """Back-fill the local message store from every dialog"""
+        request_priority.set(BACKGROUND)
+        try:
+            synced = 0
+            async for dialog in self.scheduler.iterate('iter_dialogs', self.client.iter_dialogs):
+                if not dialog.entity:
+                    continue
+                try:
+                    synced += await self.sync_dialog(dialog)
+                except FloodWaitError as e:
+                    logger.warning(f"Sync hit flood wait, sleeping {e.seconds}s")
+                    await asyncio.sleep(e.seconds)
+                except Exception as e:
+                    logger.error(f"Error syncing chat {dialog.id}: {e}")
+                await asyncio.sleep(SYNC_DIALOG_DELAY)
+            logger.info(f"Message store sync finished, {synced} new messages stored")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Message store sync failed: {e}", exc_info=True)
+    
+    async def sync_dialog(self, dialog):
+        """Store messages newer than the last synced one for a dialog"""
+        chat_id = dialog.id
+        self.store_writer.submit(self.store.set_chat_name, chat_id, dialog.name or "Unknown")
+        newest_id = await self.store_writer.run(self.store.get_newest_id, chat_id)
+        if dialog.message and dialog.message.id <= newest_id:
+            return 0
+        
+        rows = []
+        stored = 0
+        top_id = newest_id
+        if newest_id:
+            # Catching up: page oldest first until the present, saving progress after each batch,
+            # so newest_id never moves past messages that were not fetched
+            factory = lambda: self.client.iter_messages(dialog.entity, min_id=newest_id, reverse=True)
+        else:
+            # First sync: only the most recent messages
+            factory = lambda: self.client.iter_messages(dialog.entity, limit=SYNC_BACKFILL_LIMIT)
+        async for message in self.scheduler.iterate('iter_messages', factory):
+            sender_name = await self.get_sender_name(message)
+            rows.append(self.build_store_row(chat_id, message, sender_name))
+            top_id = max(top_id, message.id)
+            if len(rows) >= SYNC_BATCH_SIZE:
+                await self.store_writer.run(self.store.upsert_messages, rows)
+                stored += len(rows)
+                rows = []
+                if newest_id:
+                    await self.store_writer.run(self.store.set_newest_id, chat_id, top_id)
+        await self.store_writer.run(self.store.upsert_messages, rows)
+        stored += len(rows)
+        await self.store_writer.run(self.store.set_newest_id, chat_id, top_id)
+        return stored
+    
     def get_chat_id_from_peer(self, peer_id):
         """Extract chat ID from peer object"""
         if isinstance(peer_id, PeerUser):
@@ -147,7 +2023,8 @@ class TelegramWebClient:
     async def get_sender_name(self, message):
         """Get sender name from message"""
         try:
-            sender = await message.get_sender()
+            # Usually already known from the request that returned the message
+            sender = message.sender or await self.scheduler.call('get_sender', message.get_sender)
             if hasattr(sender, 'first_name'):
                 name = sender.first_name or "Unknown"
                 if hasattr(sender, 'last_name') and sender.last_name:
@@ -164,7 +2041,10 @@ class TelegramWebClient:
     async def get_chat_name(self, peer_id):
         """Get chat name from peer ID"""
         try:
-            entity = await self.client.get_entity(peer_id)
+            chat_id = utils.get_peer_id(peer_id)
+            entity = self.dialog_cache.entities.get(chat_id) or await self.scheduler.call(
+                'get_entity', lambda: self.client.get_entity(peer_id), key=('get_entity', chat_id)
+            )
             if hasattr(entity, 'title'):
                 return entity.title
             elif hasattr(entity, 'first_name'):
@@ -226,7 +2106,8 @@ class TelegramWebClient:
                 'user_id': me.id
             })
             
-            self.setup_message_handler()
+            self.start_background_jobs(catch_up=False)
+            set_phase('ready')
             logger.info(f"Successfully authenticated as {me.phone}")
             return True, None
             
@@ -240,231 +2121,754 @@ class TelegramWebClient:
             logger.error(f"Sign in error: {e}", exc_info=True)
             return False, str(e)
             
-    async def get_dialogs(self, limit=100):
-        """Get list of chats/dialogs"""
+    def build_dialog_info(self, dialog):
+        """Convert a Telethon dialog into the dict served by /api/dialogs"""
+        # Get chat name
+        if hasattr(dialog.entity, 'title'):
+            chat_name = dialog.entity.title
+        elif hasattr(dialog.entity, 'first_name'):
+            chat_name = dialog.entity.first_name or "Unknown"
+            if hasattr(dialog.entity, 'last_name') and dialog.entity.last_name:
+                chat_name += f" {dialog.entity.last_name}"
+        else:
+            chat_name = dialog.name or "Unknown"
+        
+        # Format date
+        date_str = ""
+        if dialog.date:
+            date_str = dialog.date.isoformat()
+        
+        return {
+            'id': dialog.id,
+            'name': chat_name,
+            'unread_count': dialog.unread_count,
+            'last_message': make_preview(dialog.message),
+            'last_message_id': dialog.message.id if dialog.message else 0,
+            'date': date_str,
+            'timestamp': dialog.date.timestamp() if dialog.date else 0,
+            'is_user': dialog.is_user,
+            'is_group': dialog.is_group,
+            'is_channel': dialog.is_channel
+        }
+    
+    async def load_dialogs(self):
+        """Load every dialog into the in-memory dialog cache"""
+        dialogs = []
+        async for dialog in self.scheduler.iterate('iter_dialogs', self.client.iter_dialogs):
+            if not dialog.entity:
+                continue
+            dialogs.append((self.build_dialog_info(dialog), dialog.entity))
+        self.dialog_cache.replace(dialogs)
+        logger.info(f"Loaded {len(dialogs)} dialogs")
+    
+    async def refresh_dialog(self, chat_id):
+        """Reload a single dialog (new chat, unknown unread count, deleted preview)"""
         try:
-            dialogs = []
-            async for dialog in self.client.iter_dialogs(limit=limit):
-                if not dialog.entity:
-                    continue
-                
-                # Get chat name
-                if hasattr(dialog.entity, 'title'):
-                    chat_name = dialog.entity.title
-                elif hasattr(dialog.entity, 'first_name'):
-                    chat_name = dialog.entity.first_name or "Unknown"
-                    if hasattr(dialog.entity, 'last_name') and dialog.entity.last_name:
-                        chat_name += f" {dialog.entity.last_name}"
-                else:
-                    chat_name = dialog.name or "Unknown"
-                
-                # Get last message
-                last_message = "No messages"
-                if dialog.message:
-                    last_message = dialog.message.text or '[Media]'
-                    if len(last_message) > 50:
-                        last_message = last_message[:47] + "..."
-                
-                # Format date
-                date_str = ""
-                if dialog.date:
-                    date_str = dialog.date.isoformat()
-                
-                dialog_info = {
-                    'id': dialog.id,
-                    'name': chat_name,
-                    'unread_count': dialog.unread_count,
-                    'last_message': last_message,
-                    'date': date_str,
-                    'is_user': dialog.is_user,
-                    'is_group': dialog.is_group,
-                    'is_channel': dialog.is_channel
-                }
-                dialogs.append(dialog_info)
+            peer = await self.scheduler.call('get_input_entity', lambda: self.client.get_input_entity(chat_id))
+            result = await self.scheduler.call(
+                'get_peer_dialogs',
+                lambda: self.client(functions.messages.GetPeerDialogsRequest(
+                    peers=[utils.get_input_dialog(peer)]
+                )),
+                key=('get_peer_dialogs', chat_id)
+            )
+            entities = {
+                utils.get_peer_id(entity): entity
+                for entity in [*result.users, *result.chats]
+            }
+            messages = {}
+            for message in result.messages:
+                message._finish_init(self.client, entities, None)
+                messages[message.id] = message
+            for raw_dialog in result.dialogs:
+                dialog = Dialog(self.client, raw_dialog, entities, messages.get(raw_dialog.top_message))
+                if dialog.entity:
+                    self.dialog_cache.upsert(self.build_dialog_info(dialog), dialog.entity)
+                    self.publish_dialog(dialog.id)
+        except Exception as e:
+            logger.error(f"Error refreshing dialog {chat_id}: {e}")
+    
+    async def get_dialogs(self, limit=DIALOG_PAGE_SIZE, cursor=None, refresh=False):
+        """Get a page of chats/dialogs from the dialog cache"""
+        try:
+            if refresh or not self.dialog_cache.loaded:
+                await self.scheduler.coalesce('load_dialogs', self.load_dialogs)
+            return self.dialog_cache.page(cursor, limit)
+        except Exception as e:
+            logger.error(f"Error getting dialogs: {e}", exc_info=True)
+            return [], None
+        
+    def get_image_mime(self, message):
+        """Mime type of a photo or image document, or None for other media"""
+        media = message.media
+        if getattr(media, 'photo', None):
+            return 'image/jpeg'
+        document = getattr(media, 'document', None)
+        mime_type = getattr(document, 'mime_type', '') or ''
+        if mime_type.startswith('image/'):
+            return mime_type
+        return None
+    
+    def get_thumb_sizes(self, message):
+        """Telegram-provided size variants of a photo or document, smallest first"""
+        media = message.media
+        photo = getattr(media, 'photo', None)
+        if photo:
+            sizes = getattr(photo, 'sizes', None) or []
+        else:
+            sizes = getattr(getattr(media, 'document', None), 'thumbs', None) or []
+        sized = [
+            size for size in sizes
+            if isinstance(size, (PhotoSize, PhotoCachedSize, PhotoSizeProgressive))
+        ]
+        return sorted(sized, key=lambda size: size.w)
+    
+    def pick_thumb_size(self, message, width):
+        """Smallest size variant at least width wide, or None when the original is needed"""
+        sizes = self.get_thumb_sizes(message)
+        if not sizes:
+            return None
+        size = next((size for size in sizes if size.w >= width), None)
+        if size is not None:
+            return size
+        if getattr(message.media, 'photo', None) or not self.get_image_mime(message):
+            # Largest photo size is the original; other documents only have their thumbs
+            return sizes[-1]
+        return None
+    
+    def get_media_placeholder(self, message):
+        """Inline blurred preview from a stripped size (a few hundred bytes), if any"""
+        media = message.media
+        sizes = getattr(getattr(media, 'photo', None), 'sizes', None) or getattr(
+            getattr(media, 'document', None), 'thumbs', None
+        ) or []
+        for size in sizes:
+            if isinstance(size, PhotoStrippedSize):
+                jpeg = utils.stripped_photo_to_jpg(size.bytes)
+                return f"data:image/jpeg;base64,{base64.b64encode(jpeg).decode()}"
+        return None
+    
+    def is_video(self, message):
+        """Whether the message media is a video document (including round videos and GIFs)"""
+        document = getattr(message.media, 'document', None)
+        if document is None:
+            return False
+        if (getattr(document, 'mime_type', '') or '').startswith('video/'):
+            return True
+        return any(
+            isinstance(attribute, DocumentAttributeVideo)
+            for attribute in getattr(document, 'attributes', []) or []
+        )
+    
+    def describe_media(self, message):
+        """Describe message media for the chat view without downloading anything"""
+        media = message.media
+        if not media:
+            return {'media': None, 'media_type': None}
+        
+        chat_id = message.chat_id
+        version = int(message.edit_date.timestamp()) if message.edit_date else 0
+        base = f"/api/media/{chat_id}/{message.id}?v={version}"
+        if self.get_image_mime(message):
+            info = {
+                'media': f"{base}&w={THUMB_DEFAULT_WIDTH}",
+                'media_full': f"{base}&full=1",
+                'media_type': 'photo' if getattr(media, 'photo', None) else 'image'
+            }
+        elif getattr(media, 'document', None):
+            mime_type = getattr(media.document, 'mime_type', '')
+            video = self.is_video(message)
+            info = {
+                'media': '[Video]' if video else f'[Document: {mime_type}]',
+                'media_full': f"/api/stream/{chat_id}/{message.id}?v={version}",
+                'media_type': 'video' if video else 'document'
+            }
+            if self.get_thumb_sizes(message):
+                info['media_thumb'] = f"{base}&w={THUMB_DEFAULT_WIDTH}"
+        else:
+            info = None
+        if info is not None:
+            placeholder = self.get_media_placeholder(message)
+            if placeholder:
+                info['media_placeholder'] = placeholder
+            width, height = self.get_media_dimensions(message)
+            if width and height:
+                info.update({'media_width': width, 'media_height': height})
+            return info
+        if getattr(media, 'webpage', None):
+            # Handle web previews
+            return {'media': '[Web Preview]', 'media_type': 'webpage'}
+        return {'media': '[Media]', 'media_type': 'other'}
+    
+    def get_media_dimensions(self, message):
+        """Largest known (width, height) of a photo or image document"""
+        media = message.media
+        photo = getattr(media, 'photo', None)
+        if photo:
+            sizes = [size for size in getattr(photo, 'sizes', []) if getattr(size, 'w', None)]
+            if sizes:
+                largest = max(sizes, key=lambda size: size.w * size.h)
+                return largest.w, largest.h
+        document = getattr(media, 'document', None)
+        for attribute in getattr(document, 'attributes', []) or []:
+            if getattr(attribute, 'w', None) and getattr(attribute, 'h', None):
+                return attribute.w, attribute.h
+        return None, None
+    
+    def remember_media(self, message):
+        """Keep a reference to a listed message so its media can be served without a lookup"""
+        if not message.media:
+            return
+        key = (message.chat_id, message.id)
+        self.media_refs[key] = message
+        self.media_refs.move_to_end(key)
+        while len(self.media_refs) > MEDIA_REFS_LIMIT:
+            self.media_refs.popitem(last=False)
+    
+    async def build_message_info(self, message):
+        """Convert a Telethon message into the API dict (media is referenced by URL)"""
+        sender_name = await self.get_sender_name(message)
+        self.remember_media(message)
+        return {
+            'id': message.id,
+            'text': message.text or '[Media]',
+            'sender_name': sender_name,
+            'date': message.date.isoformat(),
+            'is_outgoing': message.out,
+            **self.describe_media(message)
+        }
+    
+    async def get_media_message(self, chat_id, message_id):
+        """Get a message with media, from the recent listing cache or Telegram"""
+        message = self.media_refs.get((chat_id, message_id))
+        metrics.hit('media_refs', message is not None)
+        if message is None:
+            message = await self.scheduler.call(
+                'get_messages',
+                lambda: self.client.get_messages(chat_id, ids=message_id),
+                key=('get_messages', chat_id, message_id)
+            )
+            if message is None or not message.media:
+                return None
+            self.remember_media(message)
+        return message
+    
+    async def run_once(self, key, factory):
+        """Run factory() once per key; concurrent callers share the same result"""
+        future = self.media_inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self.media_inflight[key] = future
+            future.add_done_callback(lambda _: self.media_inflight.pop(key, None))
+        return await asyncio.shield(future)
+    
+    def media_written(self):
+        """Prune the media cache every so often as files are added"""
+        self.media_writes += 1
+        if self.media_writes % 50 == 0:
+            asyncio.get_running_loop().run_in_executor(
+                None, prune_cache_dir, MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES
+            )
+    
+    def media_cache_prefix(self, message):
+        """Cache file prefix for a message's media; edits get a new prefix"""
+        version = int(message.edit_date.timestamp()) if message.edit_date else 0
+        return os.path.join(MEDIA_CACHE_DIR, f"{message.chat_id}_{message.id}_{version}")
+    
+    async def get_media_original(self, message):
+        """Download the original media file into the disk cache, returning (path, mime)"""
+        mime = self.get_image_mime(message) or getattr(
+            getattr(message.media, 'document', None), 'mime_type', None
+        ) or 'application/octet-stream'
+        path = f"{self.media_cache_prefix(message)}.orig"
+        metrics.hit('media_original', os.path.exists(path))
+        if os.path.exists(path):
+            return path, mime
+        
+        async def download():
+            result = await self.scheduler.call(
+                'download_media', lambda: self.client.download_media(message, file=path + '.part')
+            )
+            if not result:
+                raise FileNotFoundError(f"Media of message {message.id} could not be downloaded")
+            os.replace(result, path)
+            self.media_written()
+            return path
+        
+        await self.run_once(path, download)
+        return path, mime
+    
+    async def get_media_variant(self, message, size):
+        """Download one Telegram size variant into the disk cache, returning (path, mime)"""
+        path = f"{self.media_cache_prefix(message)}_t{size.type}.img"
+        metrics.hit('media_variant', os.path.exists(path))
+        if not os.path.exists(path):
+            async def download():
+                result = await self.scheduler.call(
+                    'download_thumb',
+                    lambda: self.client.download_media(message, file=path + '.part', thumb=size.type)
+                )
+                if not result:
+                    raise FileNotFoundError(f"Thumbnail of message {message.id} could not be downloaded")
+                os.replace(result, path)
+                self.media_written()
+                return path
             
-            logger.info(f"Loaded {len(dialogs)} dialogs")
-            return dialogs
-        except Exception as e:
-            logger.error(f"Error getting dialogs: {e}", exc_info=True)
-            return []
+            await self.run_once(path, download)
+        return path, sniff_image_mime(path)
+    
+    async def get_media_thumb(self, message, width, image_format):
+        """Get a cached thumbnail at one of THUMB_WIDTHS, returning (path, mime)
+        
+        Telegram's own size variants are used when one is large enough, so the
+        full file is only downloaded for image documents without big thumbs.
+        """
+        width = next((w for w in THUMB_WIDTHS if w >= width), THUMB_WIDTHS[-1])
+        size = self.pick_thumb_size(message, width)
+        if size is not None:
+            source, mime = await self.get_media_variant(message, size)
+            if mime == 'image/jpeg' and image_format == 'JPEG' and size.w <= width:
+                # The variant already fits: no need to re-encode it
+                return source, mime
+        elif self.get_image_mime(message):
+            source, mime = await self.get_media_original(message)
+        else:
+            raise FileNotFoundError(f"Message {message.id} has no preview")
+        if Image is None or mime == 'image/gif':
+            # No transcoder (or an animation we would flatten): serve the source as is
+            return source, mime
+        
+        extension = 'webp' if image_format == 'WEBP' else 'jpg'
+        thumb_mime = 'image/webp' if image_format == 'WEBP' else 'image/jpeg'
+        path = f"{self.media_cache_prefix(message)}_{width}.{extension}"
+        metrics.hit('media_thumb', os.path.exists(path))
+        if os.path.exists(path):
+            return path, thumb_mime
+        
+        async def transcode():
+            if self.transcode_pool is None:
+                self.transcode_pool = ProcessPoolExecutor(max_workers=TRANSCODE_WORKERS)
+            await asyncio.get_running_loop().run_in_executor(
+                self.transcode_pool, transcode_image, source, path, width, image_format
+            )
+            self.media_written()
+            return path
         
-    async def get_messages(self, chat_id, limit=50, offset_id=0):
-        """Get messages from a chat"""
+        await self.run_once(path, transcode)
+        return path, thumb_mime
+    
+    def get_stream_info(self, message):
+        """(size, mime) of a document that can be streamed, or None"""
+        document = getattr(message.media, 'document', None)
+        if document is None or not document.size:
+            return None
+        return document.size, document.mime_type or 'application/octet-stream'
+    
+    async def get_media_chunk(self, message, index):
+        """One STREAM_CHUNK_SIZE-aligned chunk of a document, from the disk cache or Telegram"""
+        loop = asyncio.get_running_loop()
+        prefix = self.media_cache_prefix(message)
+        offset = index * STREAM_CHUNK_SIZE
+        for path, start in ((f"{prefix}.orig", offset), (f"{prefix}.c{index}", 0)):
+            if os.path.exists(path):
+                try:
+                    data = await loop.run_in_executor(None, read_file, path, start, STREAM_CHUNK_SIZE)
+                    metrics.hit('media_chunk', True)
+                    return data
+                except FileNotFoundError:
+                    pass  # Pruned in the meantime
+        
+        metrics.hit('media_chunk', False)
+        path = f"{prefix}.c{index}"
+        
+        async def download():
+            data = b''
+            async for part in self.scheduler.iterate('iter_download', lambda: self.client.iter_download(
+                message.document,
+                offset=offset,
+                limit=1,
+                request_size=STREAM_CHUNK_SIZE,
+                file_size=message.document.size
+            ), page_size=1):
+                data += part
+            await loop.run_in_executor(None, write_file, path, data)
+            self.media_written()
+            return data
+        
+        return await self.run_once(path, download)
+    
+    async def prefetch_chunk(self, message, index):
+        """Read-ahead download of a chunk; failures are retried when it is actually needed"""
+        request_priority.set(BACKGROUND)
         try:
-            messages = []
-            async for message in self.client.iter_messages(
-                chat_id, 
-                limit=limit, 
-                offset_id=offset_id
-            ):
-                if not (message.text or message.media):
-                    continue
-                    
-                sender_name = await self.get_sender_name(message)
-                
-                # Handle media
-                media_data = None
-                media_type = None
-                if message.media:
-                    if hasattr(message.media, 'photo'):
-                        try:
-                            # Download photo with size limit
-                            photo_bytes = await self.client.download_media(
-                                message.media.photo, 
-                                bytes
-                            )
-                            if photo_bytes:
-                                # Check size and compress if needed
-                                if len(photo_bytes) > 5 * 1024 * 1024:  # 5MB limit
-                                    logger.warning(f"Photo too large: {len(photo_bytes)} bytes")
-                                    media_data = '[Photo - too large to display]'
-                                    media_type = 'photo_large'
-                                else:
-                                    media_data = f"data:image/jpeg;base64,{base64.b64encode(photo_bytes).decode('utf-8')}"
-                                    media_type = 'photo'
-                                    logger.info(f"Photo loaded: {len(photo_bytes)} bytes")
-                        except Exception as e:
-                            logger.error(f"Error downloading photo: {e}")
-                            media_data = '[Photo - failed to load]'
-                            media_type = 'photo_error'
-                    elif hasattr(message.media, 'document'):
-                        # Check if it's an image document
-                        doc = message.media.document
-                        mime_type = getattr(doc, 'mime_type', '')
-                        if mime_type.startswith('image/'):
-                            try:
-                                # Download image document
-                                img_bytes = await self.client.download_media(doc, bytes)
-                                if img_bytes:
-                                    if len(img_bytes) > 5 * 1024 * 1024:  # 5MB limit
-                                        media_data = f'[Image - too large to display]'
-                                        media_type = 'image_large'
-                                    else:
-                                        # Determine correct mime type for base64
-                                        if 'png' in mime_type:
-                                            mime = 'image/png'
-                                        elif 'gif' in mime_type:
-                                            mime = 'image/gif'
-                                        elif 'webp' in mime_type:
-                                            mime = 'image/webp'
-                                        else:
-                                            mime = 'image/jpeg'
-                                        
-                                        media_data = f"data:{mime};base64,{base64.b64encode(img_bytes).decode('utf-8')}"
-                                        media_type = 'image'
-                                        logger.info(f"Image document loaded: {len(img_bytes)} bytes, type: {mime_type}")
-                            except Exception as e:
-                                logger.error(f"Error downloading image document: {e}")
-                                media_data = '[Image - failed to load]'
-                                media_type = 'image_error'
-                        else:
-                            media_data = f'[Document: {mime_type}]'
-                            media_type = 'document'
-                    elif hasattr(message.media, 'webpage'):
-                        # Handle web previews
-                        media_data = '[Web Preview]'
-                        media_type = 'webpage'
-                    else:
-                        media_data = '[Media]'
-                        media_type = 'other'
-                
-                msg_info = {
-                    'id': message.id,
-                    'text': message.text or '[Media]',
-                    'sender_name': sender_name,
-                    'date': message.date.isoformat(),
-                    'is_outgoing': message.out,
-                    'media': media_data,
-                    'media_type': media_type
-                }
-                messages.append(msg_info)
-            
-            messages.reverse()
-            logger.info(f"Loaded {len(messages)} messages from chat {chat_id}")
-            return messages
+            await self.get_media_chunk(message, index)
         except Exception as e:
-            logger.error(f"Error getting messages: {e}", exc_info=True)
-            return []
+            logger.debug(f"Read-ahead of chunk {index} of message {message.id} failed: {e}")
+    
+    async def iter_media_range(self, message, start, end):
+        """Yield bytes start..end (inclusive) of a document, chunk by chunk with read-ahead"""
+        chunk_count = -(-message.document.size // STREAM_CHUNK_SIZE)
+        prefix = self.media_cache_prefix(message)
+        index = start // STREAM_CHUNK_SIZE
+        last = end // STREAM_CHUNK_SIZE
+        while index <= last:
+            for ahead in range(index + 1, min(index + 1 + STREAM_READ_AHEAD, chunk_count)):
+                path = f"{prefix}.c{ahead}"
+                if path not in self.media_inflight and not os.path.exists(path):
+                    asyncio.ensure_future(self.prefetch_chunk(message, ahead))
+            data = await self.get_media_chunk(message, index)
+            chunk_start = index * STREAM_CHUNK_SIZE
+            yield data[max(start - chunk_start, 0):end - chunk_start + 1]
+            index += 1
+    
+    async def fetch_history_messages(self, chat_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+        """Fetch one page of raw history messages (oldest first) and the cursors to its neighbours
+
+        Cursors are "before:<id>" (older messages) and "after:<id>" (newer
+        messages); no cursor means the latest page.
+        """
+        direction, _, anchor = (cursor or 'before:0').partition(':')
+        anchor = int(anchor or 0)
+        if direction == 'after':
+            raw = [
+                message async for message in self.scheduler.iterate('iter_messages', lambda: self.client.iter_messages(
+                    chat_id, limit=limit, min_id=anchor, reverse=True
+                ))
+            ]
+        elif direction == 'before':
+            raw = [
+                message async for message in self.scheduler.iterate('iter_messages', lambda: self.client.iter_messages(
+                    chat_id, limit=limit, offset_id=anchor
+                ))
+            ]
+            raw.reverse()
+        else:
+            raise ValueError(f"Invalid cursor: {cursor}")
         
+        next_cursor = prev_cursor = None
+        if raw:
+            if direction == 'after' or len(raw) == limit:
+                next_cursor = f"before:{raw[0].id}"
+            if (direction == 'before' and anchor) or (direction == 'after' and len(raw) == limit):
+                prev_cursor = f"after:{raw[-1].id}"
+        return raw, {'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+    
+    async def iter_message_infos(self, raw):
+        """Yield message dicts for fetched messages, in order, as their media is loaded"""
+        for message in raw:
+            if message.text or message.media:
+                yield await self.build_message_info(message)
+    
+    async def fetch_history_page(self, chat_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+        """Fetch one page of history (oldest first) with cursors to its neighbours"""
+        raw, cursors = await self.fetch_history_messages(chat_id, cursor, limit)
+        messages = [info async for info in self.iter_message_infos(raw)]
+        return {'messages': messages, **cursors}
+    
+    def message_changes(self, chat_id, cursor):
+        """New, edited and deleted messages of a chat since a journal cursor, or None if unknown"""
+        is_channel = utils.resolve_id(chat_id)[1] is PeerChannel
+        return self.journal.since(cursor, chat_id, is_channel)
+    
+    async def load_history_page(self, chat_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+        """Fetch a history page, sharing it with a prefetch or another tab loading the same one"""
+        return await self.scheduler.coalesce(
+            ('history', chat_id, cursor, limit),
+            lambda: self.fetch_history_page(chat_id, cursor, limit)
+        )
+    
+    async def get_history_page(self, chat_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+        """Serve a history page, from the prefetch window when possible"""
+        page = self.prefetcher.get(chat_id, cursor, limit) if cursor else None
+        hit = page is not None
+        if cursor:
+            metrics.hit('history_prefetch', hit)
+        if not hit:
+            page = await self.load_history_page(chat_id, cursor, limit)
+        logger.info(
+            f"Served {len(page['messages'])} messages from chat {chat_id}"
+            f"{' (prefetched)' if hit else ''}"
+        )
+        if cursor is None or cursor.startswith('before:'):
+            self.prefetcher.schedule(chat_id, page['next_cursor'], limit, hit)
+        return page
+    
+    async def stream_history_page(self, chat_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+        """Like get_history_page, but a page that is not prefetched yet is streamed as its media loads
+
+        Returns (async iterator of message dicts, {'next_cursor', 'prev_cursor'}).
+        """
+        page = self.prefetcher.get(chat_id, cursor, limit) if cursor else None
+        hit = page is not None
+        if cursor:
+            metrics.hit('history_prefetch', hit)
+        if page is None and ('history', chat_id, cursor, limit) in self.scheduler.inflight:
+            # A prefetch is loading this page right now: share it rather than fetching it twice
+            page = await self.load_history_page(chat_id, cursor, limit)
+        if page is not None:
+            messages = iterate(page['messages'])
+            cursors = {'next_cursor': page['next_cursor'], 'prev_cursor': page['prev_cursor']}
+        else:
+            raw, cursors = await self.fetch_history_messages(chat_id, cursor, limit)
+            messages = self.iter_message_infos(raw)
+        logger.info(f"Streaming history of chat {chat_id}{' (prefetched)' if hit else ''}")
+        if cursor is None or cursor.startswith('before:'):
+            self.prefetcher.schedule(chat_id, cursors['next_cursor'], limit, hit)
+        return messages, cursors
+    
     async def send_message(self, chat_id, message_text):
         """Send a message to a chat"""
         try:
-            await self.client.send_message(chat_id, message_text)
+            await self.scheduler.call('send_message', lambda: self.client.send_message(chat_id, message_text))
             logger.info(f"Message sent to chat {chat_id}")
             return True, "Message sent successfully"
         except Exception as e:
             logger.error(f"Error sending message: {e}", exc_info=True)
             return False, str(e)
             
-    async def search_messages(self, query, limit=100):
-        """Search messages across all chats"""
+    def search_local(self, query, chat_id=None, date_from=None, date_to=None, limit=100):
+        """Search the local message store"""
+        try:
+            results = self.store.search(query, chat_id, date_from, date_to, limit)
+            logger.info(f"Found {len(results)} local results for query: {query}")
+            return results
+        except Exception as e:
+            logger.error(f"Error searching local store: {e}", exc_info=True)
+            return []
+    
+    async def build_search_result(self, message):
+        """Convert a found message into a search result dict"""
+        # Marked ID, the same one /api/dialogs and /api/messages use
+        chat_id = utils.get_peer_id(message.peer_id)
+        dialog = self.dialog_cache.get(chat_id)
+        chat_name = dialog['name'] if dialog else await self.get_chat_name(message.peer_id)
+        sender_name = await self.get_sender_name(message)
+        return {
+            'id': message.id,
+            'text': message.text[:200],  # Limit text length
+            'chat_name': chat_name,
+            'sender_name': sender_name,
+            'date': message.date.isoformat(),
+            'chat_id': chat_id
+        }
+    
+    async def iter_search_results(self, query, limit=100, chat_id=None):
+        """Yield Telegram search results as they are found
+        
+        Names are resolved in background tasks while the next messages are
+        being fetched; results are still yielded in the order Telegram returned them.
+        """
+        pending = deque()
         try:
-            results = []
-            async for message in self.client.iter_messages(
-                None, 
+            async for message in self.scheduler.iterate('search_messages', lambda: self.client.iter_messages(
+                chat_id, 
                 search=query, 
                 limit=limit
-            ):
+            )):
                 if not message.text:
                     continue
-                    
-                chat_name = await self.get_chat_name(message.peer_id)
-                sender_name = await self.get_sender_name(message)
-                
-                result = {
-                    'text': message.text[:200],  # Limit text length
-                    'chat_name': chat_name,
-                    'sender_name': sender_name,
-                    'date': message.date.isoformat(),
-                    'chat_id': self.get_chat_id_from_peer(message.peer_id)
-                }
-                results.append(result)
-            
+                pending.append(asyncio.ensure_future(self.build_search_result(message)))
+                while pending and pending[0].done():
+                    yield pending.popleft().result()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    async def iter_fanout_results(self, query, chats=SEARCH_FANOUT_CHATS, per_chat=SEARCH_FANOUT_PER_CHAT):
+        """Search the most recently active dialogs one by one, a few at a time"""
+        if not self.dialog_cache.loaded:
+            await self.scheduler.coalesce('load_dialogs', self.load_dialogs)
+        dialogs, _ = self.dialog_cache.page(None, chats)
+        semaphore = asyncio.Semaphore(SEARCH_FANOUT_CONCURRENCY)
+        
+        async def search_chat(chat_id):
+            async with semaphore:
+                try:
+                    async for result in self.iter_search_results(query, per_chat, chat_id):
+                        yield result
+                except Exception as e:
+                    # One inaccessible chat should not end the whole search
+                    logger.error(f"Error searching chat {chat_id}: {e}")
+        
+        async for result in merge_iterators(*(search_chat(dialog['id']) for dialog in dialogs)):
+            yield result
+    
+    async def iter_search_stream(self, query, chat_id=None, date_from=None, date_to=None,
+                                 limit=100, source='auto', fanout=False):
+        """Yield (source, result) pairs: local store hits first, then Telegram's, without duplicates"""
+        seen = set()
+        if source in ('auto', 'local'):
+            results = await asyncio.to_thread(
+                self.search_local, query, chat_id, date_from, date_to, limit
+            )
+            for result in results:
+                seen.add((result['chat_id'], result['id']))
+                yield 'local', result
+        # Telegram's search has no date filter, so only text queries go remote
+        if source == 'local' or not query or len(seen) >= limit:
+            return
+        
+        remote = [self.iter_search_results(query, limit, chat_id)]
+        if fanout and chat_id is None:
+            remote.append(self.iter_fanout_results(query))
+        async for result in merge_iterators(*remote):
+            key = (result['chat_id'], result['id'])
+            if key in seen:
+                continue
+            seen.add(key)
+            yield 'remote', result
+            if len(seen) >= limit:
+                return
+    
+    async def search_messages(self, query, limit=100, chat_id=None):
+        """Search messages across all chats (or one chat) on Telegram"""
+        try:
+            results = [
+                result async for result in self.iter_search_results(query, limit, chat_id)
+            ]
             logger.info(f"Found {len(results)} results for query: {query}")
             return results
         except Exception as e:
             logger.error(f"Error searching messages: {e}", exc_info=True)
             return []
     
-    async def get_profile_photo(self, chat_id):
-        """Get profile photo for a chat"""
+    async def get_profile_thumb(self, chat_id):
+        """Get the cached small profile photo for a chat as (path, version), or None"""
+        expires = self.no_photo.get(chat_id)
+        if expires and expires > time.monotonic():
+            metrics.hit('profile_photo', True)
+            return None
+        
         try:
-            entity = await self.client.get_entity(chat_id)
-            if not entity.photo:
+            entity = self.dialog_cache.entities.get(chat_id) or await self.scheduler.call(
+                'get_entity', lambda: self.client.get_entity(chat_id), key=('get_entity', chat_id)
+            )
+            photo_id = getattr(getattr(entity, 'photo', None), 'photo_id', None)
+            if not photo_id:
+                self.no_photo[chat_id] = time.monotonic() + PHOTO_NEGATIVE_TTL
                 return None
             
-            # Download with size limit
-            photo_bytes = await self.client.download_profile_photo(entity, bytes)
-            if photo_bytes:
-                if len(photo_bytes) > 2 * 1024 * 1024:  # 2MB limit for profile photos
-                    logger.warning(f"Profile photo too large: {len(photo_bytes)} bytes")
-                    return None
-                return f"data:image/jpeg;base64,{base64.b64encode(photo_bytes).decode('utf-8')}"
-            return None
+            path = os.path.join(PHOTO_CACHE_DIR, f"{chat_id}_{photo_id}.jpg")
+            metrics.hit('profile_photo', os.path.exists(path))
+            if os.path.exists(path):
+                return path, photo_id
+            
+            def store(photo_bytes):
+                # Write atomically, then drop thumbnails of older photos
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(photo_bytes)
+                os.replace(path + '.tmp', path)
+                for name in os.listdir(PHOTO_CACHE_DIR):
+                    old_path = os.path.join(PHOTO_CACHE_DIR, name)
+                    if name.startswith(f"{chat_id}_") and old_path != path and not name.endswith('.tmp'):
+                        try:
+                            os.remove(old_path)
+                        except FileNotFoundError:
+                            pass
+            
+            async def download():
+                async with self.photo_semaphore:
+                    if os.path.exists(path):  # Fetched while we were waiting
+                        return path, photo_id
+                    # download_big=False picks Telegram's small (160px) variant
+                    photo_bytes = await self.scheduler.call(
+                        'download_profile_photo',
+                        lambda: self.client.download_profile_photo(entity, bytes, download_big=False),
+                        key=('download_profile_photo', chat_id)
+                    )
+                    if not photo_bytes:
+                        return None
+                    await asyncio.to_thread(store, photo_bytes)
+                    return path, photo_id
+            
+            # One download, write and cleanup per chat at a time
+            thumb = await self.run_once(('profile_photo', chat_id), download)
+            if thumb is None:
+                self.no_photo[chat_id] = time.monotonic() + PHOTO_NEGATIVE_TTL
+            return thumb
         except Exception as e:
-            logger.error(f"Error getting profile photo: {e}")
+            logger.error(f"Error getting profile photo for {chat_id}: {e}")
+            return None
+    
+    async def get_profile_thumbs(self, chat_ids):
+        """Resolve thumbnails for many chats concurrently"""
+        results = await asyncio.gather(*(self.get_profile_thumb(chat_id) for chat_id in chat_ids))
+        return dict(zip(chat_ids, results))
+    
+    async def get_profile_photo(self, chat_id):
+        """Get profile photo thumbnail for a chat as a data URL"""
+        thumb = await self.get_profile_thumb(chat_id)
+        if not thumb:
             return None
+        with open(thumb[0], 'rb') as f:
+            photo_bytes = f.read()
+        return f"data:image/jpeg;base64,{base64.b64encode(photo_bytes).decode('utf-8')}"
     
     async def logout(self):
         """Logout and disconnect client"""
         try:
+            if self.sync_task:
+                self.sync_task.cancel()
+            if self.warmup_task:
+                self.warmup_task.cancel()
+            if self.catch_up_task:
+                self.catch_up_task.cancel()
+            self.exporter.cancel_all()
             if self.client and self.client.is_connected():
                 await self.client.log_out()
                 logger.info("User logged out")
+            await self.store_writer.run(self.store.clear)
+            self.dialog_cache.clear()
+            self.journal.reset()
+            self.batcher.reset()
+            self.prefetcher.clear()
+            self.no_photo.clear()
+            self.media_refs.clear()
+            for cache_dir in (PHOTO_CACHE_DIR, MEDIA_CACHE_DIR):
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                os.makedirs(cache_dir, exist_ok=True)
             return True
         except Exception as e:
             logger.error(f"Error during logout: {e}", exc_info=True)
             return False
 
-def run_async_in_thread(coro, timeout=30):
-    """Execute async coroutine in the client thread"""
-    global client_loop
-    if not client_loop or client_loop.is_closed():
-        raise RuntimeError("Client loop not available")
-    
+def status_payload():
+    return {**client_status, 'ready': client_ready.is_set()}
+
+def publish_status():
+    asyncio.ensure_future(socketio.emit('status', status_payload()))
+
+def set_phase(phase):
+    """Record a startup phase and push the new status to connected pages"""
+    client_status['phase'] = phase
+    publish_status()
+
+def set_warmup(state):
+    client_status['warmup'] = state
+    publish_status()
+
+async def wait_until_ready(timeout=CLIENT_READY_TIMEOUT):
+    """Wait for the client to finish starting; False if it is still starting after timeout"""
+    try:
+        await asyncio.wait_for(client_ready.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+async def run_startup():
+    """Start the client in the background so the server accepts requests right away"""
+    try:
+        await telegram_client.start_client()
+    finally:
+        client_ready.set()
+        publish_status()
+
+async def await_client(coro, timeout=30):
+    """Await a Telegram client coroutine, cancelling it if it takes too long"""
     try:
-        future = asyncio.run_coroutine_threadsafe(coro, client_loop)
-        return future.result(timeout=timeout)
+        return await asyncio.wait_for(coro, timeout)
     except asyncio.TimeoutError:
         logger.error(f"Operation timed out after {timeout}s")
         raise TimeoutError(f"Operation timed out after {timeout}s")
@@ -472,51 +2876,241 @@ def run_async_in_thread(coro, timeout=30):
         logger.error(f"Error in async operation: {e}", exc_info=True)
         raise
 
-def init_telegram_client():
-    """Initialize Telegram client in a separate thread"""
-    global telegram_client, client_loop, client_thread
-    
-    def client_thread_func():
-        global client_loop, telegram_client
-        client_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(client_loop)
-        
-        async def run_client():
-            global telegram_client
-            telegram_client = TelegramWebClient(API_ID, API_HASH, SESSION_NAME)
-            await telegram_client.start_client()
-            
-            # Keep the loop running
-            while True:
-                await asyncio.sleep(1)
-        
+def dumps(payload):
+    """Serialize to JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def accepted_encodings():
+    return {
+        part.split(';')[0].strip().lower()
+        for part in request.headers.get('Accept-Encoding', '').split(',')
+    }
+
+def choose_encoding():
+    """Pick a response encoding from the request's Accept-Encoding header"""
+    accepted = accepted_encodings()
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def wants_stream():
+    """Whether the client asked for an NDJSON stream instead of one JSON body"""
+    return (
+        request.args.get('stream', 0, type=int) == 1
+        or 'application/x-ndjson' in request.headers.get('Accept', '')
+    )
+
+def json_response(payload, status=200):
+    """JSON response encoded with the fast encoder and compressed when it pays off"""
+    return compressed_response(dumps(payload), 'application/json', status)
+
+def compressed_response(body, mimetype, status=200):
+    """Response for a body generated per request, compressed when it pays off"""
+    response = Response(body, status=status, mimetype=mimetype)
+    encoding = choose_encoding() if len(body) >= COMPRESS_MIN_SIZE else None
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+    elif encoding == 'gzip':
+        response.set_data(zlib.compress(body, GZIP_LEVEL, wbits=31))
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def stream_response(items, **summary):
+    """Stream an async iterable as NDJSON lines while it is being produced
+
+    Each item is one line; the last line is {"done": true, "count": N, ...summary}
+    or {"done": true, "success": false, "error": ...} if the producer failed.
+    """
+    encoding = choose_encoding()
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress = compressor.process
+        flush = lambda: compressor.flush()
+        finish = compressor.finish
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, wbits=31)
+        compress = compressor.compress
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        finish = compressor.flush
+    else:
+        compress = lambda data: data
+        flush = lambda: b''
+        finish = lambda: b''
+
+    async def generate():
+        count = 0
         try:
-            client_loop.run_until_complete(run_client())
-        except KeyboardInterrupt:
-            logger.info("Client thread interrupted")
+            async for item in items:
+                count += 1
+                # Flush per line so the browser can render results as they arrive
+                yield compress(dumps(item) + b'\n') + flush()
+            trailer = {'done': True, 'success': True, 'count': count, **summary}
         except Exception as e:
-            logger.error(f"Client thread error: {e}", exc_info=True)
+            logger.error(f"Error while streaming response: {e}", exc_info=True)
+            trailer = {'done': True, 'success': False, 'error': str(e)}
+        yield compress(dumps(trailer) + b'\n') + finish()
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.timeout = None
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+async def iterate(items):
+    """Wrap an already built list so it can be streamed"""
+    for item in items:
+        yield item
+
+async def sample_loop_lag():
+    """Record how late the event loop wakes up; sustained lag means blocking code"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        metrics.observe('event_loop_lag_seconds', max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+
+def instrument_asgi(asgi):
+    """Time HTTP requests until their last body byte (streams included) and count bytes sent"""
+    async def instrumented(scope, receive, send):
+        if scope['type'] != 'http':
+            return await asgi(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await asgi(scope, receive, counting_send)
         finally:
-            if client_loop:
-                client_loop.close()
-    
-    client_thread = threading.Thread(target=client_thread_func, daemon=True)
-    client_thread.start()
-    logger.info("Telegram client thread started")
+            route = scope.get('route_rule') or 'unmatched'
+            metrics.observe(
+                'http_request_duration_seconds', time.perf_counter() - start,
+                route=route, method=scope['method'], status=status
+            )
+            metrics.inc('http_response_bytes_total', sent, route=route)
+    return instrumented
+
+@app.before_request
+async def label_request_route():
+    # Route patterns (not raw paths) keep the number of metric series bounded
+    request.scope['route_rule'] = request.url_rule.rule if request.url_rule else None
+
+@app.before_request
+async def wait_for_client():
+    # Requests arriving while Telegram is still connecting wait for it instead of failing
+    if request.path.startswith('/api/') and request.path not in ('/api/status', '/api/metrics'):
+        if not await wait_until_ready():
+            return jsonify({'success': False, 'error': 'Telegram client is still starting'}), 503
+
+@app.before_serving
+async def start_telegram_client():
+    """Start the Telegram client on the server's event loop"""
+    global telegram_client, client_loop, startup_task
+    client_loop = asyncio.get_running_loop()
+    client_loop.create_task(sample_loop_lag())
+    telegram_client = TelegramWebClient(API_ID, API_HASH, SESSION_NAME, telegram_client_factory)
+    metrics.gauge('dialogs_cached', lambda: len(telegram_client.dialog_cache.dialogs))
+    metrics.gauge('media_jobs_inflight', lambda: len(telegram_client.media_inflight))
+    # ru_maxrss is in kilobytes on Linux
+    metrics.gauge('process_peak_rss_bytes', lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+    startup_task = client_loop.create_task(run_startup())
+
+@app.after_serving
+async def stop_telegram_client():
+    """Disconnect the Telegram client on shutdown"""
+    if startup_task and not startup_task.done():
+        startup_task.cancel()
+    if telegram_client and telegram_client.client:
+        await telegram_client.client.disconnect()
 
 # API Routes
+asset_manifest = None
+
+def load_asset_manifest():
+    """Logical asset name -> fingerprinted name under static/dist, or {} when not built"""
+    global asset_manifest
+    try:
+        with open(ASSET_MANIFEST) as f:
+            asset_manifest = json.load(f)
+        logger.info(f"Serving {len(asset_manifest)} fingerprinted static assets")
+    except FileNotFoundError:
+        asset_manifest = {}
+        logger.info("No static asset build found, serving static/ sources (run build_static.py)")
+    return asset_manifest
+
+def asset_url(name):
+    """URL of a static asset, fingerprinted when build_static.py has been run"""
+    manifest = asset_manifest if asset_manifest is not None else load_asset_manifest()
+    if name in manifest:
+        return f"/static/dist/{manifest[name]}"
+    return f"/static/{name}"
+
+@app.context_processor
+async def inject_asset_url():
+    return {'asset': asset_url}
+
 @app.route('/')
-def index():
-    """Serve main page"""
-    return render_template('index.html')
+async def index():
+    """Serve main page; it is small and revalidated, the assets it links are cached for good"""
+    body = (await render_template('index.html')).encode('utf-8')
+    response = compressed_response(body, 'text/html')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(hashlib.sha256(body).hexdigest()[:16])
+    return await response.make_conditional(request)
+
+@app.route('/static/<path:filename>')
+async def static_asset(filename):
+    """Serve a static file, preferring a precompressed variant; fingerprinted files are immutable"""
+    path = safe_join(STATIC_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'error': 'Not found'}), 404
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    accepted = accepted_encodings()
+    encoding = next(
+        (name for name, suffix in (('br', '.br'), ('gzip', '.gz'))
+         if name in accepted and os.path.isfile(path + suffix)),
+        None
+    )
+    if encoding:
+        path += '.br' if encoding == 'br' else '.gz'
+    response = await send_file(path, mimetype=mimetype, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    if filename.startswith('dist/'):
+        response.headers['Cache-Control'] = f"public, max-age={STATIC_IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/sw.js')
+async def service_worker():
+    """Serve the service worker from the root so its scope covers the whole app"""
+    response = await send_file(os.path.join(STATIC_DIR, 'sw.js'), mimetype='application/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/status')
-def get_status():
-    """Get current client status"""
-    return jsonify(client_status)
+async def get_status():
+    """Get current client status, including the startup phase"""
+    return jsonify(status_payload())
 
 @app.route('/api/check_login')
-def check_login():
+async def check_login():
     """Check if user is logged in"""
     return jsonify({
         'logged_in': client_status.get('authenticated', False),
@@ -524,7 +3118,7 @@ def check_login():
     })
 
 @app.route('/api/user_info')
-def get_user_info():
+async def get_user_info():
     """Get current user information"""
     return jsonify({
         'success': True,
@@ -535,16 +3129,16 @@ def get_user_info():
     })
 
 @app.route('/api/send_code', methods=['POST'])
-def send_verification_code():
+async def send_verification_code():
     """Send verification code to phone"""
     try:
-        data = request.get_json()
+        data = await request.get_json()
         phone = data.get('phone', '').strip()
         
         if not phone:
             return jsonify({'success': False, 'error': 'Phone number is required'})
         
-        success, error = run_async_in_thread(
+        success, error = await await_client(
             telegram_client.send_code_request(phone)
         )
         
@@ -557,14 +3151,14 @@ def send_verification_code():
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/verify_code', methods=['POST'])
-def verify_code():
+async def verify_code():
     """Verify code or password"""
     try:
-        data = request.get_json()
+        data = await request.get_json()
         code = data.get('code')
         password = data.get('password')
         
-        success, error = run_async_in_thread(
+        success, error = await await_client(
             telegram_client.sign_in(code=code, password=password)
         )
         
@@ -576,35 +3170,155 @@ def verify_code():
         logger.error(f"Verify code error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)})
 
+# API calls shared by the HTTP routes and the Socket.IO RPC
+async def dialogs_payload(limit=DIALOG_PAGE_SIZE, cursor=None, refresh=False, since=None):
+    """A page of dialogs, or only the changes after a since cursor"""
+    if since and not refresh and telegram_client.dialog_cache.loaded:
+        # Only what changed after the browser's cached copy
+        changes = telegram_client.dialog_cache.changes(since)
+        if changes is not None:
+            dialogs, removed, since = changes
+            return {'success': True, 'dialogs': dialogs, 'removed': removed, 'since': since}
+    # The first page carries the position to ask for changes from next time
+    summary = {} if cursor else {'since': telegram_client.dialog_cache.cursor(), 'reset': bool(since)}
+    
+    hot = not refresh and telegram_client.dialog_cache.loaded
+    metrics.hit('dialogs', hot)
+    if hot:
+        # Hot path: serve straight from memory
+        dialogs, next_cursor = telegram_client.dialog_cache.page(cursor, limit)
+    else:
+        dialogs, next_cursor = await await_client(
+            telegram_client.get_dialogs(limit, cursor, refresh),
+            timeout=120
+        )
+    return {'success': True, 'dialogs': dialogs, 'next_cursor': next_cursor, **summary}
+
+def message_changes_payload(chat_id, since):
+    """Changes to a chat's latest page after a since cursor (None = send the page again)"""
+    changes = telegram_client.message_changes(chat_id, since)
+    if changes is not None:
+        return {'success': True, **changes}
+    return None
+
+async def messages_payload(chat_id, cursor=None, limit=HISTORY_PAGE_SIZE, since=None):
+    """A page of a chat's history, or only the changes after a since cursor"""
+    if since:
+        # Patch the browser's cached latest page instead of sending it again
+        changes = message_changes_payload(chat_id, since)
+        if changes is not None:
+            return changes
+    # The latest page carries the journal position it is current as of
+    summary = {} if cursor else {'since': telegram_client.journal.cursor(), 'reset': bool(since)}
+    # Increase timeout for image loading
+    page = await await_client(
+        telegram_client.get_history_page(chat_id, cursor, limit),
+        timeout=120  # 2 minutes for loading images
+    )
+    return {'success': True, **page, **summary}
+
+async def send_message_payload(chat_id, message):
+    """Send a text message to a chat"""
+    message = (message or '').strip()
+    if not message:
+        return {'success': False, 'error': 'Message is required'}
+    success, result = await await_client(
+        telegram_client.send_message(chat_id, message)
+    )
+    return {'success': success, 'message': result}
+
+def search_params(params):
+    """Normalized search parameters; None when there is nothing to search for"""
+    query = (params.get('q') or '').strip()
+    chat_id = params.get('chat_id')
+    date_from = params.get('date_from') or None
+    date_to = params.get('date_to') or None
+    if not (query or chat_id or date_from or date_to):
+        return None
+    return {
+        'query': query,
+        'chat_id': int(chat_id) if chat_id not in (None, '') else None,
+        'date_from': date_from,
+        'date_to': date_to,
+        'limit': int(params.get('limit') or 50),
+        'source': params.get('source') or 'auto',
+        'fanout': bool(params.get('fanout'))
+    }
+
+async def stream_search(params, emit):
+    """Run a search, handing results to emit() in batches; returns the number of results"""
+    loop = asyncio.get_running_loop()
+    batch = []
+    count = 0
+    last_emit = loop.time()
+    
+    async def flush():
+        nonlocal batch, last_emit
+        if batch:
+            await emit(batch)
+            batch = []
+        last_emit = loop.time()
+    
+    try:
+        async for source, result in telegram_client.iter_search_stream(**params):
+            result['source'] = source
+            batch.append(result)
+            count += 1
+            if len(batch) >= SEARCH_BATCH_SIZE or loop.time() - last_emit >= SEARCH_BATCH_INTERVAL:
+                await flush()
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        # Whatever was found before the failure still reaches the client
+        await flush()
+        raise
+    await flush()
+    return count
+
 @app.route('/api/dialogs')
-def get_dialogs():
+async def get_dialogs():
     """Get list of chats"""
     try:
         if not client_status.get('authenticated'):
             return jsonify({'success': False, 'error': 'Not authenticated'})
-            
-        dialogs = run_async_in_thread(telegram_client.get_dialogs())
-        return jsonify({'success': True, 'dialogs': dialogs})
+        
+        payload = await dialogs_payload(
+            request.args.get('limit', DIALOG_PAGE_SIZE, type=int),
+            request.args.get('cursor') or None,
+            bool(request.args.get('refresh', 0, type=int)),
+            request.args.get('since')
+        )
+        if wants_stream() and 'next_cursor' in payload:
+            del payload['success']
+            return stream_response(iterate(payload.pop('dialogs')), **payload)
+        return json_response(payload)
     except Exception as e:
         logger.error(f"Get dialogs error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/messages/<int:chat_id>')
-def get_messages(chat_id):
+@app.route('/api/messages/<int(signed=True):chat_id>')
+async def get_messages(chat_id):
     """Get messages from a chat"""
     try:
         if not client_status.get('authenticated'):
             return jsonify({'success': False, 'error': 'Not authenticated'})
             
-        limit = request.args.get('limit', 50, type=int)
+        limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
         offset_id = request.args.get('offset_id', 0, type=int)
+        cursor = request.args.get('cursor') or (f"before:{offset_id}" if offset_id else None)
+        since = request.args.get('since')
         
-        # Increase timeout for image loading
-        messages = run_async_in_thread(
-            telegram_client.get_messages(chat_id, limit, offset_id),
-            timeout=120  # 2 minutes for loading images
-        )
-        return jsonify({'success': True, 'messages': messages})
+        if wants_stream():
+            if since:
+                changes = message_changes_payload(chat_id, since)
+                if changes is not None:
+                    return json_response(changes)
+            summary = {} if cursor else {'since': telegram_client.journal.cursor(), 'reset': bool(since)}
+            # Same page and cursors as the JSON body, each message sent as soon as its media is loaded
+            messages, cursors = await await_client(telegram_client.stream_history_page(chat_id, cursor, limit))
+            return stream_response(messages, **cursors, **summary)
+        
+        return json_response(await messages_payload(chat_id, cursor, limit, since))
     except TimeoutError:
         logger.error("Timeout loading messages with images")
         return jsonify({'success': False, 'error': 'Timeout loading messages. Try loading fewer messages.'})
@@ -613,74 +3327,288 @@ def get_messages(chat_id):
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/send_message', methods=['POST'])
-def send_message():
+async def send_message():
     """Send a message"""
     try:
         if not client_status.get('authenticated'):
             return jsonify({'success': False, 'error': 'Not authenticated'})
             
-        data = request.get_json()
-        chat_id = data.get('chat_id')
-        message = data.get('message', '').strip()
-        
-        if not message:
-            return jsonify({'success': False, 'error': 'Message is required'})
-        
-        success, result = run_async_in_thread(
-            telegram_client.send_message(chat_id, message)
-        )
-        return jsonify({'success': success, 'message': result})
+        data = await request.get_json()
+        return jsonify(await send_message_payload(data.get('chat_id'), data.get('message')))
     except Exception as e:
         logger.error(f"Send message error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/search')
-def search_messages():
-    """Search messages"""
+async def search_messages():
+    """Search messages (local store first, Telegram as fallback)"""
     try:
         if not client_status.get('authenticated'):
             return jsonify({'success': False, 'error': 'Not authenticated'})
             
         query = request.args.get('q', '').strip()
         limit = request.args.get('limit', 50, type=int)
+        chat_id = request.args.get('chat_id', None, type=int)
+        date_from = request.args.get('date_from') or None
+        date_to = request.args.get('date_to') or None
+        source = request.args.get('source', 'auto')
         
-        if not query:
+        if not (query or chat_id or date_from or date_to):
             return jsonify({'success': False, 'error': 'Query is required'})
         
-        results = run_async_in_thread(
-            telegram_client.search_messages(query, limit),
+        stream = wants_stream()
+        results = []
+        if source in ('auto', 'local'):
+            results = await asyncio.to_thread(
+                telegram_client.search_local, query, chat_id, date_from, date_to, limit
+            )
+            # Telegram's search has no date filter, so only text queries fall back
+            if results or source == 'local' or not query:
+                if stream:
+                    return stream_response(iterate(results), source='local')
+                return json_response({'success': True, 'results': results, 'source': 'local'})
+        
+        if stream:
+            return stream_response(
+                telegram_client.iter_search_results(query, limit, chat_id),
+                source='remote'
+            )
+        results = await await_client(
+            telegram_client.search_messages(query, limit, chat_id),
             timeout=60
         )
-        return jsonify({'success': True, 'results': results})
+        return json_response({'success': True, 'results': results, 'source': 'remote'})
     except Exception as e:
         logger.error(f"Search error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/photo/<int:chat_id>')
-def get_profile_photo(chat_id):
+@app.route('/api/photo/<int(signed=True):chat_id>')
+async def get_profile_photo(chat_id):
     """Get profile photo"""
     try:
         if not client_status.get('authenticated'):
             return jsonify({'success': False, 'error': 'Not authenticated'})
             
-        photo_data = run_async_in_thread(
+        photo_data = await await_client(
             telegram_client.get_profile_photo(chat_id),
             timeout=30
         )
         
         if photo_data:
-            return jsonify({'success': True, 'photo': photo_data})
+            return jsonify({'success': True, 'photo': photo_data, 'url': photo_url(chat_id)})
         return jsonify({'success': False, 'error': 'No profile photo'})
     except Exception as e:
         logger.error(f"Get photo error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)})
 
+def photo_url(chat_id, version=None):
+    """Versioned thumbnail URL, safe to cache for a long time"""
+    if version is None:
+        return f"/api/photo/{chat_id}/thumb"
+    return f"/api/photo/{chat_id}/thumb?v={version}"
+
+@app.route('/api/photo/<int(signed=True):chat_id>/thumb')
+async def get_profile_thumb(chat_id):
+    """Serve the small profile photo thumbnail with HTTP caching headers"""
+    try:
+        if not client_status.get('authenticated'):
+            return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+        
+        thumb = await await_client(telegram_client.get_profile_thumb(chat_id), timeout=30)
+        if not thumb:
+            response = jsonify({'success': False, 'error': 'No profile photo'})
+            response.headers['Cache-Control'] = f'private, max-age={PHOTO_NEGATIVE_TTL}'
+            return response, 404
+        
+        path, version = thumb
+        response = await send_file(path, mimetype='image/jpeg', conditional=True)
+        if request.args.get('v') == str(version):
+            response.headers['Cache-Control'] = f'private, max-age={PHOTO_CACHE_MAX_AGE}, immutable'
+        else:
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except Exception as e:
+        logger.error(f"Get photo thumb error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/photos', methods=['POST'])
+async def get_profile_photos():
+    """Resolve thumbnail URLs for many chats in one call (null = no photo)"""
+    try:
+        if not client_status.get('authenticated'):
+            return jsonify({'success': False, 'error': 'Not authenticated'})
+        
+        data = await request.get_json()
+        chat_ids = [int(chat_id) for chat_id in data.get('chat_ids', [])][:PHOTO_BATCH_LIMIT]
+        thumbs = await await_client(telegram_client.get_profile_thumbs(chat_ids), timeout=60)
+        photos = {
+            str(chat_id): photo_url(chat_id, thumb[1]) if thumb else None
+            for chat_id, thumb in thumbs.items()
+        }
+        return json_response({'success': True, 'photos': photos})
+    except Exception as e:
+        logger.error(f"Get photos error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/exports')
+async def list_exports():
+    """Chat exports on disk with their progress"""
+    try:
+        if not client_status.get('authenticated'):
+            return jsonify({'success': False, 'error': 'Not authenticated'})
+        return json_response({'success': True, 'exports': telegram_client.exporter.states()})
+    except Exception as e:
+        logger.error(f"List exports error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/export/<int(signed=True):chat_id>', methods=['POST'])
+async def start_export(chat_id):
+    """Start exporting a chat's history, or resume after the last exported message"""
+    try:
+        if not client_status.get('authenticated'):
+            return jsonify({'success': False, 'error': 'Not authenticated'})
+        cached = telegram_client.dialog_cache.get(chat_id)
+        chat_name = cached['name'] if cached else str(chat_id)
+        return json_response({'success': True, 'export': telegram_client.exporter.start(chat_id, chat_name)})
+    except Exception as e:
+        logger.error(f"Start export error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/export/<int(signed=True):chat_id>/cancel', methods=['POST'])
+async def cancel_export(chat_id):
+    """Stop a running export; it can be resumed later"""
+    try:
+        if not client_status.get('authenticated'):
+            return jsonify({'success': False, 'error': 'Not authenticated'})
+        return jsonify({'success': telegram_client.exporter.cancel(chat_id)})
+    except Exception as e:
+        logger.error(f"Cancel export error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/export/<int(signed=True):chat_id>/files/<path:filename>')
+async def get_export_file(chat_id, filename):
+    """Download an export's messages file, manifest or one of its media files"""
+    try:
+        if not client_status.get('authenticated'):
+            return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+        path = safe_join(telegram_client.exporter.chat_dir(chat_id), filename)
+        if path is None or not os.path.isfile(path) or path.endswith('.part'):
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        return await send_file(
+            path,
+            as_attachment=True,
+            attachment_filename=f"{chat_id}-{os.path.basename(path)}",
+            conditional=True
+        )
+    except Exception as e:
+        logger.error(f"Export file error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def preferred_image_format():
+    """WebP when both the browser and Pillow support it, JPEG otherwise"""
+    if (
+        Image is not None
+        and image_features.check('webp')
+        and 'image/webp' in request.headers.get('Accept', '')
+    ):
+        return 'WEBP'
+    return 'JPEG'
+
+@app.route('/api/media/<int(signed=True):chat_id>/<int:message_id>')
+async def get_media(chat_id, message_id):
+    """Serve a media preview as a size-bounded thumbnail (?w=) or the original (?full=1)"""
+    try:
+        if not client_status.get('authenticated'):
+            return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+        
+        message = await await_client(
+            telegram_client.get_media_message(chat_id, message_id),
+            timeout=30
+        )
+        if message is None:
+            return jsonify({'success': False, 'error': 'Media not found'}), 404
+        
+        full = request.args.get('full', 0, type=int) == 1
+        if full:
+            path, mime = await await_client(telegram_client.get_media_original(message), timeout=300)
+        else:
+            width = request.args.get('w', THUMB_DEFAULT_WIDTH, type=int)
+            image_format = preferred_image_format()
+            path, mime = await await_client(
+                telegram_client.get_media_thumb(message, width, image_format),
+                timeout=120
+            )
+        
+        response = await send_file(path, mimetype=mime, conditional=True)
+        response.headers['Cache-Control'] = f'private, max-age={MEDIA_CACHE_MAX_AGE}'
+        response.headers['Vary'] = 'Accept'
+        return response
+    except FileNotFoundError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except TimeoutError:
+        return jsonify({'success': False, 'error': 'Timeout loading media'}), 504
+    except Exception as e:
+        logger.error(f"Get media error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/stream/<int(signed=True):chat_id>/<int:message_id>')
+async def stream_media(chat_id, message_id):
+    """Serve a video or document with HTTP Range support, downloading only the chunks asked for"""
+    try:
+        if not client_status.get('authenticated'):
+            return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+        
+        message = await await_client(
+            telegram_client.get_media_message(chat_id, message_id),
+            timeout=30
+        )
+        stream_info = telegram_client.get_stream_info(message) if message else None
+        if stream_info is None:
+            return jsonify({'success': False, 'error': 'Media not found'}), 404
+        
+        size, mime = stream_info
+        headers = {
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': f'private, max-age={MEDIA_CACHE_MAX_AGE}'
+        }
+        status = 200
+        start, end = 0, size - 1
+        if request.range:
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                return Response(b'', status=416, headers={'Content-Range': f'bytes */{size}'})
+            start, end = byte_range[0], byte_range[1] - 1
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+        
+        response = Response(
+            telegram_client.iter_media_range(message, start, end),
+            status=status,
+            mimetype=mime,
+            headers=headers
+        )
+        response.timeout = None
+        return response
+    except TimeoutError:
+        return jsonify({'success': False, 'error': 'Timeout loading media'}), 504
+    except Exception as e:
+        logger.error(f"Stream media error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/metrics')
+async def get_metrics():
+    """Prometheus metrics (?format=json gives the summary used by the debug panel)"""
+    if request.args.get('format') == 'json':
+        return json_response({'success': True, **metrics.snapshot()})
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/logout', methods=['POST'])
-def logout():
+async def logout():
     """Logout user"""
     try:
         if telegram_client:
-            run_async_in_thread(telegram_client.logout())
+            await await_client(telegram_client.logout())
         
         client_status.update({
             'connected': False,
@@ -690,6 +3618,7 @@ def logout():
             'username': None,
             'user_id': None
         })
+        set_phase('login_required')
         
         return jsonify({'success': True})
     except Exception as e:
@@ -698,40 +3627,236 @@ def logout():
 
 # WebSocket events
 @socketio.on('connect')
-def handle_connect():
+async def handle_connect(sid, environ):
     """Handle client connection"""
-    emit('status', client_status)
+    await socketio.emit('status', status_payload(), to=sid)
     logger.info("Client connected via WebSocket")
 
+@socketio.on('subscribe_chat')
+async def handle_subscribe_chat(sid, data):
+    """Receive batched updates for an open chat"""
+    chat_id = (data or {}).get('chat_id')
+    if chat_id is not None:
+        await socketio.enter_room(sid, chat_room(int(chat_id)))
+
+async def leave_chat(sid, chat_id):
+    """Leave a chat's room, stopping its prefetch when nobody has the chat open any more"""
+    await socketio.leave_room(sid, chat_room(chat_id))
+    if telegram_client and not telegram_client.batcher.has_subscribers(chat_room(chat_id)):
+        telegram_client.prefetcher.stop(chat_id)
+
+@socketio.on('unsubscribe_chat')
+async def handle_unsubscribe_chat(sid, data):
+    """Stop receiving updates for a chat the client closed"""
+    chat_id = (data or {}).get('chat_id')
+    if chat_id is not None:
+        await leave_chat(sid, int(chat_id))
+
+@socketio.on('subscribe_dialogs')
+async def handle_subscribe_dialogs(sid, data=None):
+    """Receive dialog summary diffs for the sidebar"""
+    await socketio.enter_room(sid, DIALOGS_ROOM)
+
+search_tasks = {}  # sid -> running streaming search
+
+async def run_search(sid, params):
+    """Stream search results to one client in batches"""
+    request_id = params.get('request_id')
+    count = 0
+    
+    async def emit(results):
+        nonlocal count
+        count += len(results)
+        await socketio.emit('search_results', {'request_id': request_id, 'results': results}, to=sid)
+        metrics.inc('socketio_events_total', event='search_results')
+    
+    try:
+        await stream_search(search_params(params), emit)
+        await socketio.emit('search_done', {'request_id': request_id, 'success': True, 'count': count}, to=sid)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Streaming search error: {e}", exc_info=True)
+        await socketio.emit(
+            'search_done',
+            {'request_id': request_id, 'success': False, 'count': count, 'error': str(e)},
+            to=sid
+        )
+    finally:
+        if search_tasks.get(sid) is asyncio.current_task():
+            del search_tasks[sid]
+
+def cancel_search(sid):
+    task = search_tasks.pop(sid, None)
+    if task and not task.done():
+        task.cancel()
+
+@socketio.on('search')
+async def handle_search(sid, data):
+    """Start a streaming search; a new query from the same client cancels the previous one"""
+    data = data or {}
+    cancel_search(sid)
+    error = None
+    if not await wait_until_ready():
+        error = 'Telegram client is still starting'
+    elif not client_status.get('authenticated'):
+        error = 'Not authenticated'
+    elif search_params(data) is None:
+        error = 'Query is required'
+    if error:
+        await socketio.emit(
+            'search_done',
+            {'request_id': data.get('request_id'), 'success': False, 'count': 0, 'error': error},
+            to=sid
+        )
+        return
+    search_tasks[sid] = asyncio.ensure_future(run_search(sid, data))
+
+@socketio.on('cancel_search')
+async def handle_cancel_search(sid, data=None):
+    """Stop the client's running search"""
+    cancel_search(sid)
+
+# Request/response RPC over the socket: {id, method, params, channel}. Results
+# arrive as 'rpc_result' {id, success, ...}; methods that stream also send
+# 'rpc_partial' {id, items} first. A call on a channel supersedes the previous
+# call on the same channel, which is cancelled along with its Telegram requests.
+async def rpc_dialogs(params, partial):
+    return await dialogs_payload(
+        int(params.get('limit') or DIALOG_PAGE_SIZE),
+        params.get('cursor') or None,
+        bool(params.get('refresh')),
+        params.get('since')
+    )
+
+async def rpc_messages(params, partial):
+    return await messages_payload(
+        int(params['chat_id']),
+        params.get('cursor') or None,
+        int(params.get('limit') or HISTORY_PAGE_SIZE),
+        params.get('since')
+    )
+
+async def rpc_send_message(params, partial):
+    return await send_message_payload(params.get('chat_id'), params.get('message'))
+
+async def rpc_search(params, partial):
+    normalized = search_params(params)
+    if normalized is None:
+        return {'success': False, 'error': 'Query is required'}
+    return {'success': True, 'count': await stream_search(normalized, partial)}
+
+async def rpc_photos(params, partial):
+    chat_ids = [int(chat_id) for chat_id in params.get('chat_ids', [])][:PHOTO_BATCH_LIMIT]
+    thumbs = await await_client(telegram_client.get_profile_thumbs(chat_ids), timeout=60)
+    return {
+        'success': True,
+        'photos': {str(chat_id): photo_url(chat_id, thumb[1]) if thumb else None for chat_id, thumb in thumbs.items()}
+    }
+
+RPC_METHODS = {
+    'dialogs': rpc_dialogs,
+    'messages': rpc_messages,
+    'send_message': rpc_send_message,
+    'search': rpc_search,
+    'photos': rpc_photos,
+}
+
+rpc_calls = {}  # sid -> {call id: task}
+rpc_channels = {}  # sid -> {channel: call id}
+
+async def run_rpc(sid, call_id, method, params):
+    """Run one RPC call and send its result to the client that made it"""
+    start = time.perf_counter()
+    status = 'ok'
+    result = None
+    
+    async def partial(items):
+        await socketio.emit('rpc_partial', {'id': call_id, 'items': items}, to=sid)
+        metrics.inc('socketio_events_total', event='rpc_partial')
+    
+    try:
+        if not await wait_until_ready():
+            result = {'success': False, 'error': 'Telegram client is still starting'}
+        elif not client_status.get('authenticated'):
+            result = {'success': False, 'error': 'Not authenticated'}
+        else:
+            result = await RPC_METHODS[method](params, partial)
+    except asyncio.CancelledError:
+        status = 'cancelled'
+        raise
+    except Exception as e:
+        logger.error(f"RPC {method} error: {e}", exc_info=True)
+        result = {'success': False, 'error': str(e)}
+    finally:
+        if rpc_calls.get(sid, {}).get(call_id) is asyncio.current_task():
+            del rpc_calls[sid][call_id]
+        if result is not None and not result.get('success'):
+            status = 'error'
+        metrics.observe('rpc_duration_seconds', time.perf_counter() - start, method=method, status=status)
+    await socketio.emit('rpc_result', {'id': call_id, **result}, to=sid)
+    metrics.inc('socketio_events_total', event='rpc_result')
+
+def cancel_rpc(sid, call_id):
+    task = rpc_calls.get(sid, {}).pop(call_id, None)
+    if task and not task.done():
+        task.cancel()
+
+@socketio.on('rpc')
+async def handle_rpc(sid, data):
+    """Start an RPC call; a call on a channel cancels the one it supersedes"""
+    data = data or {}
+    call_id = data.get('id')
+    method = data.get('method')
+    if method not in RPC_METHODS:
+        await socketio.emit('rpc_result', {'id': call_id, 'success': False, 'error': f'Unknown method: {method}'}, to=sid)
+        return
+    channel = data.get('channel')
+    if channel:
+        channels = rpc_channels.setdefault(sid, {})
+        cancel_rpc(sid, channels.get(channel))
+        channels[channel] = call_id
+    rpc_calls.setdefault(sid, {})[call_id] = asyncio.ensure_future(
+        run_rpc(sid, call_id, method, data.get('params') or {})
+    )
+
+@socketio.on('rpc_cancel')
+async def handle_rpc_cancel(sid, data=None):
+    """Abort an RPC call the client no longer needs"""
+    cancel_rpc(sid, (data or {}).get('id'))
+
 @socketio.on('disconnect')
-def handle_disconnect():
+async def handle_disconnect(sid, *args):
     """Handle client disconnection"""
+    cancel_search(sid)
+    for task in rpc_calls.pop(sid, {}).values():
+        task.cancel()
+    rpc_channels.pop(sid, None)
+    # Rooms are only left after this handler, so leave chat rooms now to stop orphaned prefetches
+    for room in socketio.rooms(sid):
+        if room.startswith('chat:'):
+            await leave_chat(sid, int(room.split(':', 1)[1]))
     logger.info("Client disconnected from WebSocket")
 
 # Error handlers
 @app.errorhandler(404)
-def not_found(e):
+async def not_found(e):
     return jsonify({'error': 'Not found'}), 404
 
 @app.errorhandler(500)
-def server_error(e):
+async def server_error(e):
     logger.error(f"Server error: {e}", exc_info=True)
     return jsonify({'error': 'Internal server error'}), 500
 
+asgi_app = ASGIApp(socketio, instrument_asgi(app))
+
 if __name__ == '__main__':
     # Validate configuration
     if API_ID == "YOUR_API_ID" or API_HASH == "YOUR_API_HASH":
         logger.error("Please configure API_ID and API_HASH")
         sys.exit(1)
     
-    # Initialize client
-    init_telegram_client()
-    
-    # Give client time to initialize
-    import time
-    time.sleep(2)
-    
-    # Start server
+    # Start server (the Telegram client starts with it, on the same event loop)
     logger.info("Starting server on http://0.0.0.0:5000")
     logger.info("Press Ctrl+C to stop the server")
-    socketio.run(app, debug=False, host='0.0.0.0', port=5000, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    uvicorn.run(asgi_app, host='0.0.0.0', port=5000, log_level='info')
@@ -0,0 +1,47 @@
+"""Markdown checks for main.py's fixed messages
+
+main.py starts polling on import, so its constants are read from the source.
+"""
+import ast
+import os
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+
+def module_constant(name):
+    with open(MAIN_PATH, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == name for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise AssertionError(f"{name} not found in main.py")
+
+
+def unbalanced_entities(text):
+    """Legacy Markdown entity markers left open, ignoring anything inside `code`"""
+    open_markers = []
+    in_code = False
+    for char in text:
+        if char == '`':
+            in_code = not in_code
+        elif in_code:
+            continue
+        elif char in '*_':
+            if open_markers and open_markers[-1] == char:
+                open_markers.pop()
+            elif open_markers:
+                return [open_markers[-1], char]  # Entities cannot nest
+            else:
+                open_markers.append(char)
+    return open_markers + (['`'] if in_code else [])
+
+
+def test_unbalanced_entities_detects_stray_markers():
+    assert unbalanced_entities("*bold* and _italic_") == []
+    assert unbalanced_entities("/select FOLDER `*.mp4`") == []
+    assert unbalanced_entities("*bold* /select *.mp4") == ['*']
+    assert unbalanced_entities("`open code") == ['`']
+
+
+def test_help_text_markdown_is_balanced():
+    assert unbalanced_entities(module_constant('HELP_TEXT')) == []